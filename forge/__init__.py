@@ -1 +1,3 @@
 __version__ = '0.7.1'
+
+default_app_config = 'forge.apps.ForgeConfig'
@@ -1,10 +1,42 @@
+from django import forms
 from django.contrib import admin
+from django.core.files.uploadedfile import UploadedFile
 
 from .models import Author, Module, Release
+from .tarball import TarballError, TarballIngest
+
+
+class ReleaseForm(forms.ModelForm):
+
+    class Meta:
+        model = Release
+        fields = '__all__'
+
+    def clean_tarball(self):
+        """
+        Rejects uploaded tarballs that the release couldn't be saved with,
+        before they're written to storage.
+        """
+        tarball = self.cleaned_data.get('tarball')
+        if isinstance(tarball, UploadedFile):
+            ingest = TarballIngest()
+            for chunk in tarball.chunks():
+                ingest.update(chunk)
+            tarball.seek(0)
+            try:
+                ingest.data()
+            except TarballError as e:
+                raise forms.ValidationError(
+                    'Invalid module tarball: %(error)s',
+                    params={'error': e},
+                )
+        return tarball
 
 
 class ReleaseAdmin(admin.ModelAdmin):
+    form = ReleaseForm
     list_display = ('module', 'version')
+    readonly_fields = ('file_md5', 'file_sha256', 'file_size')
     search_fields = ('version',
                      'module__name',
                      'module__author__name',
@@ -14,6 +46,7 @@ class ReleaseAdmin(admin.ModelAdmin):
 
 class ReleaseInline(admin.TabularInline):
     model = Release
+    form = ReleaseForm
     extra = 1
 
 
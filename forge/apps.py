@@ -0,0 +1,12 @@
+from django.apps import AppConfig
+from django.db.models.signals import post_migrate
+
+
+class ForgeConfig(AppConfig):
+    name = 'forge'
+    verbose_name = 'Forge'
+
+    def ready(self):
+        # Connect the signal handlers.
+        from . import signals
+        post_migrate.connect(signals.create_search_index, sender=self)
@@ -1,26 +1,89 @@
+import datetime
 import json
 import logging
+import threading
 import time
 import urllib
 import urlparse
+from collections import deque
+from multiprocessing.pool import ThreadPool
 
 import requests
+from requests.adapters import HTTPAdapter
+from requests.packages.urllib3.util.retry import Retry
 
 from . import __version__
 from . import constants
+from . import metrics
 
 
 logger = logging.getLogger('forge.client')
 
 
+def parse_timestamp(value):
+    """
+    Returns a naive datetime in UTC for the given timestamp from the Forge
+    API, e.g., '2015-08-18 11:23:05 -0700'.
+    """
+    timestamp = datetime.datetime.strptime(value[:19], '%Y-%m-%d %H:%M:%S')
+    offset = value[19:].strip()
+    if offset:
+        sign = -1 if offset[0] == '-' else 1
+        offset = offset.lstrip('+-').replace(':', '')
+        timestamp -= sign * datetime.timedelta(hours=int(offset[:2]),
+                                               minutes=int(offset[2:]))
+    return timestamp
+
+
+class RateLimiter(object):
+
+    def __init__(self, rate, burst=1):
+        """
+        A token bucket rate limiter, that may be shared between threads,
+        allowing `rate` requests per second on average with bursts of up
+        to `burst` requests.
+        """
+        self.rate = float(rate)
+        self.burst = burst
+        self.tokens = float(burst)
+        self.updated = time.time()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        """
+        Waits until a request may be made.
+        """
+        with self.lock:
+            now = time.time()
+            self.tokens = min(self.burst,
+                              self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            # Take a token even when there isn't one available yet, so that
+            # threads waiting at the same time are given successive slots.
+            self.tokens -= 1
+            wait = -self.tokens / self.rate if self.tokens < 0 else 0
+        if wait:
+            time.sleep(wait)
+
+
 class ForgeClient(object):
 
+    # Response status codes that are retried.
+    retry_statuses = (429, 500, 502, 503, 504)
+
     def __init__(self, api_url=constants.PUPPETLABS_FORGE_API_URL,
                  api_version=3, agent_type=None,
-                 throttle=0, verify=True):
+                 throttle=0, verify=True,
+                 pool_size=10, retries=5, backoff=0.5, timeout=(10, 60)):
         """
         This object handles all HTTP requests to the Forge API specfied
         according to the given parameters.
+
+        Requests are made through a persistent session, keeping up to
+        `pool_size` connections alive.  Connection errors, and responses
+        with a status in `retry_statuses`, are retried up to `retries`
+        times with an exponential backoff starting at `backoff` seconds.
+        The `timeout` is a 2-tuple of the connect and read timeouts.
         """
         # Use of Puppet Labs' forge requires a user agent:
         #  https://forgeapi.puppetlabs.com/#user-agent-required
@@ -32,20 +95,43 @@ class ForgeClient(object):
         self.api_url = urlparse.urljoin(api_url, 'v%d/' % api_version)
         self.throttle = throttle
         self.verify = verify
+        self.timeout = timeout
+
+        retry = Retry(total=retries, backoff_factor=backoff,
+                      status_forcelist=self.retry_statuses,
+                      raise_on_status=False)
+        adapter = HTTPAdapter(pool_connections=pool_size,
+                              pool_maxsize=pool_size,
+                              max_retries=retry)
+        self.session = requests.Session()
+        self.session.headers['User-Agent'] = user_agent
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+
+        # The throttle is the average time between requests, shared by
+        # every thread using this client.
+        if throttle:
+            self.rate_limiter = RateLimiter(1.0 / throttle)
+        else:
+            self.rate_limiter = None
 
     def get(self, url, **kwargs):
         kwargs.setdefault('verify', self.verify)
-        kwargs.setdefault('headers', {'User-Agent': self.user_agent})
-        if self.throttle:
-            time.sleep(self.throttle)
-        return requests.get(url, **kwargs)
+        kwargs.setdefault('timeout', self.timeout)
+        if self.rate_limiter:
+            self.rate_limiter.acquire()
+        return self.session.get(url, **kwargs)
 
 
 class ForgeAPI(object):
-    def __init__(self, endpoint, client=None, limit=20, query=None):
+    def __init__(self, endpoint, client=None, limit=20, query=None,
+                 prefetch=0):
         """
         This creates iterable abstraction for the results from the
         given Forge API endpoint.
+
+        When `prefetch` is given, up to that many of the following pages
+        are requested concurrently while iterating over the results.
         """
         # Setting instance variables.
         if client is None:
@@ -55,6 +141,7 @@ class ForgeAPI(object):
         self.endpoint = endpoint
         self.limit = limit
         self.query = query or {}
+        self.prefetch = prefetch
 
         # Joining the client's API URL with that of the given endpoint.
         self.api_url = urlparse.urljoin(self.client.api_url, self.endpoint)
@@ -66,13 +153,39 @@ class ForgeAPI(object):
         self.results = initial_data['results']
 
     def __iter__(self):
-        query = self.query.copy()
-        for idx in xrange(len(self)):
-            if idx >= len(self.results):
-                query['offset'] = idx
-                data = self.request(self.url(**query))
-                self.results.extend(data['results'])
-            yield self.results[idx]
+        for result in self.results:
+            yield result
+
+        # Now that the total is known, the URLs for the rest of the pages
+        # may be generated up front.
+        urls = deque()
+        for offset in xrange(len(self.results), len(self), self.limit):
+            query = self.query.copy()
+            query['offset'] = offset
+            urls.append(self.url(**query))
+
+        if not self.prefetch or len(urls) < 2:
+            for url in urls:
+                for result in self.request(url)['results']:
+                    yield result
+            return
+
+        # Keep up to `prefetch` page requests in flight, yielding each
+        # page's results in order once it arrives; pages aren't kept
+        # once they've been consumed.
+        pool = ThreadPool(self.prefetch)
+        pending = deque()
+        try:
+            while urls or pending:
+                while urls and len(pending) < self.prefetch:
+                    pending.append(
+                        pool.apply_async(self.request, (urls.popleft(),))
+                    )
+                for result in pending.popleft().get()['results']:
+                    yield result
+        finally:
+            pool.terminate()
+            pool.join()
 
     def __len__(self):
         return self.total
@@ -85,6 +198,7 @@ class ForgeAPI(object):
         except Exception as e:
             logger.exception(e)
             raise
+        metrics.inc('forge_sync_pages_fetched_total', endpoint=self.endpoint)
         return json.loads(req.content)
 
     def url(self, **query):
@@ -1,8 +1,16 @@
 import logging
+import operator
+import uuid
 from collections import defaultdict
 
+from django.conf import settings
+from django.core.cache import caches
+from django.db.models import Q
+
+from . import metrics
+from .instrumentation import timed
 from .models import Module, Release
-from .semver import ForgeSpec
+from .semver import VersionIndex, parse_spec
 
 
 logger = logging.getLogger('forge.dependency')
@@ -13,14 +21,112 @@ def release_specs(release):
     comprising the module name and dependency specification as given in the
     release's metadata.
     """
-    return [
-        (depend['name'],
-         depend.get('version_requirement', '>= 0.0.0'))
-        for depend in release.metadata.get('dependencies', [])
-    ]
+    return [(depend.name, depend.spec) for depend in release.dependencies.all()]
+
 
+class ReleaseLoader(object):
+    """
+    Loads modules, and all of their releases, by the legacy module names
+    used in release metadata.  Modules are loaded in batches and held in
+    memory for the duration of a dependency resolution.
 
-def calculate_dependencies(release):
+    When `generations` is true, the cache generation of every module is
+    read before its releases are loaded, into the `generations` dictionary.
+    """
+    # Maximum number of module names to look up in a single query.
+    batch_size = 100
+
+    def __init__(self, generations=False):
+        self.modules = {}
+        self.releases = {}
+        self.indexes = {}
+        self.generations = {} if generations else None
+
+    def load(self, names):
+        """
+        Loads the modules, and their releases, for the given names that
+        haven't been loaded yet.
+        """
+        parsed = {}
+        for name in set(names):
+            if name in self.modules:
+                continue
+            self.modules[name] = None
+            self.releases[name] = []
+            module_key = Module.objects.parse_full_name(name)
+            if module_key:
+                parsed[name] = module_key
+
+        names = list(parsed)
+        for i in xrange(0, len(names), self.batch_size):
+            batch = names[i:i + self.batch_size]
+            query = reduce(operator.or_, [
+                Q(author__name__iexact=parsed[name][0], name=parsed[name][1])
+                for name in batch
+            ])
+            modules = dict(
+                ((module.author.name.lower(), module.name), module)
+                for module in Module.objects.filter(query).select_related(
+                    'author'
+                )
+            )
+
+            if self.generations is not None:
+                # Releases saved from here on change the generations read,
+                # so they can't go unnoticed in cached dependencies.
+                self.generations.update(module_generations(
+                    [module.pk for module in modules.values()]
+                ))
+
+            # The metadata, README and CHANGELOG aren't needed, the
+            # dependencies of the releases are loaded from their own table.
+            module_releases = defaultdict(list)
+            releases = Release.objects.filter(
+                module__in=modules.values()
+            ).defer(
+                'metadata_json', 'readme', 'changelog'
+            ).prefetch_related('dependencies')
+            for release in releases:
+                module_releases[release.module_id].append(release)
+
+            for name in batch:
+                author, module_name = parsed[name]
+                module = modules.get((author.lower(), module_name))
+                if module:
+                    self.modules[name] = module
+                    self.releases[name] = module_releases[module.pk]
+
+    def module(self, name):
+        """
+        Returns the loaded module with the given name.
+        """
+        module = self.modules.get(name)
+        if module is None:
+            raise Exception('Dependency module %s not found' % name)
+        return module
+
+    def module_releases(self, name):
+        """
+        Returns the loaded releases of the module with the given name.
+        """
+        self.module(name)
+        return self.releases[name]
+
+    def module_index(self, name):
+        """
+        Returns a `VersionIndex` of the loaded releases of the module with
+        the given name, for finding the ones matching a specification.
+        """
+        index = self.indexes.get(name)
+        if index is None:
+            index = self.indexes[name] = VersionIndex(
+                (release.version, release)
+                for release in self.module_releases(name)
+            )
+        return index
+
+
+def calculate_dependencies(release, loader=None):
     """
     This function does the heavy lifting of calculating dependencies for the
     given Release instance.  It returns two data structures:
@@ -31,75 +137,168 @@ def calculate_dependencies(release):
      * A cache dictionary mapping a release's primary key it's string
        version requirements as expressed in its metadata (in other words,
        what's returned by `release_specs()` for each release.
+
+    The dependency graph is walked breadth-first, loading the modules,
+    releases and release dependencies for each level of it at once with
+    the given `ReleaseLoader`.
     """
-    # Prime the queue with the given release.
-    queue = set([release])
+    if loader is None:
+        loader = ReleaseLoader()
 
     # Add the given release to the dependency structure, and lock it's
     # version specification at the version of the release.  Use the
     # legacy module name, as that what the Forge uses in its metadata
     # to express dependencies.
+    root_name = release.module.legacy_name
     dependencies = defaultdict(set)
-    dependencies[release.module.legacy_name].add(
-        ForgeSpec(str(release.version))
+    dependencies[root_name].add(
+        parse_spec(str(release.version))
     )
 
     # Create dictionary for mapping of releases to their list of dependency
     # specifications.
     spec_cache = {}
 
-    while queue:
-        # Pop the next release from the queue, and get it's dependency
-        # specifications (caching them for later use).
-        rel = queue.pop()
-        if not rel.pk in spec_cache:
+    # Prime the first level with the given release, as loaded (along with
+    # its dependencies) from its module.
+    loader.load([root_name])
+    level = [rel for rel in loader.releases[root_name] if rel.pk == release.pk]
+    level = level or [release]
+
+    while level:
+        # Get the dependency specifications of every release in this
+        # level (caching them for later use), and collect the ones
+        # that aren't in our datastructure yet.
+        new_specs = []
+        for rel in level:
             spec_cache[rel.pk] = release_specs(rel)
+            for dep_name, dep_spec in spec_cache[rel.pk]:
+                dep_spec = parse_spec(dep_spec)
+                if not dep_spec in dependencies[dep_name]:
+                    dependencies[dep_name].add(dep_spec)
+                    new_specs.append((dep_name, dep_spec))
 
-        for dep_item in spec_cache[rel.pk]:
-            # Pull out the legacy module name, and create a `ForgeSpec`
-            # object from the metadata string.
-            dep_name, dep_spec = dep_item
-            dep_spec = ForgeSpec(dep_spec)
-
-            # When the specification is not in our datastructure yet,
-            # get the corresponding Module, and all Releases that conform
-            # to the specification and add them to the queue.
-            if not dep_spec in dependencies[dep_name]:
-                try:
-                    dep_mod = Module.objects.get_for_full_name(dep_name)
-                except Module.DoesNotExist:
-                    raise Exception('Dependency module %s not found' %
-                                    dep_name)
-
-                dependencies[dep_name].add(dep_spec)
-                for dep_rel in dep_mod.releases.all():
-                    if dep_rel.version in dep_spec:
-                        queue.add(dep_rel)
+        # Load the modules for the new specifications at once, and make
+        # the next level from the releases that conform to them.
+        loader.load(dep_name for dep_name, dep_spec in new_specs)
+        next_level = {}
+        for dep_name, dep_spec in new_specs:
+            for dep_rel in loader.module_index(dep_name).match(dep_spec):
+                if dep_rel.pk not in spec_cache:
+                    next_level[dep_rel.pk] = dep_rel
+        level = next_level.values()
 
     return dependencies, spec_cache
 
 
-def release_dependencies(release):
+@timed('dependencies')
+def resolve_dependencies(release, loader=None):
     """
-    This determines the dependencies for the given module release.
+    Returns a two-tuple comprising the dependencies for the given module
+    release, and the primary keys of every module they're drawn from.
     """
     logger.info('Calculating dependencies for %s' % release)
-    dependency_specs, spec_cache = calculate_dependencies(release)
+    if loader is None:
+        loader = ReleaseLoader()
+    dependency_specs, spec_cache = calculate_dependencies(release, loader)
+    loader.load(dependency_specs)
     dependencies = defaultdict(list)
+    module_ids = set()
 
     for dep_name, specs in dependency_specs.iteritems():
-        try:
-            dep_mod = Module.objects.get_for_full_name(dep_name)
-        except Module.DoesNotExist:
-            raise Exception('Dependency module %s not found' % dep_name)
-
-        releases = []
-        for rel in dep_mod.releases.all():
-            if all([rel.version in spec for spec in specs]):
+        module_ids.add(loader.module(dep_name).pk)
+        # Intersect the releases matching each specification, keeping them
+        # in the order they were loaded.
+        index = loader.module_index(dep_name)
+        matching = None
+        for spec in specs:
+            pks = set(rel.pk for rel in index.match(spec))
+            matching = pks if matching is None else matching & pks
+        for rel in loader.module_releases(dep_name):
+            if rel.pk in matching:
                 dependencies[dep_name].append({
                         'version': str(rel.version),
                         'file': rel.tarball.url,
                         'dependencies': spec_cache[rel.pk],
                 })
 
+    metrics.observe('forge_dependency_modules', len(module_ids))
+    metrics.observe('forge_dependency_releases',
+                    sum(len(rels) for rels in dependencies.values()))
+    return dict(dependencies), module_ids
+
+
+def release_dependencies(release):
+    """
+    This determines the dependencies for the given module release.
+    """
+    return resolve_dependencies(release)[0]
+
+
+## Caching
+
+def dependency_cache():
+    return caches[getattr(settings, 'FORGE_DEPENDENCY_CACHE', 'default')]
+
+
+def generation_key(module_id):
+    return 'forge:module-generation:%d' % module_id
+
+
+def module_generations(module_ids):
+    """
+    Returns a dictionary mapping the given module primary keys to their
+    current generation in the cache, which changes whenever one of the
+    module's releases is saved or deleted.
+    """
+    cache = dependency_cache()
+    keys = dict((generation_key(module_id), module_id)
+                for module_id in module_ids)
+    generations = cache.get_many(keys.keys())
+    missing = [key for key in keys if key not in generations]
+    if missing:
+        for key in missing:
+            cache.add(key, uuid.uuid4().hex, None)
+        generations.update(cache.get_many(missing))
+    return dict((keys[key], generation)
+                for key, generation in generations.items())
+
+
+def invalidate_modules(module_ids):
+    """
+    Invalidates the cached dependencies of every release whose
+    dependencies include the modules with the given primary keys.
+    """
+    dependency_cache().set_many(
+        dict((generation_key(module_id), uuid.uuid4().hex)
+             for module_id in module_ids),
+        None
+    )
+
+
+def cached_release_dependencies(release):
+    """
+    Returns the dependencies for the given module release, from the cache
+    when none of the modules they're drawn from have changed.
+    """
+    cache = dependency_cache()
+    key = 'forge:release-dependencies:%d' % release.pk
+
+    cached = cache.get(key)
+    if cached is not None:
+        generations, dependencies = cached
+        if module_generations(generations.keys()) == generations:
+            metrics.inc('forge_dependency_cache_requests_total',
+                        result='hit')
+            return dependencies
+
+    metrics.inc('forge_dependency_cache_requests_total', result='miss')
+    # The generations are those read before the releases were loaded: if
+    # any were saved while resolving, the result is invalid straight away.
+    loader = ReleaseLoader(generations=True)
+    dependencies, module_ids = resolve_dependencies(release, loader)
+    generations = dict((module_id, loader.generations[module_id])
+                       for module_id in module_ids)
+    cache.set(key, (generations, dependencies),
+              getattr(settings, 'FORGE_DEPENDENCY_CACHE_TIMEOUT', 3600))
     return dependencies
@@ -0,0 +1,131 @@
+"""
+Counts and times the work done while handling a request, by category: SQL
+queries, reading tarballs, hashing, dependency resolution and JSON encoding.
+
+Timings are only collected between `start` and `finish`, which the
+`InstrumentationMiddleware` calls for each request when the
+`FORGE_INSTRUMENTATION` setting is true; otherwise `timer` does nothing.
+"""
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from functools import wraps
+
+from django.db import connections
+
+
+_local = threading.local()
+
+
+class Timings(object):
+    """
+    The number of times, and total seconds, spent on each category of work
+    in a request.
+    """
+
+    def __init__(self):
+        self.start = time.time()
+        self.total = None
+        self.categories = OrderedDict()
+        self.query_logs = {}
+        for connection in connections.all():
+            # Queries are only logged by debug cursors.
+            self.query_logs[connection.alias] = (
+                connection.force_debug_cursor, len(connection.queries_log)
+            )
+            connection.force_debug_cursor = True
+
+    def add(self, category, seconds, count=1):
+        counts = self.categories.setdefault(category, [0, 0.0])
+        counts[0] += count
+        counts[1] += seconds
+
+    def finish(self):
+        self.total = time.time() - self.start
+        for connection in connections.all():
+            if connection.alias not in self.query_logs:
+                continue
+            force_debug_cursor, start = self.query_logs[connection.alias]
+            connection.force_debug_cursor = force_debug_cursor
+            queries = list(connection.queries_log)[start:]
+            if queries:
+                self.add('sql', sum(float(query['time'])
+                                    for query in queries), len(queries))
+
+    def server_timing(self):
+        """
+        Returns the value of the `Server-Timing` header for the timings.
+        """
+        metrics = []
+        for category, (count, seconds) in self.categories.items():
+            if category == 'sql':
+                unit = 'query' if count == 1 else 'queries'
+            else:
+                unit = 'call' if count == 1 else 'calls'
+            metrics.append('%s;dur=%.2f;desc="%d %s"' %
+                           (category, seconds * 1000, count, unit))
+        metrics.append('total;dur=%.2f' % (self.total * 1000))
+        return ', '.join(metrics)
+
+    def log_fields(self):
+        """
+        Returns the timings as `key=value` pairs for logging.
+        """
+        fields = ['total=%.2fms' % (self.total * 1000)]
+        fields.extend(
+            '%s=%d/%.2fms' % (category, count, seconds * 1000)
+            for category, (count, seconds) in self.categories.items()
+        )
+        return ' '.join(fields)
+
+
+def start():
+    """
+    Starts collecting timings for this thread.
+    """
+    _local.timings = Timings()
+    return _local.timings
+
+
+def finish():
+    """
+    Stops collecting timings for this thread, and returns them.
+    """
+    timings = getattr(_local, 'timings', None)
+    _local.timings = None
+    if timings is not None:
+        timings.finish()
+    return timings
+
+
+@contextmanager
+def timer(category):
+    """
+    Context manager that times its block under the given category.
+    """
+    timings = getattr(_local, 'timings', None)
+    if timings is None:
+        yield
+        return
+
+    start_time = time.time()
+    try:
+        yield
+    finally:
+        timings.add(category, time.time() - start_time)
+
+
+def timed(category):
+    """
+    Decorator that times calls of the function under the given category.
+    """
+    def decorator(func):
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            if getattr(_local, 'timings', None) is None:
+                return func(*args, **kwargs)
+            with timer(category):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
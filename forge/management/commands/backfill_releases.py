@@ -0,0 +1,134 @@
+import json
+import logging
+import sys
+from multiprocessing.pool import ThreadPool
+from optparse import make_option
+
+from django.core.management import BaseCommand
+from django.db import transaction
+
+from forge.dependency import invalidate_modules
+from forge.models import CatalogGeneration, Release, ReleaseDependency
+from forge.tarball import tarball_data
+
+
+logger = logging.getLogger('forge.backfill')
+
+
+def release_tarball_data(release_info):
+    """
+    Reads the tarball for the given release primary key and path; this
+    is run in the worker threads and returns a 3-tuple of the primary key,
+    the tarball data (or None), and an error message (or None).
+    """
+    pk, path = release_info
+    try:
+        return pk, tarball_data(path), None
+    except Exception as e:
+        return pk, None, str(e)
+
+
+class Command(BaseCommand):
+    help = (
+        'Populates the digests, size, metadata and dependencies stored for '
+        'releases from their tarballs.'
+    )
+
+    option_list = BaseCommand.option_list + (
+        make_option(
+            '-a', '--all',
+            action='store_true',
+            dest='all',
+            default=False,
+            help=('Process all releases, not just those missing data.'),
+        ),
+        make_option(
+            '-d', '--dependencies',
+            action='store_true',
+            dest='dependencies',
+            default=False,
+            help=('Only rebuild the dependencies of releases from their '
+                  'stored metadata, without reading any tarballs.'),
+        ),
+        make_option(
+            '-w', '--workers',
+            action='store',
+            dest='workers',
+            default=4,
+            type='int',
+            help=('Number of tarballs to process in parallel.'),
+        ),
+    )
+
+    def handle(self, *args, **options):
+        self.verbosity = int(options['verbosity'])
+
+        if options['dependencies']:
+            self.backfill_dependencies()
+        else:
+            self.backfill_tarball_data(options['all'], options['workers'])
+
+    def backfill_dependencies(self):
+        releases = Release.objects.exclude(metadata_json='')
+        count = 0
+        module_ids = set()
+        with transaction.atomic():
+            for pk, module_id, metadata_json in releases.values_list(
+                    'pk', 'module', 'metadata_json').iterator():
+                ReleaseDependency.objects.update_for_release(
+                    pk, json.loads(metadata_json)
+                )
+                module_ids.add(module_id)
+                count += 1
+            CatalogGeneration.objects.bump()
+        # The dependencies cached for releases of these modules (and any
+        # releases depending on them) were resolved from the old rows.
+        invalidate_modules(module_ids)
+        self.log('Updated dependencies for %d releases' % count)
+
+    def backfill_tarball_data(self, all_releases, workers):
+        releases = Release.objects.all()
+        if not all_releases:
+            releases = releases.filter(file_md5='')
+
+        # Tarballs are read in the worker threads, database queries only
+        # happen here in the main thread.
+        release_infos = []
+        release_modules = {}
+        for release in releases.only('pk', 'module', 'tarball').iterator():
+            release_infos.append((release.pk, release.tarball.path))
+            release_modules[release.pk] = release.module_id
+        pool = ThreadPool(max(workers, 1))
+        updated = errors = 0
+        updated_modules = set()
+        try:
+            for pk, data, error in pool.imap_unordered(release_tarball_data,
+                                                       release_infos):
+                if data is None:
+                    errors += 1
+                    self.log('Could not read tarball for release %d: %s' %
+                             (pk, error), error=True)
+                else:
+                    Release.objects.filter(pk=pk).update(**data)
+                    ReleaseDependency.objects.update_for_release(
+                        pk, json.loads(data['metadata_json'])
+                    )
+                    updated_modules.add(release_modules[pk])
+                    updated += 1
+                    self.log('Updated release %d' % pk, verbosity_level=2)
+        finally:
+            pool.close()
+            pool.join()
+
+        if updated:
+            CatalogGeneration.objects.bump()
+            invalidate_modules(updated_modules)
+        self.log('Updated %d releases (%d errors)' % (updated, errors))
+
+    def log(self, msg, error=False, verbosity_level=1):
+        if error:
+            logger.error(msg)
+        else:
+            logger.info(msg)
+        if self.verbosity >= verbosity_level:
+            sys.stdout.write('%s\n' % msg)
@@ -0,0 +1,288 @@
+import datetime
+import json
+import random
+import resource
+import sys
+import time
+from optparse import make_option
+
+import django
+from django.core.cache import caches
+from django.core.management import BaseCommand, CommandError
+from django.core.urlresolvers import reverse
+from django.db import connection
+from django.db.models import Count
+from django.test import Client
+from django.test.utils import CaptureQueriesContext
+from django.utils.http import urlencode
+
+from forge.models import Author, Module, Release, ReleaseDependency
+
+
+def percentile(values, percent):
+    """
+    Returns the given percentile of a sorted list of values, using the
+    nearest-rank method.
+    """
+    if not values:
+        return None
+    rank = int(round(percent / 100.0 * len(values) + 0.5))
+    return values[min(max(rank, 1), len(values)) - 1]
+
+
+def summary(values):
+    values = sorted(values)
+    return {
+        'min': values[0],
+        'mean': sum(values) / float(len(values)),
+        'p50': percentile(values, 50),
+        'p90': percentile(values, 90),
+        'p99': percentile(values, 99),
+        'max': values[-1],
+    }
+
+
+def maxrss():
+    """
+    Returns the peak resident set size of this process so far, in
+    kilobytes; this only ever grows over the life of the process.
+    """
+    usage = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, but OS X reports bytes.
+    if sys.platform == 'darwin':
+        usage //= 1024
+    return usage
+
+
+def rss():
+    """
+    Returns the current resident set size of this process, in kilobytes,
+    or None where it isn't available (it's read from `/proc`).
+    """
+    try:
+        with open('/proc/self/statm') as fh:
+            pages = int(fh.read().split()[1])
+    except (IOError, IndexError, ValueError):
+        return None
+    return pages * resource.getpagesize() // 1024
+
+
+class Command(BaseCommand):
+    help = (
+        'Benchmarks the Forge API endpoints against the current catalog '
+        '(e.g., one made with `generate_catalog`), reporting latency '
+        'percentiles, query counts and memory use for each as JSON.'
+    )
+
+    option_list = BaseCommand.option_list + (
+        make_option(
+            '-n', '--requests',
+            action='store',
+            dest='requests',
+            default=20,
+            type='int',
+            help=('Number of requests to make to each endpoint.'),
+        ),
+        make_option(
+            '-e', '--endpoints',
+            action='store',
+            dest='endpoints',
+            default='',
+            help=('Comma-separated names of the endpoints to benchmark; '
+                  'all of them by default.'),
+        ),
+        make_option(
+            '--warm',
+            action='store_true',
+            dest='warm',
+            default=False,
+            help=('Keep the response and dependency caches between '
+                  'requests, instead of clearing them before each one.'),
+        ),
+        make_option(
+            '-s', '--seed',
+            action='store',
+            dest='seed',
+            default=0,
+            type='int',
+            help=('Seed for choosing the modules and releases requested.'),
+        ),
+        make_option(
+            '-o', '--output',
+            action='store',
+            dest='output',
+            default='',
+            help=('File to write the JSON results to, instead of stdout.'),
+        ),
+        make_option(
+            '-c', '--compare',
+            action='store',
+            dest='compare',
+            default='',
+            help=('JSON results of a previous run to compare with; the '
+                  'change in latency of each endpoint is written to stderr.'),
+        ),
+    )
+
+    def handle(self, *args, **options):
+        self.rng = random.Random(options['seed'])
+        self.warm = options['warm']
+        num_requests = max(options['requests'], 1)
+
+        endpoints = self.endpoints()
+        if options['endpoints']:
+            names = options['endpoints'].split(',')
+            unknown = set(names) - set(endpoints)
+            if unknown:
+                raise CommandError('Unknown endpoints: %s (choose from %s)' %
+                                   (', '.join(sorted(unknown)),
+                                    ', '.join(sorted(endpoints))))
+            endpoints = dict((name, endpoints[name]) for name in names)
+
+        client = Client()
+        results = {
+            'created': datetime.datetime.utcnow().isoformat(),
+            'django': django.get_version(),
+            'database': connection.vendor,
+            'requests': num_requests,
+            'warm': self.warm,
+            'catalog': {
+                'authors': Author.objects.count(),
+                'modules': Module.objects.count(),
+                'releases': Release.objects.count(),
+                'dependencies': ReleaseDependency.objects.count(),
+            },
+            'endpoints': {},
+        }
+        for name in sorted(endpoints):
+            if endpoints[name]:
+                results['endpoints'][name] = self.benchmark(
+                    client, endpoints[name], num_requests
+                )
+
+        output = json.dumps(results, indent=2, sort_keys=True)
+        if options['output']:
+            with open(options['output'], 'w') as fh:
+                fh.write(output + '\n')
+        else:
+            self.stdout.write(output)
+
+        if options['compare']:
+            with open(options['compare']) as fh:
+                self.compare(json.load(fh), results)
+
+    def endpoints(self):
+        """
+        Returns a dictionary mapping the names of the endpoints to the
+        URLs to request from them.
+        """
+        modules = list(Module.objects.filter(
+            current_release__isnull=False
+        ).select_related('author').order_by('pk'))
+        sample = self.rng.sample(modules, min(len(modules), 10))
+
+        # Dependency resolution is slowest for the modules whose current
+        # releases have the most dependencies.
+        dependent = list(Module.objects.annotate(
+            num_dependencies=Count('current_release__dependencies')
+        ).filter(num_dependencies__gt=0).select_related('author').order_by(
+            '-num_dependencies', 'pk'
+        )[:10])
+
+        releases = list(Release.objects.select_related(
+            'module__author'
+        ).order_by('pk')[:1000])
+        tarballs = self.rng.sample(releases, min(len(releases), 10))
+
+        words = set()
+        for module in sample:
+            words.update(module.tag_list)
+        words = sorted(words)[:10]
+
+        return {
+            'modules_json_v1': [reverse('modules_json_v1')],
+            'modules_json_v1_search': [
+                '%s?%s' % (reverse('modules_json_v1'), urlencode({'q': word}))
+                for word in words
+            ],
+            'module_json_v1': [
+                reverse('module_json_v1', kwargs={
+                    'author': module.author.name,
+                    'module_name': module.name,
+                })
+                for module in sample
+            ],
+            'releases_json_v1': [
+                '%s?%s' % (reverse('releases_json_v1'),
+                           urlencode({'module': module.legacy_name}))
+                for module in dependent or sample
+            ],
+            'modules_v3': [
+                '%s?%s' % (reverse('modules_v3'), urlencode({'offset': offset}))
+                for offset in (0, len(modules) // 2)
+            ] if modules else [],
+            'modules_v3_search': [
+                '%s?%s' % (reverse('modules_v3'), urlencode({'query': word}))
+                for word in words
+            ],
+            'releases_v3': [
+                '%s?%s' % (reverse('releases_v3'),
+                           urlencode({'module': module.canonical_name}))
+                for module in sample
+            ],
+            'release_tarball': [release.tarball.url for release in tarballs],
+        }
+
+    def benchmark(self, client, urls, num_requests):
+        """
+        Requests the given URLs in turn, returning the statistics for
+        the endpoint.
+        """
+        latencies = []
+        queries = []
+        statuses = {}
+        start_rss = rss()
+        for i in xrange(num_requests):
+            if not self.warm:
+                for cache in caches.all():
+                    cache.clear()
+            with CaptureQueriesContext(connection) as context:
+                start = time.time()
+                response = client.get(urls[i % len(urls)])
+                if response.streaming:
+                    for chunk in response.streaming_content:
+                        pass
+                elapsed = time.time() - start
+            response.close()
+            latencies.append(elapsed * 1000)
+            queries.append(len(context.captured_queries))
+            status = str(response.status_code)
+            statuses[status] = statuses.get(status, 0) + 1
+
+        # The process's peak memory includes the endpoints benchmarked
+        # before this one, the change in its current memory doesn't.
+        end_rss = rss()
+        return {
+            'urls': len(urls),
+            'statuses': statuses,
+            'latency_ms': summary(latencies),
+            'queries': summary(queries),
+            'rss_kb': end_rss,
+            'rss_increase_kb': (end_rss - start_rss
+                                if end_rss is not None else None),
+            'process_maxrss_kb': maxrss(),
+        }
+
+    def compare(self, baseline, results):
+        self.stderr.write('%-24s %12s %12s %8s' %
+                          ('endpoint', 'base p50 ms', 'p50 ms', 'change'))
+        for name, stats in sorted(results['endpoints'].items()):
+            base = baseline.get('endpoints', {}).get(name)
+            if not base:
+                continue
+            before = base['latency_ms']['p50']
+            after = stats['latency_ms']['p50']
+            self.stderr.write('%-24s %12.2f %12.2f %+7.1f%%' % (
+                name, before, after,
+                (after - before) / before * 100 if before else 0.0
+            ))
@@ -0,0 +1,59 @@
+import logging
+import os
+import sys
+
+from django.core.management import BaseCommand, CommandError
+
+from forge.models import Release, StoredFile
+from forge.storage import ContentAddressedStorage, tarball_storage
+
+
+logger = logging.getLogger('forge.dedupe')
+
+
+class Command(BaseCommand):
+    help = (
+        'Moves release tarballs into the content-addressed storage, so that '
+        'identical tarballs are only stored once.'
+    )
+
+    def handle(self, *args, **options):
+        self.verbosity = int(options['verbosity'])
+
+        if not isinstance(tarball_storage, ContentAddressedStorage):
+            raise CommandError(
+                'The FORGE_STORAGE setting must be set to '
+                'forge.storage.ContentAddressedStorage.'
+            )
+
+        stored_names = set(StoredFile.objects.values_list('name', flat=True))
+        names = [name for name in Release.objects.values_list(
+                 'tarball', flat=True).iterator()
+                 if name not in stored_names]
+
+        stored = duplicates = missing = saved = 0
+        for name in names:
+            path = tarball_storage.legacy_path(name)
+            if not os.path.isfile(path):
+                missing += 1
+                self.log('Tarball not found: %s' % path, error=True)
+                continue
+
+            size = os.path.getsize(path)
+            digest, duplicate = tarball_storage.store_existing(name)
+            stored += 1
+            if duplicate:
+                duplicates += 1
+                saved += size
+            self.log('Stored %s as %s' % (name, digest), verbosity_level=2)
+
+        self.log('Stored %d tarballs, %d duplicates removed (%d bytes), '
+                 '%d missing' % (stored, duplicates, saved, missing))
+
+    def log(self, msg, error=False, verbosity_level=1):
+        if error:
+            logger.error(msg)
+        else:
+            logger.info(msg)
+        if self.verbosity >= verbosity_level:
+            sys.stdout.write('%s\n' % msg)
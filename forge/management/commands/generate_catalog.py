@@ -0,0 +1,288 @@
+import io
+import json
+import logging
+import random
+import sys
+import tarfile
+from optparse import make_option
+
+from django.core.files.base import ContentFile
+from django.core.management import BaseCommand, CommandError
+from django.db import transaction
+
+from forge.models import (Author, CatalogGeneration, Module, Release,
+                          ReleaseDependency, tarball_upload)
+from forge.search import get_backend
+from forge.storage import tarball_storage
+from forge.tarball import TarballIngest
+
+
+logger = logging.getLogger('forge.catalog')
+
+# Words that generated module names, tags and descriptions are made from.
+WORDS = (
+    'apache', 'nginx', 'mysql', 'postgresql', 'java', 'firewall', 'ntp',
+    'ssh', 'docker', 'redis', 'haproxy', 'users', 'sudo', 'logrotate',
+    'collectd', 'rabbitmq', 'memcached', 'zookeeper', 'stdlib', 'concat',
+)
+
+
+def version_history(rng, count):
+    """
+    Returns a list of `count` ascending version strings, mostly patch and
+    minor releases with the occasional new major version.
+    """
+    major, minor, patch = rng.choice(((0, 1, 0), (1, 0, 0)))
+    versions = []
+    for i in xrange(count):
+        versions.append('%d.%d.%d' % (major, minor, patch))
+        bump = rng.random()
+        if bump < 0.05:
+            major, minor, patch = major + 1, 0, 0
+        elif bump < 0.3:
+            minor, patch = minor + 1, 0
+        else:
+            patch += 1
+    return versions
+
+
+def module_tarball(full_name, version, files):
+    """
+    Returns the bytes of a gzipped module tarball with the given (name,
+    content) files in its top-level directory.
+    """
+    top_level = '%s-%s' % (full_name, version)
+    tarball = io.BytesIO()
+    with tarfile.open(fileobj=tarball, mode='w:gz') as tf:
+        for name, content in files:
+            ti = tarfile.TarInfo('%s/%s' % (top_level, name))
+            ti.size = len(content)
+            tf.addfile(ti, io.BytesIO(content))
+    return tarball.getvalue()
+
+
+class Command(BaseCommand):
+    help = (
+        'Generates a synthetic catalog of authors, modules and releases, '
+        'with real tarballs whose metadata depend on other generated '
+        'modules, for benchmarking.'
+    )
+
+    option_list = BaseCommand.option_list + (
+        make_option(
+            '-a', '--authors',
+            action='store',
+            dest='authors',
+            default=50,
+            type='int',
+            help=('Number of authors to generate.'),
+        ),
+        make_option(
+            '-m', '--modules',
+            action='store',
+            dest='modules',
+            default=500,
+            type='int',
+            help=('Number of modules to generate.'),
+        ),
+        make_option(
+            '-r', '--releases',
+            action='store',
+            dest='releases',
+            default=5,
+            type='int',
+            help=('Average number of releases per module; the number for '
+                  'each module is drawn from an exponential distribution.'),
+        ),
+        make_option(
+            '-d', '--depth',
+            action='store',
+            dest='depth',
+            default=3,
+            type='int',
+            help=('Depth of the dependency graph: modules are split into '
+                  'this many levels plus one, each depending on modules '
+                  'from the next level.'),
+        ),
+        make_option(
+            '-f', '--fanout',
+            action='store',
+            dest='fanout',
+            default=2,
+            type='int',
+            help=('Number of modules each release depends on.'),
+        ),
+        make_option(
+            '-p', '--prefix',
+            action='store',
+            dest='prefix',
+            default='author',
+            help=('Prefix of the generated author names.'),
+        ),
+        make_option(
+            '-s', '--seed',
+            action='store',
+            dest='seed',
+            default=0,
+            type='int',
+            help=('Seed for the random number generator, the same seed '
+                  'generates the same catalog.'),
+        ),
+        make_option(
+            '-b', '--batch-size',
+            action='store',
+            dest='batch_size',
+            default=500,
+            type='int',
+            help=('Number of releases to create in each transaction.'),
+        ),
+    )
+
+    def handle(self, *args, **options):
+        self.verbosity = int(options['verbosity'])
+        self.rng = random.Random(options['seed'])
+        self.batch_size = max(options['batch_size'], 1)
+        num_authors = max(options['authors'], 1)
+        num_modules = max(options['modules'], 1)
+        depth = max(options['depth'], 0)
+
+        author_names = ['%s%d' % (options['prefix'], i)
+                        for i in xrange(num_authors)]
+        if Author.objects.filter(name__in=author_names).exists():
+            raise CommandError(
+                'Authors named %s<N> already exist, use a different '
+                '--prefix.' % options['prefix']
+            )
+
+        with transaction.atomic():
+            Author.objects.bulk_create(
+                [Author(name=name) for name in author_names]
+            )
+            authors = list(Author.objects.filter(name__in=author_names))
+            Module.objects.bulk_create([
+                Module(
+                    author=authors[i % num_authors],
+                    name='%s%d' % (WORDS[i % len(WORDS)], i),
+                    tags=' '.join(self.rng.sample(WORDS, 3)),
+                    desc='Installs and manages %s.' % WORDS[i % len(WORDS)],
+                )
+                for i in xrange(num_modules)
+            ])
+            modules = list(
+                Module.objects.filter(author__in=authors).select_related(
+                    'author'
+                ).order_by('pk')
+            )
+        self.log('Created %d authors and %d modules' %
+                 (len(authors), len(modules)))
+
+        # Every module gets a release history, and is assigned to a level
+        # of the dependency graph; releases of modules in one level depend
+        # on modules in the next one.
+        histories = {}
+        for module in modules:
+            count = 1 + int(self.rng.expovariate(
+                1.0 / max(options['releases'] - 1, 0.1)
+            ))
+            histories[module.pk] = version_history(
+                self.rng, min(count, options['releases'] * 10)
+            )
+        levels = [modules[i::depth + 1] for i in xrange(depth + 1)]
+
+        releases = []
+        for level, level_modules in enumerate(levels):
+            next_level = levels[level + 1] if level < depth else []
+            for module in level_modules:
+                for version in histories[module.pk]:
+                    depends = self.rng.sample(
+                        next_level, min(options['fanout'], len(next_level))
+                    )
+                    releases.append((module, version, [
+                        {'name': dep.legacy_name,
+                         'version_requirement':
+                         self.version_requirement(histories[dep.pk])}
+                        for dep in depends
+                    ]))
+
+        created = 0
+        for i in xrange(0, len(releases), self.batch_size):
+            created += self.create_releases(releases[i:i + self.batch_size])
+            self.log('Created %d releases' % created, verbosity_level=2)
+
+        Module.objects.update_current_releases([m.pk for m in modules])
+        get_backend().update(modules)
+        CatalogGeneration.objects.bump()
+        self.log('Created %d releases of %d modules' % (created, len(modules)))
+
+    def version_requirement(self, versions):
+        """
+        Returns a version requirement satisfied by some of the given
+        versions of a module.
+        """
+        major, minor, patch = self.rng.choice(versions).split('.')
+        choice = self.rng.random()
+        if choice < 0.5:
+            return '>= %s.%s.%s < %d.0.0' % (major, minor, patch,
+                                             int(major) + 1)
+        elif choice < 0.7:
+            return '%s.x' % major
+        elif choice < 0.8:
+            return '%s.%s.x' % (major, minor)
+        elif choice < 0.9:
+            return '>= %s.%s.0' % (major, minor)
+        else:
+            return '%s.%s.%s' % (major, minor, patch)
+
+    def create_releases(self, releases):
+        """
+        Saves the tarballs of the given (module, version, dependencies)
+        tuples and creates their releases.
+        """
+        rows = []
+        for module, version, depends in releases:
+            metadata = {
+                'name': module.canonical_name,
+                'version': version,
+                'author': module.author.name,
+                'summary': module.desc,
+                'project_page': 'https://example.com/%s' % module.name,
+                'dependencies': depends,
+            }
+            readme = ('# %s\n\n%s\n' % (module.canonical_name, module.desc))
+            manifest = ('class %s {\n}\n' % module.name)
+            content = module_tarball(module.canonical_name, version, [
+                ('metadata.json', json.dumps(metadata).encode('utf-8')),
+                ('README.md', readme.encode('utf-8')),
+                ('manifests/init.pp', manifest.encode('utf-8')),
+            ])
+
+            release = Release(module=module, version=version)
+            name = tarball_upload(
+                release, '%s-%s.tar.gz' % (module.canonical_name, version)
+            )
+            release.tarball = tarball_storage.save(name, ContentFile(content))
+            ingest = TarballIngest()
+            ingest.update(content)
+            release.set_tarball_data(ingest.data())
+            rows.append((release, metadata))
+
+        with transaction.atomic():
+            Release.objects.bulk_create([release for release, _ in rows])
+            pks = dict(
+                ((module_id, str(version)), pk)
+                for pk, module_id, version in Release.objects.filter(
+                    module__in=set(module for module, _, _ in releases)
+                ).values_list('pk', 'module', 'version')
+            )
+            dependencies = []
+            for release, metadata in rows:
+                dependencies.extend(ReleaseDependency.objects.from_metadata(
+                    pks[(release.module_id, str(release.version))], metadata
+                ))
+            ReleaseDependency.objects.bulk_create(dependencies)
+        return len(rows)
+
+    def log(self, msg, verbosity_level=1):
+        logger.info(msg)
+        if self.verbosity >= verbosity_level:
+            sys.stdout.write('%s\n' % msg)
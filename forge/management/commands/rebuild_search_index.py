@@ -0,0 +1,23 @@
+import sys
+
+from django.core.management import BaseCommand
+from django.db import transaction
+
+from forge.models import Module
+from forge.search import get_backend
+
+
+class Command(BaseCommand):
+    help = (
+        'Creates and rebuilds the module search index.'
+    )
+
+    def handle(self, *args, **options):
+        backend = get_backend()
+        with transaction.atomic():
+            backend.setup()
+            backend.rebuild()
+        if int(options['verbosity']) >= 1:
+            sys.stdout.write('Indexed %d modules with %s\n' %
+                             (Module.objects.count(),
+                              backend.__class__.__name__))
@@ -1,24 +1,39 @@
-import hashlib
 import logging
 import os
 import sys
-import urllib
+import time
 import urlparse
+from collections import deque
 from contextlib import closing
+from multiprocessing.pool import ThreadPool
 from optparse import make_option
 
+import requests
 from django.conf import settings
 from django.core.management import BaseCommand
+from django.db import transaction
 from django.db.models import Count
 
-from forge import constants
-from forge.client import ForgeAPI, ForgeClient
-from forge.models import Author, Module, Release
+from forge import constants, metrics
+from forge.client import ForgeAPI, ForgeClient, parse_timestamp
+from forge.dependency import invalidate_modules
+from forge.models import (Author, CatalogGeneration, Module, Release,
+                          ReleaseDependency, SyncMark)
+from forge.search import get_backend
+from forge.storage import DownloadedFile, tarball_storage
+from forge.tarball import (CHUNK_SIZE, TarballError, TarballIngest,
+                           tarball_data)
 
 
 logger = logging.getLogger('forge.sync')
 
 
+class IncompleteDownload(Exception):
+    """
+    Raised when a connection closes before the whole response was read.
+    """
+
+
 class Command(BaseCommand):
     help = (
         'Syncs with another Puppet Forge.'
@@ -46,7 +61,51 @@ class Command(BaseCommand):
             dest='throttle',
             default=0.5,
             type='float',
-            help=('Time (in seconds) to wait between API requests.'),
+            help=('Average time (in seconds) between API requests.'),
+        ),
+        make_option(
+            '-w', '--workers',
+            action='store',
+            dest='workers',
+            default=1,
+            type='int',
+            help=('Number of release tarballs to download, and API pages '
+                  'to prefetch, in parallel.'),
+        ),
+        make_option(
+            '--retries',
+            action='store',
+            dest='retries',
+            default=5,
+            type='int',
+            help=('Number of times to retry failed API requests and '
+                  'resume interrupted downloads.'),
+        ),
+        make_option(
+            '--timeout',
+            action='store',
+            dest='timeout',
+            default=60,
+            type='float',
+            help=('Time (in seconds) to wait for a response from the '
+                  'Forge API.'),
+        ),
+        make_option(
+            '-b', '--batch-size',
+            action='store',
+            dest='batch_size',
+            default=500,
+            type='int',
+            help=('Number of rows to write to the database in each '
+                  'transaction.'),
+        ),
+        make_option(
+            '-i', '--incremental',
+            action='store_true',
+            dest='incremental',
+            default=False,
+            help=('Only synchronize the modules and releases that have '
+                  'changed since the last incremental sync.'),
         ),
     )
 
@@ -56,14 +115,32 @@ class Command(BaseCommand):
         else:
             self.verbosity = int(options['verbosity'])
 
+        self.workers = max(options['workers'], 1)
+        self.batch_size = max(options['batch_size'], 1)
+        self.retries = options['retries']
         self.client = ForgeClient(api_url=options['api_url'],
-                                  throttle=options['throttle'])
-
-        # Sync authors first, then modules, and finally create releases
-        # after downloading the module tarballs.
-        self.sync_authors()
-        self.sync_modules()
-        self.sync_releases()
+                                  throttle=options['throttle'],
+                                  pool_size=self.workers + 1,
+                                  retries=options['retries'],
+                                  timeout=options['timeout'])
+
+        self.api_url = options['api_url']
+        self.marks = {}
+        self.failures = 0
+        self.load_keys()
+
+        if options['incremental']:
+            # Authors are created as needed for the modules that have
+            # changed, followed by the releases that are new.
+            self.sync_modules(incremental=True)
+            self.sync_releases(incremental=True)
+        else:
+            # Sync authors first, then modules, and finally create releases
+            # after downloading the module tarballs.
+            self.sync_authors()
+            self.sync_modules()
+            self.sync_releases()
+        metrics.set_gauge('forge_sync_last_run_timestamp_seconds', time.time())
 
     def log(self, msg, error=False, verbosity_level=1):
         if error:
@@ -73,130 +150,577 @@ class Command(BaseCommand):
         if self.verbosity >= verbosity_level:
             sys.stdout.write('%s\n' % msg)
 
-    def sync_authors(self):
-        self.users_api = ForgeAPI('users', client=self.client)
+    def load_keys(self):
+        """
+        Loads the keys of the existing authors, modules and releases, so
+        that new ones may be found without querying for every item.
+        """
+        # Author names are matched case-insensitively, like their
+        # natural keys.
+        self.authors = dict(
+            (name.lower(), pk)
+            for pk, name in Author.objects.values_list('pk', 'name')
+        )
+        self.modules = dict(
+            ((author_id, name), (pk, tags, desc))
+            for pk, author_id, name, tags, desc in Module.objects.values_list(
+                'pk', 'author', 'name', 'tags', 'desc').iterator()
+        )
+        self.releases = set(
+            (module_id, str(version))
+            for module_id, version in Release.objects.values_list(
+                'module', 'version').iterator()
+        )
+
+    def batches(self, items):
+        """
+        Yields lists of up to `batch_size` of the given items.
+        """
+        batch = []
+        for item in items:
+            batch.append(item)
+            if len(batch) >= self.batch_size:
+                yield batch
+                batch = []
+        if batch:
+            yield batch
+
+    def log_rate(self, name, count, start):
+        elapsed = time.time() - start
+        self.log('Synchronized %d %s in %.1fs (%.1f rows/sec)' %
+                 (count, name, elapsed, count / elapsed if elapsed else 0))
+
+    def create_authors(self, names):
+        """
+        Creates the authors with the given names that don't exist yet,
+        returning the number created.
+        """
+        new_names = []
+        for name in names:
+            if name.lower() not in self.authors:
+                # Marks the author as pending, in case of duplicates.
+                self.authors[name.lower()] = None
+                new_names.append(name)
+        if not new_names:
+            return 0
+
+        Author.objects.bulk_create([Author(name=name) for name in new_names])
+        for pk, name in Author.objects.filter(
+                name__in=new_names).values_list('pk', 'name'):
+            self.authors[name.lower()] = pk
+        CatalogGeneration.objects.bump()
+        metrics.inc('forge_sync_rows_created_total', len(new_names),
+                    table='authors')
+        for name in new_names:
+            self.log('Created Author: %s' % name)
+        return len(new_names)
 
-        for user in self.users_api:
-            if user['module_count'] > 0:
-                author, created = Author.objects.get_or_create(
-                    name=user['username']
+    def sync_authors(self):
+        self.users_api = ForgeAPI('users', client=self.client,
+                                  prefetch=self.workers)
+
+        start = time.time()
+        count = 0
+        users = (user['username'] for user in self.users_api
+                 if user['module_count'] > 0)
+        for names in self.batches(users):
+            with transaction.atomic():
+                count += self.create_authors(names)
+        self.log_rate('authors', count, start)
+
+    def since_mark(self, endpoint, items, timestamp):
+        """
+        Yields the given items from the endpoint (sorted from newest to
+        oldest) until reaching those older than the endpoint's high-water
+        mark, as returned by the `timestamp` function for each item.  The
+        newest timestamp seen is kept for `save_mark`.
+        """
+        mark = SyncMark.objects.get_mark(self.api_url, endpoint)
+        for item in items:
+            item_timestamp = timestamp(item)
+            if mark and item_timestamp < mark:
+                break
+            if (endpoint not in self.marks or
+                    item_timestamp > self.marks[endpoint]):
+                self.marks[endpoint] = item_timestamp
+            yield item
+
+    def save_mark(self, endpoint):
+        """
+        Saves the high-water mark for the endpoint, once all of its items
+        have been synchronized.
+        """
+        if endpoint in self.marks:
+            SyncMark.objects.set_mark(self.api_url, endpoint,
+                                      self.marks[endpoint])
+            self.log('Synchronized %s up to %s' %
+                     (endpoint, self.marks[endpoint]))
+
+    def sync_modules(self, incremental=False):
+        if incremental:
+            self.modules_api = ForgeAPI(
+                'modules', client=self.client, prefetch=self.workers,
+                query={'sort_by': 'latest_release'}
+            )
+            modules = self.since_mark(
+                'modules', self.modules_api,
+                lambda mod: parse_timestamp(
+                    mod['current_release']['created_at']
                 )
-                if created:
-                    self.log('Created Author: %s' % author)
-
-    def sync_modules(self):
-        self.modules_api = ForgeAPI('modules', client=self.client)
-
-        for mod in self.modules_api:
-            module, created = Module.objects.get_or_create(
-                author=Author.objects.get_by_natural_key(mod['owner']['username']),
-                name=mod['name']
             )
-            if created:
-                msg = 'Created Module: %s' % module
-                self.log(msg)
-
+        else:
+            self.modules_api = ForgeAPI('modules', client=self.client,
+                                        prefetch=self.workers)
+            modules = self.modules_api
+
+        start = time.time()
+        count = 0
+        for mods in self.batches(modules):
+            with transaction.atomic():
+                count += self.update_modules(mods)
+        self.log_rate('modules', count, start)
+
+        if incremental:
+            self.save_mark('modules')
+
+    def update_modules(self, mods):
+        """
+        Creates or updates the modules for the given module data, returning
+        the number of modules that were changed.
+        """
+        # Authors are created as needed for incremental syncs, which
+        # don't synchronize all authors first.
+        self.create_authors([mod['owner']['username'] for mod in mods])
+
+        new_modules = {}
+        changed = []
+        for mod in mods:
+            author_name = mod['owner']['username']
+            key = (self.authors[author_name.lower()], mod['name'])
             desc = mod['current_release']['metadata'].get('description', '')
             tags = ' '.join(mod['current_release']['tags'])
 
-            if tags != module.tags or desc != module.desc:
-                if not created:
-                    if tags != module.tags:
-                        self.log(
-                            '\n'.join(
-                                [' Tags Differ:',
-                                 '  Old: %s' % module.tags,
-                                 '  New: %s' % tags]),
-                            verbosity_level=2
-                        )
-
-                    if desc != module.desc:
-                        self.log(
-                            '\n'.join(
-                                [' Descriptions Differ:',
-                                 '  Old: %s' % module.desc,
-                                 '  New: %s' % desc]),
-                            verbosity_level=2
-                        )
-
-                module.tags = tags
-                module.desc = desc
-                module.save()
-
-                if not created:
-                    self.log('Updated Module: %s' % module)
+            if key not in self.modules or key in new_modules:
+                new_modules[key] = Module(author_id=key[0], name=key[1],
+                                          tags=tags, desc=desc)
+                self.modules[key] = (None, tags, desc)
+                self.log('Created Module: %s-%s' %
+                         (author_name.lower(), mod['name'].lower()))
+                continue
+
+            pk, old_tags, old_desc = self.modules[key]
+            if tags != old_tags or desc != old_desc:
+                if tags != old_tags:
+                    self.log(
+                        '\n'.join(
+                            [' Tags Differ:',
+                             '  Old: %s' % old_tags,
+                             '  New: %s' % tags]),
+                        verbosity_level=2
+                    )
 
+                if desc != old_desc:
+                    self.log(
+                        '\n'.join(
+                            [' Descriptions Differ:',
+                             '  Old: %s' % old_desc,
+                             '  New: %s' % desc]),
+                        verbosity_level=2
+                    )
 
-    def sync_releases(self):
-        # Only synchronize releases from authors that have released at least
-        # one Puppet module.  Querying the releases by author should make it
-        # so that less total API calls are requested of the remote forge.
-        module_authors = Author.objects.annotate(
+                Module.objects.filter(pk=pk).update(tags=tags, desc=desc)
+                self.modules[key] = (pk, tags, desc)
+                changed.append(pk)
+                self.log('Updated Module: %s-%s' %
+                         (author_name.lower(), mod['name'].lower()))
+
+        if new_modules:
+            Module.objects.bulk_create(new_modules.values())
+            metrics.inc('forge_sync_rows_created_total', len(new_modules),
+                        table='modules')
+            for pk, author_id, name in Module.objects.filter(
+                    author__in=set(key[0] for key in new_modules),
+                    name__in=set(key[1] for key in new_modules)
+            ).values_list('pk', 'author', 'name'):
+                if (author_id, name) in new_modules:
+                    _, tags, desc = self.modules[(author_id, name)]
+                    self.modules[(author_id, name)] = (pk, tags, desc)
+                    changed.append(pk)
+
+        # Bulk writes don't send the signals that index modules and bump
+        # the catalog generation.
+        if changed:
+            CatalogGeneration.objects.bump()
+            get_backend().update(
+                Module.objects.select_related('author').filter(pk__in=changed)
+            )
+        return len(changed)
+
+    def author_releases(self):
+        """
+        Yields the data for every release of the authors that have released
+        at least one Puppet module.
+        """
+        # Querying the releases by author should make it so that less
+        # total API calls are requested of the remote forge.
+        module_authors = list(Author.objects.annotate(
             num_modules=Count('module')
-        ).filter(num_modules__gt=0).distinct()
-
-        for author in module_authors.iterator():
-            author_name = author.name.lower()
-            alpha = author_name[0].lower()
+        ).filter(num_modules__gt=0).distinct().values_list('name', flat=True))
 
+        for author_name in module_authors:
             releases_api = ForgeAPI(
-                'releases', client=self.client,
-                query={'owner': author_name,
+                'releases', client=self.client, prefetch=self.workers,
+                query={'owner': author_name.lower(),
                        'sort_by': 'release_date'}
             )
-
             for rel in releases_api:
+                yield rel
+
+    def new_releases(self):
+        """
+        Yields the data for the releases made since the last incremental
+        sync.
+        """
+        releases_api = ForgeAPI(
+            'releases', client=self.client, prefetch=self.workers,
+            query={'sort_by': 'release_date'}
+        )
+        return self.since_mark(
+            'releases', releases_api,
+            lambda rel: parse_timestamp(rel['created_at'])
+        )
+
+    def sync_releases(self, incremental=False):
+        if incremental:
+            releases = self.new_releases()
+        else:
+            releases = self.author_releases()
+
+        # Tarballs are downloaded and read by a pool of worker threads,
+        # while the releases are created here in the main thread, in
+        # batches, once their download has completed.
+        # Tarballs are downloaded to a directory of their own, and moved
+        # into the tarball storage when their releases are created.
+        self.download_dir = os.path.join(settings.MEDIA_ROOT, '.downloads')
+        if not os.path.isdir(self.download_dir):
+            os.makedirs(self.download_dir, mode=0755)
+
+        start = time.time()
+        self.created = 0
+        pool = ThreadPool(self.workers)
+        pending = deque()
+        completed = []
+        try:
+            for rel in releases:
+                author_name = rel['module']['owner']['username'].lower()
+                module_key = (self.authors.get(author_name),
+                              rel['module']['name'])
+                if module_key not in self.modules:
+                    self.log('Module not found for release: %s' %
+                             rel['file_uri'], error=True)
+                    self.failures += 1
+                    continue
+
+                module_id = self.modules[module_key][0]
+                if (module_id, rel['version']) in self.releases:
+                    continue
+                self.releases.add((module_id, rel['version']))
+
+                alpha = author_name[0].lower()
                 tarball = os.path.basename(rel['file_uri'])
 
-                # TODO: Change to v3 compatible file structure, this is using the
-                #  the same structure that v1 does.
+                # TODO: Change to v3 compatible file structure, this is
+                #  using the the same structure that v1 does.
                 upload_to = '/'.join([alpha, author_name, tarball])
-                destination = os.path.join(settings.MEDIA_ROOT, upload_to)
-                destination_tmp = destination + '.tmp'
 
-                dest_dir = os.path.dirname(destination)
-                if not os.path.isdir(dest_dir):
-                    os.makedirs(dest_dir, mode=0755)
-
-                if not os.path.isfile(destination):
-                    tarball_url = urlparse.urljoin(
-                        self.client.api_url, rel['file_uri']
-                    )
-
-                    file_md5 = hashlib.md5()
-                    with open(destination_tmp, 'wb') as tb_h:
-                        with closing(self.client.get(tarball_url, stream=True)) as req:
-                            for chunk in req:
-                                if chunk:
-                                    tb_h.write(chunk)
-                                    file_md5.update(chunk)
-
-                    if file_md5.hexdigest() == rel['file_md5']:
-                        os.rename(destination_tmp, destination)
-                        self.log('Downloaded Release: %s' % tarball)
-                    else:
-                        os.remove(destination_tmp)
-                        self.log(
-                            'Downloaded corrupt data from: %s' % tarball_url,
-                            error=True
+                if tarball_storage.exists(upload_to):
+                    # The tarball was stored by an earlier sync, it only
+                    # needs to be read.
+                    pending.append((
+                        module_id, rel, upload_to, None,
+                        pool.apply_async(tarball_data, (
+                            tarball_storage.path(upload_to),
+                        ))
+                    ))
+                else:
+                    download_path = os.path.join(self.download_dir, tarball)
+                    pending.append((
+                        module_id, rel, upload_to, download_path,
+                        pool.apply_async(self.fetch, (rel, download_path))
+                    ))
+
+                # Collect the completed downloads, bounding the number of
+                # downloads queued, and create their releases in batches.
+                while pending and (pending[0][-1].ready() or
+                                   len(pending) > 2 * self.workers):
+                    self.finish_download(completed, *pending.popleft())
+                if len(completed) >= self.batch_size:
+                    self.create_releases(completed)
+                    completed = []
+
+            while pending:
+                self.finish_download(completed, *pending.popleft())
+            for batch in self.batches(completed):
+                self.create_releases(batch)
+        finally:
+            pool.terminate()
+            pool.join()
+        self.log_rate('releases', self.created, start)
+
+        # Releases that failed to download will be retried by the next
+        # incremental sync when the mark isn't moved past them.
+        if incremental and not self.failures:
+            self.save_mark('releases')
+
+    def fetch(self, rel, destination):
+        """
+        Downloads the tarball for the given release, unless it's already
+        been downloaded, returning its data or None if it couldn't be
+        downloaded; this is called from the worker threads, and must not
+        use the database.
+        """
+        if os.path.isfile(destination):
+            return tarball_data(destination)
+        return self.download(rel, destination)
+
+    def download(self, rel, destination):
+        """
+        Downloads the tarball for the given release to its destination,
+        returning its data, read as it was downloaded, or None if it
+        couldn't be downloaded; this is called from the worker threads,
+        and must not use the database.
+
+        The tarball is downloaded to a temporary file first, and downloads
+        resume from what's already in it, whether it was left by a dropped
+        connection or by an earlier sync that was interrupted.
+        """
+        destination_tmp = destination + '.tmp'
+        tarball_url = urlparse.urljoin(self.client.api_url, rel['file_uri'])
+
+        attempts = 0
+        while True:
+            try:
+                ingest, resumed = self.download_range(tarball_url,
+                                                      destination_tmp)
+            except (requests.ConnectionError, requests.Timeout,
+                    requests.exceptions.ChunkedEncodingError,
+                    IncompleteDownload) as e:
+                # Keep the partial download for the next attempt, or the
+                # next sync.
+                attempts += 1
+                if attempts > self.retries:
+                    raise
+                self.log('Resuming download of %s: %s' % (tarball_url, e),
+                         verbosity_level=2)
+                continue
+
+            if ingest.md5.hexdigest() == rel['file_md5']:
+                os.rename(destination_tmp, destination)
+                self.log('Downloaded Release: %s' %
+                         os.path.basename(destination))
+                try:
+                    return ingest.data()
+                except TarballError as e:
+                    raise TarballError('%s in: %s' % (e, destination))
+
+            os.remove(destination_tmp)
+            metrics.inc('forge_sync_md5_failures_total')
+            if resumed:
+                # The partial download may have been of a different file,
+                # try again from the start.
+                self.log('Restarting download of %s' % tarball_url,
+                         verbosity_level=2)
+                continue
+
+            self.log(
+                'Downloaded corrupt data from: %s' % tarball_url,
+                error=True
+            )
+            return None
+
+    def download_range(self, url, path):
+        """
+        Downloads the given URL to the path, requesting only the range
+        after the bytes already in the file; returns a 2-tuple of the
+        `TarballIngest` that read the whole file and whether the download
+        was resumed.
+        """
+        ingest = TarballIngest()
+        offset = 0
+        if os.path.isfile(path):
+            with open(path, 'rb') as fh:
+                for chunk in iter(lambda: fh.read(CHUNK_SIZE), b''):
+                    ingest.update(chunk)
+                    offset += len(chunk)
+
+        headers = {}
+        if offset:
+            headers['Range'] = 'bytes=%d-' % offset
+
+        with closing(self.client.get(url, headers=headers,
+                                     stream=True)) as req:
+            if offset and req.status_code == 416:
+                # The file was already completely downloaded.
+                return ingest, True
+            req.raise_for_status()
+
+            if req.status_code != 206:
+                # The server sent the whole file.
+                ingest = TarballIngest()
+                offset = 0
+
+            expected = req.headers.get('Content-Length')
+            received = 0
+            with open(path, 'ab' if offset else 'wb') as fh:
+                for chunk in req.iter_content(CHUNK_SIZE):
+                    fh.write(chunk)
+                    ingest.update(chunk)
+                    received += len(chunk)
+
+        metrics.inc('forge_sync_downloaded_bytes_total', received)
+        if expected is not None and received < int(expected):
+            raise IncompleteDownload('received %d of %s bytes' %
+                                     (received, expected))
+        return ingest, bool(offset)
+
+    def finish_download(self, completed, module_id, rel, upload_to,
+                        download_path, result):
+        """
+        Waits for the download of a release's tarball, adding the release
+        (and the path its tarball was downloaded to, if it was) to those to
+        be created if it was successful.
+        """
+        try:
+            data = result.get()
+        except Exception as e:
+            self.log('Could not download %s: %s' % (rel['file_uri'], e),
+                     error=True)
+            data = None
+
+        if data is None:
+            self.failures += 1
+            return
+
+        try:
+            release = Release(module_id=module_id, version=rel['version'],
+                              tarball=upload_to, **data)
+        except Exception:
+            self.log('Could not create release for: %s version %s\n' %
+                     (rel['module']['name'], rel['version']), error=True)
+            self.failures += 1
+        else:
+            completed.append((release, download_path))
+
+    def store_tarballs(self, completed):
+        """
+        Moves the downloaded tarballs of the given releases into the tarball
+        storage, returning the releases (and download paths) whose tarballs
+        are stored.
+        """
+        stored = []
+        for release, download_path in completed:
+            if download_path:
+                try:
+                    downloaded = DownloadedFile(download_path,
+                                                sha256=release.file_sha256)
+                    with closing(downloaded):
+                        release.tarball.name = tarball_storage.save(
+                            release.tarball.name, downloaded
                         )
-                        continue
-
-                # Get corresponding module.
-                module = Module.objects.get(
-                    author=author, name=rel['module']['name']
-                )
-
-                # Creating Release now download is completed.
+                except Exception as e:
+                    self.log('Could not store tarball for: %s: %s' %
+                             (os.path.basename(release.tarball.name), e),
+                             error=True)
+                    self.failures += 1
+                    continue
+            stored.append((release, download_path))
+        return stored
+
+    def insert_releases(self, releases):
+        """
+        Inserts the given releases, along with their dependencies, and
+        updates their modules' current releases; returns the number of
+        dependencies inserted.  This should be run in a transaction.
+        """
+        module_ids = set(release.module_id for release in releases)
+        Release.objects.bulk_create(releases)
+
+        # Retrieve the primary keys of the new releases.
+        release_ids = {}
+        for pk, module_id, version in Release.objects.filter(
+                module__in=module_ids,
+                version__in=set(str(release.version) for release in releases)
+        ).values_list('pk', 'module', 'version'):
+            release_ids[(module_id, str(version))] = pk
+
+        # Bulk writes don't call `Release.save` or send signals, so
+        # do what they would have for all of the releases at once.
+        dependencies = []
+        for release in releases:
+            release.pk = release_ids[(release.module_id,
+                                      str(release.version))]
+            dependencies.extend(ReleaseDependency.objects.from_metadata(
+                release.pk, release.metadata
+            ))
+        ReleaseDependency.objects.bulk_create(dependencies)
+        Module.objects.update_current_releases(module_ids)
+        CatalogGeneration.objects.bump()
+        return len(dependencies)
+
+    def create_releases(self, completed):
+        """
+        Creates the given releases, storing their downloaded tarballs, along
+        with their dependencies, and updates their modules' current
+        releases.
+
+        The releases are inserted in one transaction; if that fails, they're
+        inserted one at a time, so that only the releases that can't be
+        created are lost (and their stored tarballs removed).
+        """
+        completed = self.store_tarballs(completed)
+        if not completed:
+            return
+
+        releases = [release for release, download_path in completed]
+        try:
+            with transaction.atomic():
+                dependencies = self.insert_releases(releases)
+        except Exception as e:
+            self.log('Could not create %d releases at once, creating them '
+                     'one at a time: %s' % (len(releases), e), error=True)
+            releases = []
+            dependencies = 0
+            for release, download_path in completed:
+                # The primary key may have been set before the rollback.
+                release.pk = None
                 try:
-                    release, created = Release.objects.get_or_create(
-                        module=module, version=rel['version'], tarball=upload_to
-                    )
-                    if created:
-                        self.log('Created Release: %s' % release)
+                    with transaction.atomic():
+                        dependencies += self.insert_releases([release])
                 except Exception as e:
-                    err_msg = (
-                        'Could not create release for: %s version %s\n' %
-                        (module, rel['version'])
-                    )
-                    self.log(err_msg, error=True)
+                    self.log('Could not create release for: %s: %s' %
+                             (os.path.basename(release.tarball.name), e),
+                             error=True)
+                    self.failures += 1
+                    self.remove_tarball(release, download_path)
+                else:
+                    releases.append(release)
+
+        invalidate_modules(set(release.module_id for release in releases))
+        metrics.inc('forge_sync_rows_created_total', len(releases),
+                    table='releases')
+        metrics.inc('forge_sync_rows_created_total', dependencies,
+                    table='dependencies')
+
+        for release in releases:
+            self.log('Created Release: %s' %
+                     os.path.basename(release.tarball.name))
+        self.created += len(releases)
+
+    def remove_tarball(self, release, download_path):
+        """
+        Removes the tarball stored for a release that couldn't be created,
+        if it was downloaded and no other release uses it.
+        """
+        if download_path and not Release.objects.filter(
+                tarball=release.tarball.name).exists():
+            tarball_storage.delete(release.tarball.name)
@@ -0,0 +1,18 @@
+import sys
+
+from django.core.management import BaseCommand
+
+from forge.models import CatalogGeneration, Module
+
+
+class Command(BaseCommand):
+    help = (
+        'Recomputes the current release of every module.'
+    )
+
+    def handle(self, *args, **options):
+        updated = Module.objects.update_current_releases()
+        if updated:
+            CatalogGeneration.objects.bump()
+        if int(options['verbosity']) >= 1:
+            sys.stdout.write('Updated %d modules\n' % updated)
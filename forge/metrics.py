@@ -0,0 +1,320 @@
+"""
+Prometheus metrics for the Forge and `sync_forge`.
+
+Metrics are only recorded when the `FORGE_METRICS` setting is true.  They're
+kept in an SQLite database in the `FORGE_METRICS_DIR` directory, which is
+shared by every process using it (e.g., the workers of a gunicorn server and
+`sync_forge`), so that `/metrics` reports the totals for all of them.
+"""
+import logging
+import os
+import sqlite3
+import threading
+from collections import OrderedDict, defaultdict
+
+from django.conf import settings
+
+
+logger = logging.getLogger('forge.metrics')
+
+COUNTER = 'counter'
+GAUGE = 'gauge'
+HISTOGRAM = 'histogram'
+
+# Buckets, in seconds, for request latencies.
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0,
+                   10.0)
+
+# Buckets for the number of modules and releases in resolved dependencies.
+SIZE_BUCKETS = (1, 2, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000)
+
+# The type, help text and (for histograms) buckets of every metric.
+METRICS = OrderedDict([
+    ('forge_http_requests_total', (
+        COUNTER, 'Requests handled, by URL name, method and status.', None)),
+    ('forge_http_request_duration_seconds', (
+        HISTOGRAM, 'Time taken to handle requests, by URL name.',
+        LATENCY_BUCKETS)),
+    ('forge_response_cache_hits_total', (
+        COUNTER, 'Responses served from the response cache, by view.', None)),
+    ('forge_response_cache_misses_total', (
+        COUNTER, 'Responses missing from the response cache, by view.', None)),
+    ('forge_response_cache_hit_ratio', (
+        GAUGE, 'Ratio of cached responses to all responses, by view.', None)),
+    ('forge_dependency_cache_requests_total', (
+        COUNTER, 'Lookups of cached release dependencies, by result.', None)),
+    ('forge_dependency_modules', (
+        HISTOGRAM, 'Number of modules in resolved release dependencies.',
+        SIZE_BUCKETS)),
+    ('forge_dependency_releases', (
+        HISTOGRAM, 'Number of releases in resolved release dependencies.',
+        SIZE_BUCKETS)),
+    ('forge_sync_pages_fetched_total', (
+        COUNTER, 'Pages of results fetched from the Forge API, by '
+        'endpoint.', None)),
+    ('forge_sync_downloaded_bytes_total', (
+        COUNTER, 'Bytes of release tarballs downloaded.', None)),
+    ('forge_sync_md5_failures_total', (
+        COUNTER, 'Downloaded tarballs that failed their MD5 check.', None)),
+    ('forge_sync_rows_created_total', (
+        COUNTER, 'Rows created by sync_forge, by table.', None)),
+    ('forge_sync_last_run_timestamp_seconds', (
+        GAUGE, 'Time that sync_forge last finished.', None)),
+])
+
+_stores = {}
+_stores_lock = threading.Lock()
+
+
+def enabled():
+    return getattr(settings, 'FORGE_METRICS', False)
+
+
+def metrics_path():
+    metrics_dir = getattr(settings, 'FORGE_METRICS_DIR', None)
+    if not metrics_dir:
+        metrics_dir = os.path.join(settings.FORGE_ROOT, 'metrics')
+    return os.path.join(metrics_dir, 'metrics.db')
+
+
+def format_labels(labels):
+    """
+    Returns the given labels formatted for the Prometheus text format,
+    sorted so that the same labels always give the same string.
+    """
+    return ','.join(
+        '%s="%s"' % (key, unicode(value).replace('\\', r'\\').replace(
+            '"', r'\"').replace('\n', r'\n'))
+        for key, value in sorted(labels.items())
+    )
+
+
+def format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    if value == int(value):
+        return '%d' % value
+    return repr(value)
+
+
+class MetricsStore(object):
+    """
+    Metric values in an SQLite database.  Counters and histogram buckets
+    are increments to the stored values, so that the updates of every
+    process add up; gauges are set to the last value given.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.local = threading.local()
+
+    def connection(self):
+        # Connections can't be shared by threads, or by processes forked
+        # after they're opened.
+        connection = getattr(self.local, 'connection', None)
+        if connection is None or self.local.pid != os.getpid():
+            directory = os.path.dirname(self.path)
+            if not os.path.isdir(directory):
+                try:
+                    os.makedirs(directory)
+                except OSError:
+                    # Another process may have created it.
+                    if not os.path.isdir(directory):
+                        raise
+            # Transactions are begun explicitly, see `update`.
+            connection = sqlite3.connect(self.path, timeout=10,
+                                         isolation_level=None)
+            # Changing the journal mode needs an exclusive lock, so it's
+            # only done by the first processes to open the database; the
+            # mode is kept in the database once one of them has changed it.
+            mode = connection.execute('PRAGMA journal_mode').fetchone()[0]
+            if mode.lower() != 'wal':
+                try:
+                    connection.execute('PRAGMA journal_mode=WAL')
+                except sqlite3.OperationalError:
+                    # Another process is changing it.
+                    pass
+            connection.execute('PRAGMA synchronous=NORMAL')
+            connection.execute(
+                'CREATE TABLE IF NOT EXISTS metrics ('
+                'name TEXT NOT NULL, labels TEXT NOT NULL, le TEXT NOT NULL, '
+                'value REAL NOT NULL, PRIMARY KEY (name, labels, le))'
+            )
+            self.local.connection = connection
+            self.local.pid = os.getpid()
+        return connection
+
+    def update(self, increments=(), gauges=()):
+        """
+        Adds to the values of the given (name, labels, le, amount) tuples,
+        and sets those of the given (name, labels, le, value) tuples, in
+        one transaction.
+        """
+        connection = self.connection()
+        # The write lock is taken when the transaction begins, waiting for
+        # other processes to release it; upgrading a read lock to a write
+        # lock later could fail straight away rather than wait.
+        connection.execute('BEGIN IMMEDIATE')
+        try:
+            for name, labels, le, amount in increments:
+                connection.execute(
+                    'INSERT OR IGNORE INTO metrics VALUES (?, ?, ?, 0)',
+                    (name, labels, le)
+                )
+                connection.execute(
+                    'UPDATE metrics SET value = value + ? '
+                    'WHERE name = ? AND labels = ? AND le = ?',
+                    (amount, name, labels, le)
+                )
+            for name, labels, le, value in gauges:
+                connection.execute(
+                    'INSERT OR REPLACE INTO metrics VALUES (?, ?, ?, ?)',
+                    (name, labels, le, value)
+                )
+        except:
+            connection.execute('ROLLBACK')
+            raise
+        connection.execute('COMMIT')
+
+    def values(self):
+        """
+        Returns every stored (name, labels, le, value) tuple.
+        """
+        return self.connection().execute(
+            'SELECT name, labels, le, value FROM metrics'
+        ).fetchall()
+
+
+def get_store():
+    path = metrics_path()
+    with _stores_lock:
+        if path not in _stores:
+            _stores[path] = MetricsStore(path)
+        return _stores[path]
+
+
+def record(increments=(), gauges=()):
+    """
+    Updates the store, logging rather than raising errors so that
+    metrics never break what they're measuring.
+    """
+    try:
+        get_store().update(increments, gauges)
+    except (sqlite3.Error, OSError):
+        logger.exception('Could not record metrics')
+
+
+def inc(name, amount=1, **labels):
+    """
+    Increases the counter with the given name and labels.
+    """
+    if enabled():
+        record(increments=[(name, format_labels(labels), '', amount)])
+
+
+def set_gauge(name, value, **labels):
+    """
+    Sets the gauge with the given name and labels.
+    """
+    if enabled():
+        record(gauges=[(name, format_labels(labels), '', value)])
+
+
+def histogram_increments(name, value, labels):
+    buckets = METRICS[name][2]
+    le = next((bucket for bucket in buckets if value <= bucket),
+              float('inf'))
+    labels = format_labels(labels)
+    return [(name, labels, format_value(le), 1),
+            (name + '_sum', labels, '', value)]
+
+
+def observe(name, value, **labels):
+    """
+    Adds an observation to the histogram with the given name and labels.
+    """
+    if enabled():
+        record(increments=histogram_increments(name, value, labels))
+
+
+def observe_request(url_name, method, status, seconds):
+    """
+    Counts a request, and its latency, in one update of the store.
+    """
+    if enabled():
+        record(increments=[
+            ('forge_http_requests_total',
+             format_labels({'url_name': url_name, 'method': method,
+                            'status': status}), '', 1)
+        ] + histogram_increments('forge_http_request_duration_seconds',
+                                 seconds, {'url_name': url_name}))
+
+
+def response_cache_ratios(samples):
+    """
+    Returns (labels, le, value) tuples for the response cache hit ratio of
+    each view, from the stored hit and miss counts.
+    """
+    hits = dict((labels, value) for labels, le, value
+                in samples['forge_response_cache_hits_total'])
+    misses = dict((labels, value) for labels, le, value
+                  in samples['forge_response_cache_misses_total'])
+    ratios = []
+    for labels in set(hits) | set(misses):
+        total = hits.get(labels, 0) + misses.get(labels, 0)
+        ratios.append((labels, '',
+                       hits.get(labels, 0) / total if total else 0.0))
+    return ratios
+
+
+def render():
+    """
+    Returns all of the metrics in the Prometheus text format.
+    """
+    samples = defaultdict(list)
+    for name, labels, le, value in get_store().values():
+        samples[name].append((labels, le, value))
+    samples['forge_response_cache_hit_ratio'] = response_cache_ratios(samples)
+
+    lines = []
+    for name, (kind, help_text, buckets) in METRICS.items():
+        if kind == HISTOGRAM:
+            metric_lines = render_histogram(name, samples)
+        else:
+            metric_lines = [
+                '%s{%s} %s' % (name, labels, format_value(value))
+                if labels else '%s %s' % (name, format_value(value))
+                for labels, le, value in sorted(samples[name])
+            ]
+        if metric_lines:
+            lines.append('# HELP %s %s' % (name, help_text))
+            lines.append('# TYPE %s %s' % (name, kind))
+            lines.extend(metric_lines)
+    return '\n'.join(lines) + '\n'
+
+
+def render_histogram(name, samples):
+    """
+    Returns the lines of the histogram with the given name, with the
+    stored counts of each bucket summed into cumulative counts.
+    """
+    buckets = defaultdict(dict)
+    for labels, le, value in samples[name]:
+        buckets[labels][float(le)] = value
+    sums = dict((labels, value) for labels, le, value in samples[name + '_sum'])
+
+    lines = []
+    for labels in sorted(buckets):
+        prefix = labels + ',' if labels else ''
+        count = 0
+        for bound in METRICS[name][2] + (float('inf'),):
+            count += buckets[labels].get(bound, 0)
+            lines.append('%s_bucket{%sle="%s"} %s' % (
+                name, prefix, format_value(bound), format_value(count)
+            ))
+        lines.append('%s_sum%s %s' % (name, '{%s}' % labels if labels else '',
+                                      format_value(sums.get(labels, 0))))
+        lines.append('%s_count%s %s' % (name,
+                                        '{%s}' % labels if labels else '',
+                                        format_value(count)))
+    return lines
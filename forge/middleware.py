@@ -0,0 +1,68 @@
+import logging
+import time
+
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+
+from . import instrumentation, metrics
+
+
+logger = logging.getLogger('forge.instrumentation')
+
+
+class InstrumentationMiddleware(object):
+    """
+    Counts and times the SQL queries, tarball reads, hashing, dependency
+    resolution and JSON encoding done for each request, sending them in
+    a `Server-Timing` header and logging them.  It's only used when the
+    `FORGE_INSTRUMENTATION` setting is true, and should come first in
+    `MIDDLEWARE_CLASSES` so that it includes the other middleware.
+    """
+
+    def __init__(self):
+        if not getattr(settings, 'FORGE_INSTRUMENTATION', False):
+            raise MiddlewareNotUsed
+
+    def process_request(self, request):
+        instrumentation.start()
+
+    def process_response(self, request, response):
+        timings = instrumentation.finish()
+        if timings is None:
+            # The request was answered by middleware before this one.
+            return response
+
+        response['Server-Timing'] = timings.server_timing()
+        logger.info('%s %s %d %s' % (request.method, request.get_full_path(),
+                                     response.status_code,
+                                     timings.log_fields()))
+        return response
+
+
+class MetricsMiddleware(object):
+    """
+    Counts requests, and records their latencies, by the name of the URL
+    pattern they matched, for the `/metrics` endpoint.  It's only used
+    when the `FORGE_METRICS` setting is true.
+    """
+
+    def __init__(self):
+        if not metrics.enabled():
+            raise MiddlewareNotUsed
+
+    def process_request(self, request):
+        request.metrics_start = time.time()
+
+    def process_response(self, request, response):
+        start = getattr(request, 'metrics_start', None)
+        if start is None:
+            return response
+
+        resolver_match = getattr(request, 'resolver_match', None)
+        if resolver_match is not None and resolver_match.url_name:
+            url_name = resolver_match.url_name
+        else:
+            url_name = 'unmatched'
+        metrics.observe_request(url_name, request.method,
+                                response.status_code, time.time() - start)
+        return response
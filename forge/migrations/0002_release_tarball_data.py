@@ -0,0 +1,34 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('forge', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='release',
+            name='file_md5',
+            field=models.CharField(max_length=32, editable=False, blank=True),
+        ),
+        migrations.AddField(
+            model_name='release',
+            name='file_sha256',
+            field=models.CharField(max_length=64, editable=False, blank=True),
+        ),
+        migrations.AddField(
+            model_name='release',
+            name='file_size',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='release',
+            name='metadata_json',
+            field=models.TextField(editable=False, blank=True),
+        ),
+    ]
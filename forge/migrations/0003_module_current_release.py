@@ -0,0 +1,20 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('forge', '0002_release_tarball_data'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='module',
+            name='current_release',
+            field=models.ForeignKey(related_name='+', on_delete=django.db.models.deletion.SET_NULL, blank=True, editable=False, to='forge.Release', null=True),
+        ),
+    ]
@@ -0,0 +1,26 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('forge', '0003_module_current_release'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ReleaseDependency',
+            fields=[
+                ('id', models.AutoField(verbose_name='ID', serialize=False, auto_created=True, primary_key=True)),
+                ('name', models.CharField(max_length=255, db_index=True)),
+                ('spec', models.CharField(max_length=255)),
+                ('release', models.ForeignKey(related_name='dependencies', to='forge.Release')),
+            ],
+            options={
+                'ordering': ('pk',),
+            },
+        ),
+    ]
@@ -0,0 +1,27 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('forge', '0004_releasedependency'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SyncMark',
+            fields=[
+                ('id', models.AutoField(verbose_name='ID', serialize=False, auto_created=True, primary_key=True)),
+                ('api_url', models.CharField(max_length=255)),
+                ('endpoint', models.CharField(max_length=64)),
+                ('timestamp', models.DateTimeField()),
+            ],
+        ),
+        migrations.AlterUniqueTogether(
+            name='syncmark',
+            unique_together=set([('api_url', 'endpoint')]),
+        ),
+    ]
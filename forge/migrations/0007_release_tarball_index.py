@@ -0,0 +1,21 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import forge.models
+import forge.storage
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('forge', '0006_storedfile'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='release',
+            name='tarball',
+            field=models.FileField(storage=forge.storage.ForgeStorage(), upload_to=forge.models.tarball_upload, db_index=True),
+        ),
+    ]
@@ -0,0 +1,24 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('forge', '0008_cataloggeneration'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='release',
+            name='readme',
+            field=models.TextField(editable=False, blank=True),
+        ),
+        migrations.AddField(
+            model_name='release',
+            name='changelog',
+            field=models.TextField(editable=False, blank=True),
+        ),
+    ]
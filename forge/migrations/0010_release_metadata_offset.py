@@ -0,0 +1,19 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('forge', '0009_release_readme_changelog'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='release',
+            name='metadata_offset',
+            field=models.BigIntegerField(null=True, editable=False),
+        ),
+    ]
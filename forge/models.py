@@ -1,14 +1,18 @@
-import hashlib
+import datetime
 import json
-import os
-import tarfile
 import warnings
+from collections import defaultdict
 
-from django.db import models
+from django.core.exceptions import ValidationError
+from django.db import models, transaction
+from django.db.models import F
+from semantic_version import Version
 from semantic_version.django_fields import VersionField
 
 from .constants import MODULE_REGEX
-from .storage import ForgeStorage
+from .instrumentation import timer
+from .storage import IngestingFile, tarball_storage
+from .tarball import TarballError, TarballIngest, read_metadata, tarball_data
 
 
 class AuthorManager(models.Manager):
@@ -34,6 +38,21 @@ class Author(models.Model):
         }
 
 
+def latest_version(versions):
+    """
+    Return the latest of the given versions, preferably one that isn't a
+    pre-release, or None if there are no versions.
+    """
+    latest = latest_prerelease = None
+    for version in versions:
+        if version.prerelease:
+            if latest_prerelease is None or version > latest_prerelease:
+                latest_prerelease = version
+        elif latest is None or version > latest:
+            latest = version
+    return latest or latest_prerelease
+
+
 class ModuleManager(models.Manager):
     def get_by_natural_key(self, author, name):
         return self.get(author=Author.objects.get_by_natural_key(author),
@@ -60,6 +79,35 @@ class ModuleManager(models.Manager):
         else:
             return None
 
+    def update_current_releases(self, module_ids=None):
+        """
+        Recomputes the `current_release` of the modules with the given
+        primary keys (or all modules), returning the number of modules
+        that were updated.
+        """
+        releases = Release.objects.all()
+        modules = self.all()
+        if module_ids is not None:
+            releases = releases.filter(module__in=module_ids)
+            modules = modules.filter(pk__in=module_ids)
+
+        module_releases = defaultdict(dict)
+        for module_id, release_id, version in releases.values_list(
+                'module', 'pk', 'version').iterator():
+            module_releases[module_id][Version(version)] = release_id
+
+        updated = 0
+        with transaction.atomic():
+            for module_id, current_id in modules.values_list(
+                    'pk', 'current_release').iterator():
+                versions = module_releases.get(module_id, {})
+                latest = latest_version(versions)
+                latest_id = versions[latest] if latest else None
+                if latest_id != current_id:
+                    self.filter(pk=module_id).update(current_release=latest_id)
+                    updated += 1
+        return updated
+
 
 class Module(models.Model):
     author = models.ForeignKey(Author)
@@ -67,6 +115,12 @@ class Module(models.Model):
     desc = models.TextField(db_index=True, blank=True)
     tags = models.TextField(db_index=True, blank=True)
 
+    # The latest release of the module, maintained by signals whenever
+    # a release is saved or deleted.
+    current_release = models.ForeignKey('Release', blank=True, null=True,
+                                        editable=False, related_name='+',
+                                        on_delete=models.SET_NULL)
+
     objects = ModuleManager()
 
     class Meta:
@@ -106,19 +160,10 @@ class Module(models.Model):
         """
         Return the latest version, preferably one that isn't a pre-release.
         """
-        # First, try and get all non pre-release versions.
         releases = dict((release.version, release)
-                        for release in self.releases.all()
-                        if not release.version.prerelease)
-        if not releases:
-            # If all pre-releases, get all of them or return None.
-            releases = dict((release.version, release)
-                            for release in self.releases.all())
-            if not releases:
-                return None
-
-        latest_version = max(releases.keys())
-        return releases[latest_version]
+                        for release in self.releases.all())
+        latest = latest_version(releases)
+        return releases[latest] if latest else None
 
     def natural_key(self):
         return (self.author.name, self.name)
@@ -137,12 +182,17 @@ class Module(models.Model):
     @property
     def v3(self):
         v3_data = self.v3_base
-        current_release = self.latest_release
+        current_release = self.current_release
         if current_release:
+            # The current release belongs to this module, setting it avoids
+            # a query when serializing the release.
+            current_release.module = self
             current_release = current_release.v3
             v3_data.update({
                 'current_release': current_release,
-                'homepage_url': current_release['metadata'].get('project_page', ''),
+                'homepage_url': current_release['metadata'].get(
+                    'project_page', ''
+                ),
             })
         return v3_data
 
@@ -156,7 +206,19 @@ class Release(models.Model):
     module = models.ForeignKey(Module, related_name='releases')
     version = VersionField(db_index=True)
     tarball = models.FileField(upload_to=tarball_upload,
-                               storage=ForgeStorage())
+                               storage=tarball_storage, db_index=True)
+
+    # Information about the tarball, populated when the release is saved
+    # so that it never has to be read when serving the APIs.
+    file_md5 = models.CharField(max_length=32, blank=True, editable=False)
+    file_sha256 = models.CharField(max_length=64, blank=True, editable=False)
+    file_size = models.PositiveIntegerField(default=0, editable=False)
+    metadata_json = models.TextField(blank=True, editable=False)
+    readme = models.TextField(blank=True, editable=False)
+    changelog = models.TextField(blank=True, editable=False)
+    # Offset of the `metadata.json` header in the decompressed tarball,
+    # so that it can be read again without reading the members before it.
+    metadata_offset = models.BigIntegerField(null=True, editable=False)
 
     class Meta:
         unique_together = ('module', 'version')
@@ -164,44 +226,58 @@ class Release(models.Model):
     def __unicode__(self):
         return u'%s version %s' % (self.module, self.version)
 
-    @property
-    def file_md5(self):
-        # TODO: This will become an actual database field.
-        self.tarball.open()
-        file_md5 = hashlib.md5()
-        file_md5.update(self.tarball.read())
-        self.tarball.close()
-        return file_md5.hexdigest()
-
-    @property
-    def file_size(self):
-        return self.tarball.size
-
-    @property
-    def metadata_json(self):
-        with tarfile.open(self.tarball.path, mode='r:gz') as tf:
-            metadata_ti = None
-            for fname in tf.getnames():
-                if os.path.basename(fname) == 'metadata.json':
-                    metadata_ti = tf.getmember(fname)
-                    break
-
-            if metadata_ti is None:
-                raise Exception("Can't find metadata.json for release: %s" %
-                                self)
-
-            metadata = tf.extractfile(metadata_ti.name).read()
-
-        for encoding in ('utf-8', 'latin-1'):
-            try:
-                return metadata.decode(encoding)
-            except UnicodeDecodeError:
-                continue
+    def save(self, *args, **kwargs):
+        update = not self.file_md5 or not self.tarball._committed
+        if update:
+            if not self.tarball._committed:
+                # Commit the uploaded tarball to storage first (this is
+                # what `FileField.pre_save` would do), reading it as it's
+                # written.
+                ingest = TarballIngest()
+                with timer('tarball'):
+                    self.tarball.save(self.tarball.name,
+                                      IngestingFile(self.tarball, ingest),
+                                      save=False)
+                try:
+                    if ingest.size:
+                        self.set_tarball_data(ingest.data())
+                    else:
+                        # The storage didn't read the tarball in chunks.
+                        self.update_tarball_data()
+                except TarballError as e:
+                    # Don't keep a tarball that no release can use.
+                    self.tarball.delete(save=False)
+                    raise ValidationError({'tarball': [
+                        'Invalid module tarball: %s' % e
+                    ]})
+            else:
+                self.update_tarball_data()
+        # The dependencies are written in the same transaction as the
+        # release, so they're in place before the caches using them are
+        # invalidated when it's committed.
+        with transaction.atomic():
+            super(Release, self).save(*args, **kwargs)
+            if update:
+                ReleaseDependency.objects.update_for_release(self.pk,
+                                                             self.metadata)
+
+    def update_tarball_data(self):
+        """
+        Sets the digests, size and metadata fields from the contents
+        of the release's tarball.
+        """
+        self.set_tarball_data(tarball_data(self.tarball.path))
 
-        raise Exception("Can't find an encoding for metadata.json")
+    def set_tarball_data(self, data):
+        for field, value in data.items():
+            setattr(self, field, value)
 
     @property
     def metadata(self):
+        if not self.metadata_json:
+            # Releases that haven't been backfilled yet.
+            self.metadata_json = read_metadata(self.tarball.path,
+                                               self.metadata_offset)
         return json.loads(self.metadata_json)
 
     @property
@@ -215,3 +291,126 @@ class Release(models.Model):
             'tags': self.module.tag_list,
             'version': str(self.version),
         }
+
+
+class ReleaseDependencyManager(models.Manager):
+    def from_metadata(self, release_id, metadata):
+        """
+        Returns unsaved dependencies for the release with the given primary
+        key from the given metadata.
+        """
+        return [
+            self.model(release_id=release_id,
+                       name=depend['name'],
+                       spec=depend.get('version_requirement', '>= 0.0.0'))
+            for depend in metadata.get('dependencies', [])
+        ]
+
+    def update_for_release(self, release_id, metadata):
+        """
+        Replaces the dependencies of the release with the given primary
+        key with those in the given metadata.
+        """
+        self.filter(release=release_id).delete()
+        self.bulk_create(self.from_metadata(release_id, metadata))
+
+
+class ReleaseDependency(models.Model):
+    """
+    A dependency of a release, as given in its metadata: the name of the
+    module depended on (e.g., 'puppetlabs/stdlib') and the version
+    specification it must satisfy.
+    """
+    release = models.ForeignKey(Release, related_name='dependencies')
+    name = models.CharField(max_length=255, db_index=True)
+    spec = models.CharField(max_length=255)
+
+    objects = ReleaseDependencyManager()
+
+    class Meta:
+        ordering = ('pk',)
+
+    def __unicode__(self):
+        return u'%s depends on %s %s' % (self.release, self.name, self.spec)
+
+
+class SyncMarkManager(models.Manager):
+    def get_mark(self, api_url, endpoint):
+        """
+        Returns the high-water mark for the given Forge API endpoint, or
+        None if it hasn't been synchronized.
+        """
+        try:
+            return self.get(api_url=api_url, endpoint=endpoint).timestamp
+        except self.model.DoesNotExist:
+            return None
+
+    def set_mark(self, api_url, endpoint, timestamp):
+        self.update_or_create(api_url=api_url, endpoint=endpoint,
+                              defaults={'timestamp': timestamp})
+
+
+class SyncMark(models.Model):
+    """
+    The timestamp (in UTC) of the newest item synchronized from an endpoint
+    of another Forge's API, used by incremental syncs.
+    """
+    api_url = models.CharField(max_length=255)
+    endpoint = models.CharField(max_length=64)
+    timestamp = models.DateTimeField()
+
+    objects = SyncMarkManager()
+
+    class Meta:
+        unique_together = ('api_url', 'endpoint')
+
+    def __unicode__(self):
+        return u'%s%s: %s' % (self.api_url, self.endpoint, self.timestamp)
+
+
+class StoredFile(models.Model):
+    """
+    Maps the name of a file saved with `ContentAddressedStorage` to the
+    SHA-256 digest of its contents.
+    """
+    name = models.CharField(max_length=255, unique=True)
+    sha256 = models.CharField(max_length=64, db_index=True)
+
+    def __unicode__(self):
+        return u'%s: %s' % (self.name, self.sha256)
+
+
+class CatalogGenerationManager(models.Manager):
+    def get_generation(self):
+        """
+        Returns the catalog generation, creating it if necessary.
+        """
+        generation, created = self.get_or_create(
+            pk=1, defaults={'modified': datetime.datetime.utcnow()}
+        )
+        return generation
+
+    def bump(self):
+        """
+        Increases the catalog generation, after the catalog has changed.
+        """
+        now = datetime.datetime.utcnow()
+        if not self.filter(pk=1).update(generation=F('generation') + 1,
+                                        modified=now):
+            self.get_or_create(pk=1, defaults={'generation': 1,
+                                               'modified': now})
+
+
+class CatalogGeneration(models.Model):
+    """
+    A counter that's increased whenever an author, module or release is
+    changed, along with the time (in UTC) it was last increased; there's
+    only ever one row.
+    """
+    generation = models.PositiveIntegerField(default=0)
+    modified = models.DateTimeField()
+
+    objects = CatalogGenerationManager()
+
+    def __unicode__(self):
+        return u'Generation %d (%s)' % (self.generation, self.modified)
@@ -0,0 +1,239 @@
+"""
+Search backends for finding modules by name, author, tags and description.
+
+The backend is chosen with the `FORGE_SEARCH_BACKEND` setting; when it's not
+set, a full-text backend matching the database (SQLite FTS5 or PostgreSQL
+tsvector) is used, falling back to substring matching otherwise.
+"""
+import re
+
+from django.conf import settings
+from django.db import connection
+from django.utils.module_loading import import_string
+
+from .models import Module
+
+
+# Regular expression for the terms in a search query; this matches how
+# the full-text tokenizers split words (including on underscores).
+TERM_REGEX = re.compile(r'[^\W_]+', re.UNICODE)
+
+_backends = {}
+
+
+def search_terms(query):
+    return TERM_REGEX.findall(query.lower())
+
+
+class SearchBackend(object):
+    """
+    Searches modules with case-insensitive substring matching; this doesn't
+    need an index, but requires scanning every module.
+    """
+    def setup(self):
+        """
+        Creates the search index, if the backend needs one.
+        """
+        pass
+
+    def update(self, modules):
+        """
+        Adds or updates the given modules in the search index.
+        """
+        pass
+
+    def remove(self, module_ids):
+        """
+        Removes the modules with the given primary keys from the index.
+        """
+        pass
+
+    def rebuild(self):
+        """
+        Indexes all modules, in batches.
+        """
+        module_ids = list(Module.objects.values_list('pk', flat=True))
+        self.remove(module_ids)
+        for i in xrange(0, len(module_ids), 1000):
+            self.update(Module.objects.select_related('author').filter(
+                pk__in=module_ids[i:i + 1000]
+            ))
+
+    def match(self, queryset, terms):
+        """
+        Returns the modules in the given queryset matching all of the given
+        terms in the search index, ordered from most to least relevant, or
+        None if the backend has no index.
+        """
+        return None
+
+    def search(self, queryset, query):
+        """
+        Returns the modules in the given queryset matching the query; these
+        are ordered by author name, unless they're found in the search index,
+        which orders them from most to least relevant.
+
+        The index only matches whole words, or their prefixes, of the name,
+        author, tags and description of modules; when nothing in it matches,
+        the query is matched as a substring of those and of release versions
+        (e.g., "lib" for "stdlib" or "1.2" for "1.2.0").
+        """
+        terms = search_terms(query)
+        if terms:
+            modules = self.match(queryset, terms)
+            if modules is not None and modules.exists():
+                return modules
+
+        return (
+            queryset.filter(name__icontains=query) |
+            queryset.filter(author__name__icontains=query) |
+            queryset.filter(releases__version__icontains=query) |
+            queryset.filter(tags__icontains=query) |
+            queryset.filter(desc__icontains=query)
+        ).order_by('author__name').distinct()
+
+
+class SQLiteSearchBackend(SearchBackend):
+    """
+    Searches modules using an SQLite FTS5 virtual table, with the module's
+    primary key as the rowid.
+    """
+    table = 'forge_module_fts'
+
+    # Relative weights of the name, author, tags and description columns.
+    weights = (10.0, 5.0, 2.0, 1.0)
+
+    def setup(self):
+        with connection.cursor() as cursor:
+            cursor.execute(
+                'CREATE VIRTUAL TABLE IF NOT EXISTS %s USING '
+                'fts5(name, author, tags, "desc")' % self.table
+            )
+
+    def update(self, modules):
+        modules = list(modules)
+        self.remove([module.pk for module in modules])
+        with connection.cursor() as cursor:
+            cursor.executemany(
+                'INSERT INTO %s (rowid, name, author, tags, "desc") '
+                'VALUES (%%s, %%s, %%s, %%s, %%s)' % self.table,
+                [(module.pk, module.name, module.author.name,
+                  module.tags, module.desc) for module in modules]
+            )
+
+    def remove(self, module_ids):
+        with connection.cursor() as cursor:
+            cursor.executemany(
+                'DELETE FROM %s WHERE rowid = %%s' % self.table,
+                [(module_id,) for module_id in module_ids]
+            )
+
+    def match(self, queryset, terms):
+        # Every term is matched as a prefix, so that partially typed
+        # queries still find modules.
+        match = ' '.join('"%s"*' % term for term in terms)
+        rank = 'bm25(%s, %s)' % (
+            self.table, ', '.join(str(weight) for weight in self.weights)
+        )
+        return queryset.extra(
+            tables=[self.table],
+            where=['%s.rowid = %s.id' % (self.table, Module._meta.db_table),
+                   '%s MATCH %%s' % self.table],
+            params=[match],
+            select={'search_rank': rank},
+        ).order_by('search_rank', 'author__name')
+
+
+class PostgresSearchBackend(SearchBackend):
+    """
+    Searches modules using a table of weighted tsvector documents with
+    a GIN index.
+    """
+    table = 'forge_module_search'
+    document = (
+        "setweight(to_tsvector('simple', %s), 'A') || "
+        "setweight(to_tsvector('simple', %s), 'B') || "
+        "setweight(to_tsvector('simple', %s), 'C') || "
+        "setweight(to_tsvector('simple', %s), 'D')"
+    )
+
+    def setup(self):
+        with connection.cursor() as cursor:
+            cursor.execute(
+                'CREATE TABLE IF NOT EXISTS %s ('
+                'module_id integer PRIMARY KEY REFERENCES %s (id) '
+                'ON DELETE CASCADE DEFERRABLE INITIALLY DEFERRED, '
+                'document tsvector NOT NULL)' %
+                (self.table, Module._meta.db_table)
+            )
+            cursor.execute(
+                'CREATE INDEX IF NOT EXISTS %s_document ON %s '
+                'USING gin (document)' % (self.table, self.table)
+            )
+
+    def update(self, modules):
+        modules = list(modules)
+        self.remove([module.pk for module in modules])
+        with connection.cursor() as cursor:
+            cursor.executemany(
+                'INSERT INTO %s (module_id, document) VALUES (%%s, %s)' %
+                (self.table, self.document),
+                [(module.pk, module.name, module.author.name,
+                  module.tags, module.desc) for module in modules]
+            )
+
+    def remove(self, module_ids):
+        with connection.cursor() as cursor:
+            cursor.execute(
+                'DELETE FROM %s WHERE module_id = ANY(%%s)' % self.table,
+                [list(module_ids)]
+            )
+
+    def match(self, queryset, terms):
+        tsquery = ' & '.join('%s:*' % term for term in terms)
+        return queryset.extra(
+            tables=[self.table],
+            where=['%s.module_id = %s.id' % (self.table,
+                                              Module._meta.db_table),
+                   "%s.document @@ to_tsquery('simple', %%s)" % self.table],
+            params=[tsquery],
+            select={
+                'search_rank': "ts_rank(%s.document, "
+                               "to_tsquery('simple', %%s))" % self.table,
+            },
+            select_params=[tsquery],
+        ).order_by('-search_rank', 'author__name')
+
+
+def default_backend():
+    """
+    Returns the dotted path of the best search backend for the database.
+    """
+    if connection.vendor == 'postgresql':
+        return 'forge.search.PostgresSearchBackend'
+    elif connection.vendor == 'sqlite':
+        with connection.cursor() as cursor:
+            cursor.execute('PRAGMA compile_options')
+            options = set(row[0] for row in cursor.fetchall())
+        if 'ENABLE_FTS5' in options:
+            return 'forge.search.SQLiteSearchBackend'
+    return 'forge.search.SearchBackend'
+
+
+def get_backend():
+    """
+    Returns the search backend instance.
+    """
+    path = getattr(settings, 'FORGE_SEARCH_BACKEND', None)
+    if path not in _backends:
+        _backends[path] = import_string(path or default_backend())()
+    return _backends[path]
+
+
+def search_modules(query, queryset=None):
+    """
+    Returns the modules matching the given search query.
+    """
+    if queryset is None:
+        queryset = Module.objects.all()
+    return get_backend().search(queryset, query)
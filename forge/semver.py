@@ -3,10 +3,27 @@ Overloaded classes from the `semantic_version` library that can work with
 the 'flavor' of semantic version specifications used by Puppet Labs.
 """
 import re
+from bisect import bisect_left, bisect_right
 
 from semantic_version import Spec, SpecItem, Version
 
 
+INFINITY = float('inf')
+
+# Maximum number of parsed specifications kept by `parse_spec`.
+SPEC_CACHE_SIZE = 10000
+
+_spec_cache = {}
+
+
+def version_key(version):
+    """
+    Returns the (major, minor, patch) tuple of a version, ignoring any
+    pre-release and build components.
+    """
+    return (version.major, version.minor or 0, version.patch or 0)
+
+
 class ForgeSpecItem(SpecItem):
     spec_pattern = r'(<|<=|==|>=|>|!=)\s?(\d[^\s]*)'
     re_spec = re.compile(r'^%s$' % spec_pattern)
@@ -50,6 +67,7 @@ class ForgeSpec(Spec):
     def __init__(self, *specs_strings):
         subspecs = [self.parse(spec) for spec in specs_strings]
         self.specs = sum(subspecs, ())
+        self.bounds = self.interval()
 
     def __repr__(self):
         return '<ForgeSpec: %r>' % (self.specs,)
@@ -78,3 +96,67 @@ class ForgeSpec(Spec):
         else:
             spec_texts = [specs_string]
         return tuple(ForgeSpecItem(spec_text) for spec_text in spec_texts)
+
+    def interval(self):
+        """
+        Returns the lower and upper bounds, as (major, minor, patch) tuples,
+        of the versions that may match this specification; either is None
+        when unbounded.  The bounds are inclusive, and ignore pre-release
+        and build components, so that the versions within them still need
+        to be matched against the specification.
+        """
+        lower = upper = None
+        for item in self.specs:
+            if item.kind in (item.KIND_GTE, item.KIND_GT, item.KIND_EQUAL):
+                bound = version_key(item.spec)
+                if lower is None or bound > lower:
+                    lower = bound
+            if item.kind in (item.KIND_LTE, item.KIND_LT, item.KIND_EQUAL):
+                # Missing components of partial versions match anything.
+                bound = (
+                    item.spec.major,
+                    INFINITY if item.spec.minor is None else item.spec.minor,
+                    INFINITY if item.spec.patch is None else item.spec.patch,
+                )
+                if upper is None or bound < upper:
+                    upper = bound
+        return lower, upper
+
+
+def parse_spec(specs_string):
+    """
+    Returns the `ForgeSpec` for the given specification string, parsing
+    each distinct string only once.
+    """
+    spec = _spec_cache.get(specs_string)
+    if spec is None:
+        if len(_spec_cache) >= SPEC_CACHE_SIZE:
+            _spec_cache.clear()
+        spec = _spec_cache[specs_string] = ForgeSpec(specs_string)
+    return spec
+
+
+class VersionIndex(object):
+    """
+    Sorted index of objects by their versions, for finding the ones that
+    match a `ForgeSpec` without testing every version against it.
+    """
+
+    def __init__(self, items):
+        """
+        Creates the index from 2-tuples of a `Version` and an object.
+        """
+        self.items = sorted(items, key=lambda item: version_key(item[0]))
+        self.keys = [version_key(version) for version, obj in self.items]
+
+    def match(self, spec):
+        """
+        Returns the objects whose versions match the given specification,
+        in version order.
+        """
+        lower, upper = spec.bounds
+        start = 0 if lower is None else bisect_left(self.keys, lower)
+        end = (len(self.keys) if upper is None
+               else bisect_right(self.keys, upper))
+        return [obj for version, obj in self.items[start:end]
+                if version in spec]
@@ -24,6 +24,8 @@ STATIC_ROOT = ''
 ROOT_URLCONF = 'forge.urls'
 
 MIDDLEWARE_CLASSES = (
+    'forge.middleware.InstrumentationMiddleware',
+    'forge.middleware.MetricsMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
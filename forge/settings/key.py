@@ -0,0 +1 @@
+SECRET_KEY = 's8do^!##11x1gw_icxbin=u)-r*bd7bxpphku9&_gx8r$m%))1'
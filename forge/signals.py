@@ -0,0 +1,87 @@
+"""
+Signal handlers that keep denormalized Forge data up to date.
+"""
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from .dependency import invalidate_modules
+from .models import Author, CatalogGeneration, Module, Release
+from .search import get_backend
+
+
+def on_commit(func):
+    """
+    Calls the given function once the current transaction is committed,
+    or straight away when there isn't one.  Django 1.8 can't defer it, so
+    it's called straight away there too.
+    """
+    if hasattr(transaction, 'on_commit'):
+        transaction.on_commit(func)
+    else:
+        func()
+
+
+@receiver(post_save, sender=Release)
+@receiver(post_delete, sender=Release)
+def update_current_release(sender, instance, **kwargs):
+    """
+    Recomputes the current release of the module whenever one of its
+    releases is saved or deleted.
+    """
+    Module.objects.update_current_releases([instance.module_id])
+
+
+@receiver(post_save, sender=Release)
+@receiver(post_delete, sender=Release)
+def invalidate_dependencies(sender, instance, **kwargs):
+    """
+    Invalidates cached dependencies that include the release's module,
+    once the change is committed; resolutions cached before then may have
+    read the old dependencies.
+    """
+    module_id = instance.module_id
+    on_commit(lambda: invalidate_modules([module_id]))
+
+
+@receiver(post_save, sender=Author)
+@receiver(post_delete, sender=Author)
+@receiver(post_save, sender=Module)
+@receiver(post_delete, sender=Module)
+@receiver(post_save, sender=Release)
+@receiver(post_delete, sender=Release)
+def bump_catalog_generation(sender, **kwargs):
+    """
+    Increases the catalog generation whenever the catalog changes, so that
+    the API responses using it as their ETag are no longer current.  This
+    is done once the change is committed, so that responses cached while
+    it's in progress aren't cached under the new generation.
+    """
+    on_commit(CatalogGeneration.objects.bump)
+
+
+def create_search_index(sender, **kwargs):
+    """
+    Creates the search index after the Forge tables are created.
+    """
+    get_backend().setup()
+
+
+@receiver(post_save, sender=Module)
+def index_module(sender, instance, **kwargs):
+    get_backend().update([instance])
+
+
+@receiver(post_delete, sender=Module)
+def unindex_module(sender, instance, **kwargs):
+    get_backend().remove([instance.pk])
+
+
+@receiver(post_save, sender=Author)
+def index_author_modules(sender, instance, created, **kwargs):
+    """
+    Reindexes the modules of an author when it's changed, as its name
+    may have changed.
+    """
+    if not created:
+        get_backend().update(instance.module_set.select_related('author'))
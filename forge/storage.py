@@ -1,7 +1,17 @@
+import errno
+import hashlib
 import os
+import tempfile
 
 from django.conf import settings
+from django.core.files import File
+from django.core.files.move import file_move_safe
 from django.core.files.storage import FileSystemStorage
+from django.utils._os import safe_join
+from django.utils.functional import LazyObject
+from django.utils.module_loading import import_string
+
+from .tarball import file_digests
 
 
 class ForgeStorage(FileSystemStorage):
@@ -16,3 +26,198 @@ class ForgeStorage(FileSystemStorage):
         if self.exists(name):
             self.delete(name)
         return name
+
+
+class ContentAddressedStorage(ForgeStorage):
+    """
+    Stores files under the SHA-256 digest of their contents, in directories
+    sharded by the digest's first bytes (e.g., `sha256/ab/cd/abcd...`), so
+    that identical files are only stored once.  The names that files are
+    saved with, and their URLs, stay the same: they're mapped to digests
+    by the `StoredFile` model.
+
+    Files saved by `ForgeStorage` are still found at their names until
+    they're moved into the store with `store_existing`.
+    """
+    blob_dir = 'sha256'
+
+    def get_available_name(self, name):
+        # Saving replaces the mapping for the name, the contents it
+        # previously mapped to are removed if nothing else uses them.
+        return name
+
+    def blob_path(self, digest):
+        return safe_join(self.location, self.blob_dir,
+                         digest[:2], digest[2:4], digest)
+
+    def legacy_path(self, name):
+        return super(ContentAddressedStorage, self).path(name)
+
+    def digest(self, name):
+        """
+        Returns the SHA-256 digest of the file with the given name, or None
+        if it's not in the store.
+        """
+        from .models import StoredFile
+        try:
+            return StoredFile.objects.get(name=name).sha256
+        except StoredFile.DoesNotExist:
+            return None
+
+    def path(self, name):
+        digest = self.digest(name)
+        if digest:
+            return self.blob_path(digest)
+        return self.legacy_path(name)
+
+    def exists(self, name):
+        return (self.digest(name) is not None or
+                os.path.exists(self.legacy_path(name)))
+
+    def delete(self, name):
+        from .models import StoredFile
+        digest = self.digest(name)
+        if digest:
+            StoredFile.objects.filter(name=name).delete()
+            self.remove_blob(digest)
+        else:
+            super(ContentAddressedStorage, self).delete(name)
+
+    def _save(self, name, content):
+        if hasattr(content, 'temporary_file_path'):
+            # The file is already on disk, and is moved into the store.
+            tmp_path = content.temporary_file_path()
+            digest = getattr(content, 'sha256', None)
+            if not digest:
+                with open(tmp_path, 'rb') as fh:
+                    digest = file_digests(fh)['file_sha256']
+        else:
+            tmp_dir = os.path.join(self.location, self.blob_dir)
+            if not os.path.isdir(tmp_dir):
+                os.makedirs(tmp_dir)
+            fd, tmp_path = tempfile.mkstemp(dir=tmp_dir, suffix='.tmp')
+            sha256 = hashlib.sha256()
+            with os.fdopen(fd, 'wb') as fh:
+                for chunk in content.chunks():
+                    fh.write(chunk)
+                    sha256.update(chunk)
+            digest = sha256.hexdigest()
+
+        self.store_blob(tmp_path, digest)
+        self.map_name(name, digest)
+        return name
+
+    def store_blob(self, path, digest):
+        """
+        Moves the file at the given path into the store, or removes it if
+        the store already has its contents.
+        """
+        blob_path = self.blob_path(digest)
+        if os.path.exists(blob_path):
+            os.remove(path)
+            return
+
+        blob_dir = os.path.dirname(blob_path)
+        if not os.path.isdir(blob_dir):
+            try:
+                os.makedirs(blob_dir)
+            except OSError as e:
+                # Another process may have created it.
+                if e.errno != errno.EEXIST:
+                    raise
+        file_move_safe(path, blob_path, allow_overwrite=True)
+        if self.file_permissions_mode is not None:
+            os.chmod(blob_path, self.file_permissions_mode)
+
+    def remove_blob(self, digest):
+        """
+        Removes the contents with the given digest, unless some file still
+        uses them.
+        """
+        from .models import StoredFile
+        if StoredFile.objects.filter(sha256=digest).exists():
+            return
+        try:
+            os.remove(self.blob_path(digest))
+        except OSError as e:
+            if e.errno != errno.ENOENT:
+                raise
+
+    def map_name(self, name, digest):
+        """
+        Maps the name to the contents with the given digest, removing any
+        file previously saved with the name.
+        """
+        from .models import StoredFile
+        old_digest = self.digest(name)
+        StoredFile.objects.update_or_create(name=name,
+                                            defaults={'sha256': digest})
+        if old_digest and old_digest != digest:
+            self.remove_blob(old_digest)
+
+        legacy_path = self.legacy_path(name)
+        if os.path.exists(legacy_path):
+            os.remove(legacy_path)
+
+    def store_existing(self, name):
+        """
+        Moves a file saved at its name (as `ForgeStorage` does) into the
+        store, returning a 2-tuple of its digest and whether the store
+        already had its contents.
+        """
+        path = self.legacy_path(name)
+        with open(path, 'rb') as fh:
+            digest = file_digests(fh)['file_sha256']
+        duplicate = os.path.exists(self.blob_path(digest))
+        self.store_blob(path, digest)
+        self.map_name(name, digest)
+        return digest, duplicate
+
+
+class DownloadedFile(File):
+    """
+    A file that has already been written to disk, such as a downloaded
+    tarball; it's moved into storage rather than copied.  The SHA-256 digest
+    of its contents may be given, when known, to avoid reading it again.
+    """
+
+    def __init__(self, path, sha256=None):
+        super(DownloadedFile, self).__init__(open(path, 'rb'),
+                                             name=os.path.basename(path))
+        self.sha256 = sha256
+
+    def temporary_file_path(self):
+        return self.file.name
+
+
+class IngestingFile(File):
+    """
+    Wraps a file being saved to storage, giving each chunk of it that's
+    read to a `TarballIngest`, so that the tarball is hashed and read as
+    it's written.
+    """
+
+    def __init__(self, file, ingest):
+        super(IngestingFile, self).__init__(file, name=file.name)
+        self.ingest = ingest
+
+    def chunks(self, chunk_size=None):
+        for chunk in self.file.chunks(chunk_size):
+            self.ingest.update(chunk)
+            yield chunk
+
+
+def get_storage_class():
+    return import_string(getattr(settings, 'FORGE_STORAGE',
+                                 'forge.storage.ForgeStorage'))
+
+
+class TarballStorage(LazyObject):
+    """
+    The storage for release tarballs, set by the `FORGE_STORAGE` setting.
+    """
+    def _setup(self):
+        self._wrapped = get_storage_class()()
+
+
+tarball_storage = TarballStorage()
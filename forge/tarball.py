@@ -0,0 +1,434 @@
+"""
+Utilities for extracting information from Puppet module tarballs.
+"""
+import hashlib
+import json
+import re
+import zlib
+
+from .instrumentation import timed
+
+
+# Size of the chunks read from tarballs when hashing.
+CHUNK_SIZE = 64 * 1024
+
+# Size of the blocks of tar archives.
+BLOCK_SIZE = 512
+
+# Largest `metadata.json` read from a tarball.
+MAX_METADATA_SIZE = 10 * 1024 * 1024
+
+# Largest README or CHANGELOG kept from a tarball, longer ones are truncated.
+MAX_TEXT_SIZE = 1024 * 1024
+
+README_REGEX = re.compile(r'^readme(\.\w+)?$', re.IGNORECASE)
+CHANGELOG_REGEX = re.compile(r'^(changelog|changes|history)(\.\w+)?$',
+                             re.IGNORECASE)
+
+
+class TarballError(Exception):
+    pass
+
+
+def decode_text(data):
+    """
+    Returns the given bytes from a tarball as unicode, trying UTF-8 first
+    and falling back to Latin-1.
+    """
+    for encoding in ('utf-8', 'latin-1'):
+        try:
+            return data.decode(encoding)
+        except UnicodeDecodeError:
+            continue
+
+    raise TarballError("Can't find an encoding for metadata.json")
+
+
+@timed('tarball')
+def read_metadata(path, offset=None):
+    """
+    Returns the contents of the `metadata.json` file in the module tarball
+    at the given path, as unicode.  Reading stops at the `metadata.json`
+    in the module's top-level directory; when the offset of its header in
+    the decompressed archive is given (as stored for releases when their
+    tarballs are saved), the members before it aren't read at all.
+    """
+    if offset is not None:
+        try:
+            return scan_metadata(path, offset)
+        except TarballError:
+            # The offset isn't for this tarball, read it from the start.
+            pass
+    return scan_metadata(path)
+
+
+def scan_metadata(path, start=None):
+    reader = TarballReader(members=('metadata.json', 'nested metadata.json'),
+                           start=start or 0)
+    with open(path, 'rb') as fh:
+        for chunk in iter(lambda: fh.read(CHUNK_SIZE), b''):
+            reader.update(chunk)
+            if 'metadata.json' in reader.files or reader.finished:
+                break
+    if reader.error is not None:
+        raise TarballError('Could not read tarball %s: %s' %
+                           (path, reader.error))
+
+    if start is not None:
+        if reader.offsets.get('metadata.json') != start:
+            raise TarballError("Can't find metadata.json at offset %d in: %s" %
+                               (start, path))
+        metadata = reader.files['metadata.json']
+    else:
+        metadata = reader.files.get('metadata.json',
+                                    reader.files.get('nested metadata.json'))
+    if metadata is None:
+        raise TarballError("Can't find metadata.json in: %s" % path)
+    return decode_text(metadata)
+
+
+@timed('hash')
+def file_digests(fh):
+    """
+    Returns a dictionary with the MD5 and SHA-256 hex digests, along with
+    the size, of the data read from the given file object.
+    """
+    file_md5 = hashlib.md5()
+    file_sha256 = hashlib.sha256()
+    file_size = 0
+    for chunk in iter(lambda: fh.read(CHUNK_SIZE), b''):
+        file_md5.update(chunk)
+        file_sha256.update(chunk)
+        file_size += len(chunk)
+
+    return {
+        'file_md5': file_md5.hexdigest(),
+        'file_sha256': file_sha256.hexdigest(),
+        'file_size': file_size,
+    }
+
+
+def tar_string(field):
+    """
+    Returns the NUL-terminated string in the given tar header field.
+    """
+    return field.split(b'\0', 1)[0]
+
+
+def tar_number(field):
+    """
+    Returns the number in the given tar header field, in octal or, for
+    large values, GNU's base-256 encoding.
+    """
+    if ord(field[0]) & 0x80:
+        value = 0
+        for byte in bytearray(field[1:]):
+            value = (value << 8) + byte
+        return value
+    field = tar_string(field).strip()
+    try:
+        return int(field or b'0', 8)
+    except ValueError:
+        raise TarballError('Invalid number in tar header: %r' % field)
+
+
+def pax_headers(data):
+    """
+    Returns a dictionary of the `key=value` records in a pax extended
+    header.
+    """
+    headers = {}
+    pos = 0
+    while pos < len(data):
+        space = data.find(b' ', pos)
+        if space == -1:
+            break
+        try:
+            length = int(data[pos:space])
+        except ValueError:
+            raise TarballError('Invalid pax header: %r' % data[pos:space])
+        if length <= 0:
+            break
+        key, _, value = data[space + 1:pos + length - 1].partition(b'=')
+        headers[key] = value
+        pos += length
+    return headers
+
+
+class TarballReader(object):
+    """
+    Streaming reader of a gzipped module tarball, from chunks of it given
+    to `update`: it keeps the `metadata.json`, README and CHANGELOG files
+    from the module's top-level directory (or only those in `members`,
+    when given), along with the offsets of their headers in the
+    decompressed archive.  It understands ustar, GNU long name and pax
+    headers.
+
+    When a `start` offset is given, the decompressed bytes before it are
+    skipped without reading their tar headers.
+    """
+
+    def __init__(self, members=None, start=0):
+        self.members = members
+        self.decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+        self.buffer = b''
+        self.skip = start
+        self.position = 0
+        self.finished = False
+        self.error = None
+        self.files = {}
+        self.offsets = {}
+
+        # The member being read: the bytes of it (and its padding) left
+        # to read, and where to keep its contents, if anywhere.
+        self.remaining = 0
+        self.member = None
+        self.member_size = 0
+        self.member_data = []
+        self.kept = 0
+        self.truncated = False
+
+        # Overrides from GNU long name and pax headers for the next member,
+        # and the offset of the first of them.
+        self.long_name = None
+        self.pax = {}
+        self.header_offset = None
+
+    def update(self, chunk):
+        """
+        Reads a chunk of the gzipped tarball.
+        """
+        if self.finished or self.error is not None:
+            return
+
+        try:
+            data = chunk
+            while data and not self.finished:
+                self.read(self.decompressor.decompress(data, 4 * CHUNK_SIZE))
+                data = self.decompressor.unconsumed_tail
+                if not data and self.decompressor.unused_data:
+                    # Another gzip member follows.
+                    data = self.decompressor.unused_data
+                    self.decompressor = zlib.decompressobj(
+                        16 + zlib.MAX_WBITS
+                    )
+        except (zlib.error, TarballError) as e:
+            self.error = e
+
+    def read(self, data):
+        """
+        Reads decompressed bytes of the tar archive.
+        """
+        if self.skip:
+            skipped = min(self.skip, len(data))
+            self.skip -= skipped
+            self.position += skipped
+            data = data[skipped:]
+        start = self.position - len(self.buffer)
+        self.position += len(data)
+
+        buf = self.buffer + data if self.buffer else data
+        pos = 0
+        while not self.finished:
+            if self.remaining:
+                end = min(len(buf), pos + self.remaining)
+                if end == pos:
+                    break
+                if self.member is not None:
+                    self.keep(buf[pos:end])
+                self.remaining -= end - pos
+                pos = end
+                if not self.remaining:
+                    self.end_member()
+            elif len(buf) - pos >= BLOCK_SIZE:
+                self.read_header(buf[pos:pos + BLOCK_SIZE], start + pos)
+                pos += BLOCK_SIZE
+            else:
+                break
+        self.buffer = buf[pos:] if not self.finished else b''
+
+    def read_header(self, header, offset):
+        if header == b'\0' * BLOCK_SIZE:
+            # The end of the archive.
+            self.finished = True
+            return
+
+        # Some archivers sum the header's bytes as signed characters.
+        checksum = tar_number(header[148:156])
+        header_bytes = bytearray(header[:148] + b' ' * 8 + header[156:])
+        if (checksum != sum(header_bytes) and
+                checksum != sum(b - 256 if b > 127 else b
+                                for b in header_bytes)):
+            raise TarballError('Invalid tar header checksum')
+
+        name = tar_string(header[:100])
+        if header[257:263] == b'ustar\x00':
+            # POSIX ustar archives may split long names into a prefix.
+            prefix = tar_string(header[345:500])
+            if prefix:
+                name = prefix + b'/' + name
+        size = tar_number(header[124:136])
+        type_flag = header[156:157]
+
+        if type_flag in (b'L', b'x', b'g'):
+            # The contents of these headers describe the next member.
+            if type_flag != b'g' and self.header_offset is None:
+                self.header_offset = offset
+            self.start_member(type_flag, size, MAX_METADATA_SIZE, offset)
+            return
+
+        if self.long_name is not None:
+            name = self.long_name
+        if b'path' in self.pax:
+            name = self.pax[b'path']
+        if b'size' in self.pax:
+            size = int(self.pax[b'size'])
+        if self.header_offset is not None:
+            offset = self.header_offset
+        self.long_name = None
+        self.pax = {}
+        self.header_offset = None
+
+        member = None
+        if type_flag in (b'0', b'\0', b'7'):
+            member = self.wanted(name.decode('utf-8', 'replace'))
+            if self.members is not None and member not in self.members:
+                member = None
+        self.start_member(member, size,
+                          MAX_METADATA_SIZE if member == 'metadata.json'
+                          else MAX_TEXT_SIZE, offset)
+
+    def wanted(self, name):
+        """
+        Returns the key that the contents of the regular file with the given
+        name should be kept under, or None.
+        """
+        parts = [part for part in name.split('/') if part and part != '.']
+        if not parts:
+            return None
+        basename = parts[-1]
+        top_level = len(parts) <= 2
+
+        if basename == 'metadata.json':
+            if top_level:
+                return 'metadata.json'
+            # Fall back to the first metadata.json found anywhere, as
+            # earlier versions did.
+            return 'nested metadata.json'
+        elif top_level and README_REGEX.match(basename):
+            return 'readme'
+        elif top_level and CHANGELOG_REGEX.match(basename):
+            return 'changelog'
+        return None
+
+    def start_member(self, member, size, limit, offset):
+        if member in self.files:
+            member = None
+        if member in ('metadata.json', 'nested metadata.json', b'L', b'x',
+                      b'g') and size > limit:
+            raise TarballError('Tarball member is too large: %d bytes' % size)
+        self.member = member
+        self.member_offset = offset
+        self.member_size = min(size, limit)
+        self.member_data = []
+        self.kept = 0
+        self.truncated = size > limit
+        self.remaining = size + (-size % BLOCK_SIZE)
+        if not self.remaining:
+            self.end_member()
+
+    def keep(self, data):
+        if self.kept < self.member_size:
+            data = data[:self.member_size - self.kept]
+            self.member_data.append(data)
+            self.kept += len(data)
+
+    def end_member(self):
+        member, self.member = self.member, None
+        if member is None:
+            return
+
+        contents = b''.join(self.member_data)
+        self.member_data = []
+        if member == b'L':
+            self.long_name = tar_string(contents)
+        elif member == b'x':
+            self.pax = pax_headers(contents)
+        elif member == b'g':
+            # Global pax headers don't change member names that matter here.
+            pass
+        elif member == 'readme' or member == 'changelog':
+            if self.truncated:
+                self.files[member] = contents.decode('utf-8', 'ignore')
+            else:
+                self.files[member] = decode_text(contents)
+        else:
+            self.files[member] = contents
+        if member in self.files:
+            self.offsets[member] = self.member_offset
+
+
+class TarballIngest(TarballReader):
+    """
+    Reads a module tarball in a single pass as it's written, from chunks
+    of its gzipped bytes given to `update`: they're hashed and counted as
+    well as read by the `TarballReader`.
+    """
+
+    def __init__(self):
+        super(TarballIngest, self).__init__()
+        self.md5 = hashlib.md5()
+        self.sha256 = hashlib.sha256()
+        self.size = 0
+
+    def update(self, chunk):
+        self.md5.update(chunk)
+        self.sha256.update(chunk)
+        self.size += len(chunk)
+        super(TarballIngest, self).update(chunk)
+
+    def data(self):
+        """
+        Returns a dictionary of the values stored on a `Release` for the
+        tarball: its digests, size, and the contents of its `metadata.json`,
+        README and CHANGELOG.
+        """
+        if self.error is not None:
+            raise TarballError('Could not read tarball: %s' % self.error)
+        metadata = self.files.get('metadata.json',
+                                  self.files.get('nested metadata.json'))
+        if metadata is None:
+            raise TarballError("Can't find metadata.json")
+        metadata = decode_text(metadata)
+        try:
+            json.loads(metadata)
+        except ValueError as e:
+            raise TarballError('Invalid metadata.json: %s' % e)
+
+        return {
+            'file_md5': self.md5.hexdigest(),
+            'file_sha256': self.sha256.hexdigest(),
+            'file_size': self.size,
+            'metadata_json': metadata,
+            'metadata_offset': self.offsets.get('metadata.json'),
+            'readme': self.files.get('readme', u''),
+            'changelog': self.files.get('changelog', u''),
+        }
+
+
+@timed('tarball')
+def tarball_data(path):
+    """
+    Returns a dictionary of the values stored on a `Release` for the
+    module tarball at the given path: its digests, size, and the
+    contents of its `metadata.json`, README and CHANGELOG.
+    """
+    ingest = TarballIngest()
+    with open(path, 'rb') as fh:
+        for chunk in iter(lambda: fh.read(CHUNK_SIZE), b''):
+            ingest.update(chunk)
+    try:
+        return ingest.data()
+    except TarballError as e:
+        raise TarballError('%s in: %s' % (e, path))
+
@@ -0,0 +1,235 @@
+"""
+A stand-in for the Puppet Forge v3 API, served over HTTP from a thread
+for testing `sync_forge` and the Forge API client.
+"""
+import hashlib
+import json
+import threading
+import time
+import urlparse
+from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+from SocketServer import ThreadingMixIn
+
+from .utils import make_tarball
+
+
+class ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+class FakeForgeHandler(BaseHTTPRequestHandler):
+    # Allow persistent connections, without the responses being delayed
+    # by Nagle's algorithm.
+    protocol_version = 'HTTP/1.1'
+    disable_nagle_algorithm = True
+
+    def log_message(self, format, *args):
+        pass
+
+    def setup(self):
+        BaseHTTPRequestHandler.setup(self)
+        with self.server.forge.lock:
+            self.server.forge.connections += 1
+
+    def do_GET(self):
+        forge = self.server.forge
+        url = urlparse.urlsplit(self.path)
+        query = dict(urlparse.parse_qsl(url.query))
+        with forge.lock:
+            forge.requests.append(self.path)
+            failures = forge.failures.get(url.path)
+            status = failures.pop(0) if failures else None
+
+        if status:
+            self.send_response(status)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+        elif url.path in ('/v3/users', '/v3/modules', '/v3/releases'):
+            with forge.lock:
+                forge.active += 1
+                forge.max_active = max(forge.active, forge.max_active)
+            try:
+                time.sleep(forge.delay)
+                self.send_page(url.path, query)
+            finally:
+                with forge.lock:
+                    forge.active -= 1
+        elif url.path in forge.files:
+            self.send_file(url.path)
+        else:
+            self.send_error(404)
+
+    def send_file(self, path):
+        """
+        Sends a tarball, supporting requests for the range of bytes after
+        an offset, and dropping the connection partway through when
+        requested.
+        """
+        forge = self.server.forge
+        content = forge.files[path]
+        offset = 0
+        range_header = self.headers.get('Range')
+        with forge.lock:
+            forge.ranges.append(range_header)
+            drops = forge.drops.get(path)
+            drop = drops.pop(0) if drops else None
+
+        if range_header:
+            offset = int(range_header[len('bytes='):].rstrip('-'))
+            if offset >= len(content):
+                self.send_response(416)
+                self.send_header('Content-Length', '0')
+                self.end_headers()
+                return
+            self.send_response(206)
+            self.send_header('Content-Range', 'bytes %d-%d/%d' %
+                             (offset, len(content) - 1, len(content)))
+        else:
+            self.send_response(200)
+        self.send_header('Content-Type', 'application/x-gzip')
+        self.send_header('Content-Length', str(len(content) - offset))
+        self.end_headers()
+
+        if drop is None:
+            self.wfile.write(content[offset:])
+        else:
+            self.wfile.write(content[offset:offset + drop])
+            self.close_connection = 1
+
+    def send_content(self, content, content_type):
+        self.send_response(200)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+    def send_page(self, path, query):
+        forge = self.server.forge
+        offset = int(query.get('offset', 0))
+        limit = int(query.get('limit', 20))
+
+        if path == '/v3/users':
+            results = forge.users()
+        elif path == '/v3/modules':
+            results = forge.modules(query.get('sort_by'))
+        else:
+            results = forge.releases(query.get('owner'))
+
+        page = {
+            'pagination': {
+                'limit': limit,
+                'offset': offset,
+                'total': len(results),
+            },
+            'results': results[offset:offset + limit],
+        }
+        self.send_content(json.dumps(page), 'application/json')
+
+
+class FakeForge(object):
+    """
+    Serves the authors, modules and releases added to it in the same
+    format as the Puppet Forge v3 API.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.connections = 0
+        self.requests = []
+        # Maps paths to a list of error statuses to respond with before
+        # responding normally.
+        self.failures = {}
+        # Time taken to respond to API requests, and the most API requests
+        # that were handled concurrently.
+        self.delay = 0
+        self.active = 0
+        self.max_active = 0
+        self.files = {}
+        # Maps file paths to a list of byte counts after which to drop
+        # the connection, and the Range headers of file requests.
+        self.drops = {}
+        self.ranges = []
+        self._modules = {}
+        self._releases = []
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    def start(self):
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), FakeForgeHandler)
+        self.server.forge = self
+        self.url = 'http://127.0.0.1:%d' % self.server.server_port
+        self.thread = threading.Thread(target=self.server.serve_forever)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def add_module(self, full_name, desc='', tags=()):
+        author, name = full_name.split('-')
+        self._modules[full_name] = {
+            'name': name,
+            'owner': {'username': author},
+            'current_release': {
+                'created_at': '2015-01-01 00:00:00 +0000',
+                'metadata': {'description': desc},
+                'tags': list(tags),
+            },
+        }
+
+    def add_release(self, full_name, version, metadata=None, file_md5=None,
+                    created_at='2015-08-01 12:00:00 -0700'):
+        """
+        Adds a release, with a tarball created from the given metadata;
+        a bad `file_md5` may be given to test corrupt downloads.
+        """
+        if full_name not in self._modules:
+            self.add_module(full_name)
+        module = self._modules[full_name]
+
+        if created_at > module['current_release']['created_at']:
+            module['current_release']['created_at'] = created_at
+
+        content = make_tarball(full_name, version, metadata=metadata)
+        file_uri = '/v3/files/%s-%s.tar.gz' % (full_name, version)
+        self.files[file_uri] = content
+        self._releases.append({
+            'created_at': created_at,
+            'file_md5': file_md5 or hashlib.md5(content).hexdigest(),
+            'file_size': len(content),
+            'file_uri': file_uri,
+            'module': {'name': module['name'], 'owner': module['owner']},
+            'version': version,
+        })
+
+    def users(self):
+        module_counts = {}
+        for module in self._modules.values():
+            username = module['owner']['username']
+            module_counts[username] = module_counts.get(username, 0) + 1
+        return [{'username': username, 'module_count': count}
+                for username, count in sorted(module_counts.items())]
+
+    def modules(self, sort_by=None):
+        modules = [self._modules[full_name]
+                   for full_name in sorted(self._modules)]
+        if sort_by == 'latest_release':
+            modules.sort(
+                key=lambda module: module['current_release']['created_at'],
+                reverse=True
+            )
+        return modules
+
+    def releases(self, owner=None):
+        # Releases are sorted from newest to oldest.
+        return sorted(
+            [release for release in self._releases
+             if owner is None or release['module']['owner']['username'] == owner],
+            key=lambda release: release['created_at'], reverse=True
+        )
@@ -0,0 +1,107 @@
+"""
+Tests for the `generate_catalog` and `benchmark_forge` commands.
+"""
+import json
+import os
+
+from django.core.management import call_command
+from django.core.management.base import CommandError
+
+from forge.models import Author, Module, Release, ReleaseDependency
+from forge.tarball import tarball_data
+
+from .utils import ForgeTestCase
+
+
+class TestGenerateCatalog(ForgeTestCase):
+
+    def generate(self, **options):
+        options.setdefault('authors', 3)
+        options.setdefault('modules', 12)
+        options.setdefault('releases', 3)
+        options.setdefault('depth', 2)
+        options.setdefault('fanout', 2)
+        call_command('generate_catalog', verbosity=0, **options)
+
+    def test_generate(self):
+        """
+        Ensure the generated releases have real tarballs, and depend on
+        other generated modules with requirements they can satisfy.
+        """
+        self.generate()
+        self.assertEqual(Author.objects.count(), 3)
+        self.assertEqual(Module.objects.count(), 12)
+        self.assertFalse(
+            Module.objects.filter(current_release__isnull=True).exists()
+        )
+
+        release = Release.objects.order_by('pk')[0]
+        data = tarball_data(release.tarball.path)
+        self.assertEqual(release.file_md5, data['file_md5'])
+        self.assertEqual(release.file_size, data['file_size'])
+        self.assertEqual(release.metadata, json.loads(data['metadata_json']))
+
+        # Modules in the first level depend on the second, which depend on
+        # the third, so dependencies of every release are two levels deep.
+        names = set(module.legacy_name for module in
+                    Module.objects.select_related('author'))
+        self.assertTrue(ReleaseDependency.objects.exists())
+        for dependency in ReleaseDependency.objects.all():
+            self.assertIn(dependency.name, names)
+        module = Module.objects.filter(
+            current_release__dependencies__isnull=False
+        ).select_related('author').order_by('pk')[0]
+        response = self.client.get('/api/v1/releases.json',
+                                   {'module': module.legacy_name})
+        self.assertEqual(response.status_code, 200)
+        self.assertGreater(len(json.loads(response.content)), 1)
+
+    def test_seed(self):
+        """
+        Ensure the same seed generates the same catalog.
+        """
+        self.generate(prefix='first')
+        self.generate(prefix='second')
+        versions = [
+            sorted((str(release.module.name), str(release.version))
+                   for release in Release.objects.filter(
+                       module__author__name__startswith=prefix
+                   ).select_related('module'))
+            for prefix in ('first', 'second')
+        ]
+        self.assertEqual(versions[0], versions[1])
+
+        with self.assertRaises(CommandError):
+            self.generate(prefix='first')
+
+
+class TestBenchmarkForge(ForgeTestCase):
+
+    def test_benchmark(self):
+        """
+        Ensure the benchmark reports statistics for every endpoint.
+        """
+        call_command('generate_catalog', authors=2, modules=8, releases=2,
+                     depth=1, verbosity=0)
+        output = os.path.join(self.media_root, 'benchmark.json')
+        call_command('benchmark_forge', requests=2, output=output)
+        with open(output) as fh:
+            results = json.load(fh)
+
+        self.assertEqual(results['catalog']['modules'], 8)
+        self.assertEqual(sorted(results['endpoints']), [
+            'module_json_v1', 'modules_json_v1', 'modules_json_v1_search',
+            'modules_v3', 'modules_v3_search', 'release_tarball',
+            'releases_json_v1', 'releases_v3',
+        ])
+        for name, stats in results['endpoints'].items():
+            self.assertEqual(stats['statuses'], {'200': 2}, name)
+            self.assertLessEqual(stats['latency_ms']['p50'],
+                                 stats['latency_ms']['max'])
+            self.assertGreaterEqual(stats['queries']['max'], 1)
+            if stats['rss_kb'] is not None:
+                self.assertGreater(stats['rss_kb'], 0)
+                self.assertIsInstance(stats['rss_increase_kb'], int)
+
+        with self.assertRaises(CommandError):
+            call_command('benchmark_forge', endpoints='nonexistent')
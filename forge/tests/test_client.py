@@ -0,0 +1,80 @@
+"""
+Tests for the Forge API client.
+"""
+from django.test import SimpleTestCase
+
+from forge.client import ForgeAPI, ForgeClient
+
+from .server import FakeForge
+
+
+class TestForgeClient(SimpleTestCase):
+
+    def setUp(self):
+        self.forge = FakeForge()
+        for i in xrange(45):
+            self.forge.add_module('author%d-module' % i)
+        self.forge.start()
+        self.addCleanup(self.forge.stop)
+        self.client = ForgeClient(api_url=self.forge.url, backoff=0)
+
+    def test_pagination(self):
+        """
+        Ensure every result is returned by the API iterator.
+        """
+        modules = list(ForgeAPI('modules', client=self.client))
+        self.assertEqual(modules, self.forge.modules())
+        self.assertEqual(len(self.forge.requests), 3)
+
+    def test_prefetch(self):
+        """
+        Ensure pages may be requested concurrently, with the results still
+        returned in order.
+        """
+        for i in xrange(45, 100):
+            self.forge.add_module('author%d-module' % i)
+        self.forge.delay = 0.05
+        modules = list(ForgeAPI('modules', client=self.client, prefetch=3))
+        self.assertEqual(modules, self.forge.modules())
+        self.assertEqual(len(self.forge.requests), 5)
+        self.assertEqual(self.forge.max_active, 3)
+
+    def test_prefetch_close(self):
+        """
+        Ensure no more pages are requested once iteration stops.
+        """
+        for i in xrange(45, 200):
+            self.forge.add_module('author%d-module' % i)
+        iterator = iter(ForgeAPI('modules', client=self.client, prefetch=2))
+        for i in xrange(30):
+            next(iterator)
+        iterator.close()
+        self.assertLessEqual(len(self.forge.requests), 4)
+
+    def test_keep_alive(self):
+        """
+        Ensure connections are reused between requests.
+        """
+        list(ForgeAPI('modules', client=self.client))
+        list(ForgeAPI('users', client=self.client))
+        self.assertEqual(len(self.forge.requests), 6)
+        self.assertEqual(self.forge.connections, 1)
+
+    def test_retry(self):
+        """
+        Ensure rate limited and server error responses are retried.
+        """
+        self.forge.failures['/v3/modules'] = [429, 503, 500]
+        modules = list(ForgeAPI('modules', client=self.client))
+        self.assertEqual(len(modules), 45)
+        self.assertEqual(len(self.forge.requests), 6)
+
+    def test_retries_exhausted(self):
+        """
+        Ensure an error is raised once the retries are exhausted.
+        """
+        client = ForgeClient(api_url=self.forge.url, retries=2, backoff=0)
+        self.forge.failures['/v3/users'] = [503, 503, 503]
+        with self.assertRaises(Exception):
+            ForgeAPI('users', client=client)
+        self.assertEqual(len(self.forge.requests), 3)
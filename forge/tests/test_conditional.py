@@ -0,0 +1,72 @@
+"""
+Tests for conditional requests to the v1 and v3 JSON APIs.
+"""
+from django.core.urlresolvers import reverse
+
+from forge.models import CatalogGeneration
+
+from .utils import ForgeTestCase
+
+
+class TestConditionalRequests(ForgeTestCase):
+
+    def setUp(self):
+        super(TestConditionalRequests, self).setUp()
+        self.stdlib = self.create_module('puppetlabs-stdlib')
+        self.create_release(self.stdlib, '4.9.0')
+        self.urls = [
+            reverse('modules_json_v1'),
+            reverse('modules_json_v1') + '?q=stdlib',
+            reverse('module_json_v1', args=('puppetlabs', 'stdlib')),
+            reverse('releases_json_v1') + '?module=puppetlabs/stdlib',
+            reverse('modules_v3'),
+            reverse('releases_v3') + '?module=puppetlabs-stdlib',
+        ]
+
+    def test_not_modified(self):
+        """
+        Ensure requests with a current ETag get a 304 response, with only
+        the catalog generation queried.
+        """
+        etags = set()
+        for url in self.urls:
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            self.assertTrue(response.has_header('Last-Modified'))
+            etags.add(response['ETag'])
+
+            with self.assertNumQueries(1):
+                response = self.client.get(
+                    url, HTTP_IF_NONE_MATCH=response['ETag']
+                )
+            self.assertEqual(response.status_code, 304)
+
+        # Every URL has its own ETag.
+        self.assertEqual(len(etags), len(self.urls))
+
+    def test_catalog_changed(self):
+        """
+        Ensure ETags change whenever authors, modules or releases do.
+        """
+        url = reverse('modules_v3')
+
+        def etag():
+            return self.client.get(url)['ETag']
+
+        old_etag = etag()
+        for change in (lambda: self.create_module('puppetlabs-concat'),
+                       lambda: self.create_release(self.stdlib, '4.10.0'),
+                       lambda: self.stdlib.author.save(),
+                       lambda: self.stdlib.releases.all()[0].delete()):
+            generation = CatalogGeneration.objects.get_generation().generation
+            change()
+            self.commit()
+            self.assertGreater(
+                CatalogGeneration.objects.get_generation().generation,
+                generation
+            )
+            new_etag = etag()
+            self.assertNotEqual(new_etag, old_etag)
+            response = self.client.get(url, HTTP_IF_NONE_MATCH=old_etag)
+            self.assertEqual(response.status_code, 200)
+            old_etag = new_etag
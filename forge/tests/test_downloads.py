@@ -0,0 +1,71 @@
+"""
+Tests for serving release tarballs (/system/releases/).
+"""
+import os
+
+from django.test import override_settings
+
+from .utils import ForgeTestCase
+
+
+class TestReleaseTarball(ForgeTestCase):
+
+    def setUp(self):
+        super(TestReleaseTarball, self).setUp()
+        module = self.create_module('puppetlabs-stdlib')
+        self.release = self.create_release(module, '4.9.0')
+        with open(self.release.tarball.path, 'rb') as fh:
+            self.content = fh.read()
+
+    def assertTarballHeaders(self, response):
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], 'application/octet-stream')
+        self.assertFalse(response.has_header('Content-Encoding'))
+        self.assertEqual(response['Content-Disposition'],
+                         'attachment; filename="puppetlabs-stdlib-4.9.0.tar.gz"')
+
+    def test_tarball(self):
+        """
+        Ensure tarballs are streamed when there's no front-end server to
+        hand them off to.
+        """
+        response = self.client.get(self.release.tarball.url)
+        self.assertTarballHeaders(response)
+        self.assertEqual(response['Content-Length'], str(len(self.content)))
+        self.assertEqual(b''.join(response.streaming_content), self.content)
+
+        response = self.client.get(
+            self.release.tarball.url,
+            HTTP_IF_MODIFIED_SINCE=response['Last-Modified']
+        )
+        self.assertEqual(response.status_code, 304)
+
+    def test_not_found(self):
+        """
+        Ensure only the tarballs of releases are served.
+        """
+        for path in ('p/puppetlabs/puppetlabs-stdlib-4.8.0.tar.gz',
+                     'p/puppetlabs/../puppetlabs/other.tar.gz'):
+            response = self.client.get('/system/releases/' + path)
+            self.assertEqual(response.status_code, 404)
+
+        os.remove(self.release.tarball.path)
+        response = self.client.get(self.release.tarball.url)
+        self.assertEqual(response.status_code, 404)
+
+    @override_settings(FORGE_SENDFILE='x-accel-redirect')
+    def test_x_accel_redirect(self):
+        response = self.client.get(self.release.tarball.url)
+        self.assertTarballHeaders(response)
+        self.assertEqual(
+            response['X-Accel-Redirect'],
+            '/internal/releases/p/puppetlabs/puppetlabs-stdlib-4.9.0.tar.gz'
+        )
+        self.assertEqual(response.content, b'')
+
+    @override_settings(FORGE_SENDFILE='x-sendfile')
+    def test_x_sendfile(self):
+        response = self.client.get(self.release.tarball.url)
+        self.assertTarballHeaders(response)
+        self.assertEqual(response['X-Sendfile'], self.release.tarball.path)
+        self.assertEqual(response.content, b'')
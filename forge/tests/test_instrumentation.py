@@ -0,0 +1,90 @@
+"""
+Tests for the request instrumentation.
+"""
+import logging
+
+from django.test import override_settings
+
+from forge import instrumentation
+
+from .utils import ForgeTestCase
+
+
+class ListHandler(logging.Handler):
+
+    def __init__(self):
+        logging.Handler.__init__(self)
+        self.messages = []
+
+    def emit(self, record):
+        self.messages.append(record.getMessage())
+
+
+class TestInstrumentation(ForgeTestCase):
+
+    def setUp(self):
+        super(TestInstrumentation, self).setUp()
+        self.stdlib = self.create_module('puppetlabs-stdlib')
+        self.create_release(self.stdlib, '4.9.0')
+        self.apache = self.create_module('puppetlabs-apache')
+        self.create_release(self.apache, '1.0.0', metadata={
+            'dependencies': [{'name': 'puppetlabs/stdlib',
+                              'version_requirement': '>= 4.0.0'}],
+        })
+
+    def metrics(self, response):
+        return dict(
+            (metric.split(';')[0], metric)
+            for metric in response['Server-Timing'].split(', ')
+        )
+
+    @override_settings(FORGE_INSTRUMENTATION=True)
+    def test_server_timing(self):
+        """
+        Ensure the work done for a request is sent in a `Server-Timing`
+        header and logged.
+        """
+        handler = ListHandler()
+        logger = logging.getLogger('forge.instrumentation')
+        logger.addHandler(handler)
+        self.addCleanup(logger.removeHandler, handler)
+
+        response = self.client.get('/api/v1/releases.json',
+                                   {'module': 'puppetlabs/apache'})
+        self.assertEqual(response.status_code, 200)
+        metrics = self.metrics(response)
+        self.assertEqual(sorted(metrics),
+                         ['dependencies', 'json', 'sql', 'total'])
+        self.assertIn('desc="1 call"', metrics['dependencies'])
+        self.assertRegexpMatches(metrics['sql'],
+                                 r'^sql;dur=\d+\.\d\d;desc="\d+ queries"$')
+
+        self.assertEqual(len(handler.messages), 1)
+        self.assertRegexpMatches(
+            handler.messages[0],
+            r'^GET /api/v1/releases.json\?module=puppetlabs%2Fapache 200 '
+            r'total=\d+\.\d\dms dependencies=1/\d+\.\d\dms '
+        )
+
+    def test_disabled(self):
+        """
+        Ensure nothing is collected without `FORGE_INSTRUMENTATION`.
+        """
+        response = self.client.get('/api/v1/releases.json',
+                                   {'module': 'puppetlabs/apache'})
+        self.assertFalse(response.has_header('Server-Timing'))
+
+    def test_tarball_timings(self):
+        """
+        Ensure reading tarballs is timed, in a single pass that also
+        hashes them.
+        """
+        instrumentation.start()
+        try:
+            self.create_release(self.stdlib, '4.10.0')
+        finally:
+            timings = instrumentation.finish()
+        self.assertEqual(timings.categories['tarball'][0], 1)
+        self.assertNotIn('hash', timings.categories)
+        self.assertGreater(timings.categories['sql'][0], 0)
+        self.assertIsNone(instrumentation.finish())
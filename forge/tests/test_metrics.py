@@ -0,0 +1,141 @@
+"""
+Tests for the Prometheus metrics.
+"""
+import multiprocessing
+import os
+import re
+import shutil
+import tempfile
+
+from django.core.management import call_command
+from django.test import override_settings
+
+from forge import metrics
+
+from .server import FakeForge
+from .utils import ForgeTestCase
+
+
+def increment_counter(count):
+    for i in xrange(count):
+        metrics.inc('forge_sync_md5_failures_total')
+
+
+class TestMetrics(ForgeTestCase):
+
+    def setUp(self):
+        super(TestMetrics, self).setUp()
+        self.metrics_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.metrics_dir)
+        settings_override = override_settings(
+            FORGE_METRICS=True, FORGE_METRICS_DIR=self.metrics_dir
+        )
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+    def samples(self):
+        """
+        Returns a dictionary mapping the samples from `/metrics` to their
+        values.
+        """
+        response = self.client.get('/metrics')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'],
+                         'text/plain; version=0.0.4; charset=utf-8')
+        return dict(
+            line.rsplit(' ', 1) for line in response.content.splitlines()
+            if not line.startswith('#')
+        )
+
+    def test_requests(self):
+        """
+        Ensure requests are counted and timed by URL name.
+        """
+        module = self.create_module('puppetlabs-stdlib')
+        self.create_release(module, '4.9.0')
+        for i in xrange(2):
+            self.client.get('/api/v1/releases.json',
+                            {'module': 'puppetlabs/stdlib'})
+        self.client.get('/v3/modules')
+
+        samples = self.samples()
+        self.assertEqual(samples[
+            'forge_http_requests_total{method="GET",status="200",'
+            'url_name="releases_json_v1"}'
+        ], '2')
+        self.assertEqual(samples[
+            'forge_http_request_duration_seconds_count'
+            '{url_name="releases_json_v1"}'
+        ], '2')
+        self.assertEqual(samples[
+            'forge_http_request_duration_seconds_bucket'
+            '{url_name="modules_v3",le="+Inf"}'
+        ], '1')
+        self.assertEqual(samples[
+            'forge_response_cache_hit_ratio'
+            '{view="forge.views.v1.releases_json"}'
+        ], '0.5')
+        self.assertEqual(samples[
+            'forge_dependency_cache_requests_total{result="miss"}'
+        ], '1')
+        self.assertEqual(samples['forge_dependency_modules_sum'], '1')
+
+    def test_processes(self):
+        """
+        Ensure the metrics of every process add up.
+        """
+        # The database is created before the processes are started, they
+        # only contend for writes to it.
+        metrics.get_store().connection()
+        processes = [multiprocessing.Process(target=increment_counter,
+                                             args=(25,))
+                     for i in xrange(4)]
+        for process in processes:
+            process.start()
+        increment_counter(25)
+        for process in processes:
+            process.join()
+            self.assertEqual(process.exitcode, 0)
+        self.assertEqual(self.samples()['forge_sync_md5_failures_total'],
+                         '125')
+
+    def test_sync(self):
+        """
+        Ensure the progress of `sync_forge` is recorded.
+        """
+        with FakeForge() as forge:
+            forge.add_release('puppetlabs-stdlib', '4.9.0')
+            forge.add_release('puppetlabs-stdlib', '4.10.0')
+            forge.add_release('puppetlabs-apache', '1.0.0', metadata={
+                'dependencies': [{'name': 'puppetlabs/stdlib',
+                                  'version_requirement': '>= 4.0.0'}],
+            })
+            call_command('sync_forge', api_url=forge.url, quiet=True,
+                         throttle=0)
+            tarball_bytes = sum(len(content)
+                                for content in forge.files.values())
+
+        samples = self.samples()
+        for table, count in (('authors', 1), ('modules', 2), ('releases', 3),
+                             ('dependencies', 1)):
+            self.assertEqual(samples[
+                'forge_sync_rows_created_total{table="%s"}' % table
+            ], str(count))
+        self.assertEqual(samples['forge_sync_downloaded_bytes_total'],
+                         str(tarball_bytes))
+        self.assertEqual(samples[
+            'forge_sync_pages_fetched_total{endpoint="releases"}'
+        ], '1')
+        self.assertTrue(
+            re.match(r'^\d+(\.\d+)?$',
+                     samples['forge_sync_last_run_timestamp_seconds'])
+        )
+
+    def test_disabled(self):
+        """
+        Ensure nothing is recorded, or served, without `FORGE_METRICS`.
+        """
+        with override_settings(FORGE_METRICS=False):
+            metrics.inc('forge_sync_md5_failures_total')
+            self.assertEqual(self.client.get('/metrics').status_code, 404)
+        self.assertFalse(os.path.exists(metrics.metrics_path()))
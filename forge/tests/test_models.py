@@ -0,0 +1,241 @@
+"""
+Tests for the Forge models.
+"""
+import hashlib
+
+from django.core.exceptions import ValidationError
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+
+from forge.admin import ReleaseForm
+from forge.dependency import module_generations
+from forge.models import Module, Release, ReleaseDependency
+from forge.storage import tarball_storage
+from forge.tarball import scan_metadata
+
+from .utils import ForgeTestCase, make_archive, make_tarball
+
+
+class TestRelease(ForgeTestCase):
+
+    def setUp(self):
+        super(TestRelease, self).setUp()
+        self.module = self.create_module('puppetlabs-stdlib')
+
+    def test_tarball_data_on_save(self):
+        """
+        Ensure the digests, size and metadata are stored when saved.
+        """
+        release = self.create_release(
+            self.module, '4.9.0', metadata={'project_page': 'http://x'}
+        )
+        with open(release.tarball.path, 'rb') as fh:
+            content = fh.read()
+
+        release = Release.objects.get(pk=release.pk)
+        self.assertEqual(release.file_md5, hashlib.md5(content).hexdigest())
+        self.assertEqual(release.file_sha256,
+                         hashlib.sha256(content).hexdigest())
+        self.assertEqual(release.file_size, len(content))
+        self.assertEqual(release.metadata['project_page'], 'http://x')
+
+    def test_tarball_data_on_upload(self):
+        """
+        Ensure the tarball data is populated for uploaded tarballs, as
+        they're saved.
+        """
+        content = make_tarball('puppetlabs-stdlib', '4.9.0', extra_files=[
+            ('README.md', b'# stdlib\n'),
+        ])
+        release = Release.objects.create(
+            module=self.module, version='4.9.0',
+            tarball=SimpleUploadedFile('puppetlabs-stdlib-4.9.0.tar.gz',
+                                       content)
+        )
+        self.assertEqual(release.tarball.name,
+                         'p/puppetlabs/puppetlabs-stdlib-4.9.0.tar.gz')
+        self.assertEqual(release.file_md5, hashlib.md5(content).hexdigest())
+        self.assertEqual(release.file_size, len(content))
+        self.assertEqual(release.metadata['version'], '4.9.0')
+        self.assertIsNotNone(release.metadata_offset)
+        self.assertEqual(release.readme, u'# stdlib\n')
+        self.assertEqual(release.changelog, u'')
+
+    def test_invalid_upload(self):
+        """
+        Ensure an uploaded tarball without valid metadata is rejected, and
+        isn't left in storage.
+        """
+        invalid = [
+            make_archive([('README.md', b'# stdlib\n')]),
+            make_archive([('metadata.json', b'{"name": ')]),
+            b'not a tarball',
+        ]
+        for content in invalid:
+            upload = SimpleUploadedFile('puppetlabs-stdlib-9.9.9.tar.gz',
+                                        content)
+            with self.assertRaises(ValidationError) as cm:
+                Release.objects.create(module=self.module, version='9.9.9',
+                                       tarball=upload)
+            self.assertIn('tarball', cm.exception.message_dict)
+            self.assertFalse(Release.objects.exists())
+            self.assertFalse(tarball_storage.exists(
+                'p/puppetlabs/puppetlabs-stdlib-9.9.9.tar.gz'
+            ))
+
+            upload.seek(0)
+            form = ReleaseForm(
+                {'module': self.module.pk, 'version': '9.9.9'},
+                {'tarball': upload},
+            )
+            self.assertFalse(form.is_valid())
+            self.assertIn('tarball', form.errors)
+
+        content = make_tarball('puppetlabs-stdlib', '9.9.9')
+        form = ReleaseForm(
+            {'module': self.module.pk, 'version': '9.9.9'},
+            {'tarball': SimpleUploadedFile('puppetlabs-stdlib-9.9.9.tar.gz',
+                                           content)},
+        )
+        self.assertTrue(form.is_valid(), form.errors)
+        release = form.save()
+        self.assertEqual(release.file_md5, hashlib.md5(content).hexdigest())
+
+    def test_metadata_offset(self):
+        """
+        Ensure the metadata of releases that haven't got it stored is read
+        from the offset stored for their tarball.
+        """
+        content = make_archive([
+            ('puppetlabs-stdlib-4.9.0/README.md', b'# stdlib\n' * 1000),
+            ('puppetlabs-stdlib-4.9.0/metadata.json',
+             b'{"name": "puppetlabs-stdlib", "version": "4.9.0"}'),
+        ])
+        release = Release.objects.create(
+            module=self.module, version='4.9.0',
+            tarball=SimpleUploadedFile('puppetlabs-stdlib-4.9.0.tar.gz',
+                                       content)
+        )
+        Release.objects.filter(pk=release.pk).update(metadata_json='')
+
+        unread = Release.objects.get(pk=release.pk)
+        self.assertGreater(unread.metadata_offset, 9000)
+        # The offset is that of the `metadata.json` header, rather than
+        # needing the fallback of reading the whole tarball.
+        self.assertEqual(scan_metadata(unread.tarball.path,
+                                       unread.metadata_offset),
+                         release.metadata_json)
+        self.assertEqual(unread.metadata, release.metadata)
+
+    def test_backfill_releases(self):
+        """
+        Ensure the `backfill_releases` command populates missing data.
+        """
+        release = self.create_release(self.module, '4.9.0')
+        Release.objects.filter(pk=release.pk).update(
+            file_md5='', file_sha256='', file_size=0, metadata_json='',
+            metadata_offset=None
+        )
+        self.assertEqual(Release.objects.get(pk=release.pk).metadata,
+                         release.metadata)
+
+        call_command('backfill_releases', workers=2, verbosity=0)
+        backfilled = Release.objects.get(pk=release.pk)
+        self.assertEqual(backfilled.file_md5, release.file_md5)
+        self.assertEqual(backfilled.file_sha256, release.file_sha256)
+        self.assertEqual(backfilled.file_size, release.file_size)
+        self.assertEqual(backfilled.metadata_json, release.metadata_json)
+        self.assertEqual(backfilled.metadata_offset, release.metadata_offset)
+
+
+class TestModule(ForgeTestCase):
+
+    def setUp(self):
+        super(TestModule, self).setUp()
+        self.module = self.create_module('puppetlabs-stdlib')
+
+    def get_current_release(self):
+        return Module.objects.get(pk=self.module.pk).current_release
+
+    def test_current_release(self):
+        """
+        Ensure the current release is kept up to date as releases are
+        created and deleted, and prefers releases that aren't pre-releases.
+        """
+        self.assertIsNone(self.get_current_release())
+
+        rc = self.create_release(self.module, '1.0.0-rc1')
+        self.assertEqual(self.get_current_release(), rc)
+
+        first = self.create_release(self.module, '1.0.0')
+        self.assertEqual(self.get_current_release(), first)
+
+        self.create_release(self.module, '2.0.0-rc1')
+        self.assertEqual(self.get_current_release(), first)
+
+        second = self.create_release(self.module, '1.1.0')
+        self.assertEqual(self.get_current_release(), second)
+
+        second.delete()
+        self.assertEqual(self.get_current_release(), first)
+
+        Release.objects.exclude(version='1.0.0-rc1').delete()
+        self.assertEqual(self.get_current_release(), rc)
+
+        rc.delete()
+        self.assertIsNone(self.get_current_release())
+
+    def test_update_current_releases(self):
+        """
+        Ensure the `update_current_releases` command repairs the current
+        release of modules.
+        """
+        release = self.create_release(self.module, '1.0.0')
+        Module.objects.update(current_release=None)
+
+        call_command('update_current_releases', verbosity=0)
+        self.assertEqual(self.get_current_release(), release)
+
+
+class TestReleaseDependency(ForgeTestCase):
+
+    def setUp(self):
+        super(TestReleaseDependency, self).setUp()
+        self.module = self.create_module('puppetlabs-apache')
+        self.release = self.create_release(self.module, '1.5.0', metadata={
+            'dependencies': [{'name': 'puppetlabs/stdlib',
+                              'version_requirement': '>= 4.0.0'},
+                             {'name': 'puppetlabs/concat'}],
+        })
+
+    def dependencies(self):
+        return list(ReleaseDependency.objects.filter(
+            release=self.release
+        ).values_list('name', 'spec'))
+
+    def test_dependencies_on_save(self):
+        """
+        Ensure the dependencies in a release's metadata are stored.
+        """
+        self.assertEqual(self.dependencies(),
+                         [('puppetlabs/stdlib', '>= 4.0.0'),
+                          ('puppetlabs/concat', '>= 0.0.0')])
+
+    def test_backfill_dependencies(self):
+        """
+        Ensure the `backfill_releases` command rebuilds the dependencies
+        from stored metadata.
+        """
+        ReleaseDependency.objects.all().delete()
+        generations = module_generations([self.module.pk])
+        call_command('backfill_releases', dependencies=True, verbosity=0)
+        self.assertEqual(len(self.dependencies()), 2)
+        # The dependencies cached for the module's releases are invalid.
+        self.assertNotEqual(module_generations([self.module.pk]),
+                            generations)
+
+        generations = module_generations([self.module.pk])
+        Release.objects.update(file_md5='')
+        call_command('backfill_releases', verbosity=0)
+        self.assertNotEqual(module_generations([self.module.pk]),
+                            generations)
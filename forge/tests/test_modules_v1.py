@@ -1,11 +1,18 @@
 """
 Tests for the Forge modules resource (/modules.json).
 """
+import functools
 import json
 
 from django.core.urlresolvers import reverse
 from django.test import TestCase
 
+from forge.models import Module
+from forge.views import v1
+from forge.views.utils import queryset_chunks
+
+from .utils import ForgeTestCase
+
 
 class TestModulesResourceV1(TestCase):
 
@@ -15,4 +22,63 @@ class TestModulesResourceV1(TestCase):
         """
         response = self.client.get(reverse('modules_json_v1'))
         self.assertEqual(response['Content-Type'], 'application/json')
-        self.assertEqual(json.loads(response.content), [])
+        self.assertEqual(json.loads(''.join(response.streaming_content)), [])
+
+
+class TestModulesListV1(ForgeTestCase):
+
+    def setUp(self):
+        super(TestModulesListV1, self).setUp()
+        for full_name in ('puppetlabs-stdlib', 'example42-apache',
+                          'puppetlabs-concat', 'jfryman-nginx'):
+            module = self.create_module(full_name, tags='web proxy')
+            self.create_release(module, '1.0.0')
+            self.create_release(module, '1.1.0', metadata={
+                'project_page': 'https://example.com/%s' % full_name,
+            })
+
+    def test_modules(self):
+        """
+        Ensure all modules are streamed, ordered by author.
+        """
+        response = self.client.get(reverse('modules_json_v1'))
+        modules = json.loads(''.join(response.streaming_content))
+        self.assertEqual([module['author'] for module in modules],
+                         ['example42', 'jfryman', 'puppetlabs', 'puppetlabs'])
+        nginx = modules[1]
+        self.assertEqual(nginx['full_name'], 'jfryman/nginx')
+        self.assertEqual(nginx['version'], '1.1.0')
+        self.assertEqual(nginx['project_url'],
+                         'https://example.com/jfryman-nginx')
+        self.assertEqual(nginx['releases'],
+                         [{'version': '1.1.0'}, {'version': '1.0.0'}])
+        self.assertEqual(nginx['tag_list'], ['web', 'proxy'])
+
+    def test_queryset_chunks(self):
+        """
+        Ensure chunked iteration preserves the order of the queryset, and
+        uses a constant number of queries per chunk.
+        """
+        qs = Module.objects.order_by('-name')
+        with self.assertNumQueries(3):
+            modules = list(queryset_chunks(qs, chunk_size=2))
+        self.assertEqual(modules, list(qs))
+
+    def test_module_deleted_while_streaming(self):
+        """
+        Ensure modules deleted after the response has started streaming are
+        left out of it, rather than cutting it short.
+        """
+        self.addCleanup(setattr, v1, 'queryset_chunks', queryset_chunks)
+        v1.queryset_chunks = functools.partial(queryset_chunks, chunk_size=1)
+
+        response = self.client.get(reverse('modules_json_v1'))
+        content = iter(response.streaming_content)
+        streamed = [next(content), next(content)]
+        Module.objects.get(author__name='jfryman', name='nginx').delete()
+        streamed.extend(content)
+
+        modules = json.loads(''.join(streamed))
+        self.assertEqual([module['full_name'] for module in modules],
+                         ['example42/apache', 'puppetlabs/stdlib',
+                          'puppetlabs/concat'])
@@ -0,0 +1,130 @@
+"""
+Tests for the Forge v3 modules resource (/v3/modules).
+"""
+import json
+
+from django.core.urlresolvers import reverse
+
+from forge.views.v3 import encode_cursor
+
+from .utils import ForgeTestCase
+
+
+class TestModulesResourceV3(ForgeTestCase):
+
+    def create_modules(self, count, author='puppetlabs'):
+        for i in range(count):
+            module = self.create_module('%s-mod%d' % (author, i))
+            self.create_release(module, '1.0.0')
+            self.create_release(module, '1.1.0')
+            self.create_release(module, '2.0.0-rc1')
+
+    def test_current_release(self):
+        """
+        Ensure the current release is the latest non pre-release version.
+        """
+        self.create_modules(1)
+        response = self.client.get(reverse('modules_v3'))
+        data = json.loads(response.content)
+        self.assertEqual(data['pagination']['total'], 1)
+        result = data['results'][0]
+        self.assertEqual(result['name'], 'mod0')
+        self.assertEqual(result['owner'], {'username': 'puppetlabs'})
+        self.assertEqual(result['current_release']['version'], '1.1.0')
+        self.assertEqual(result['current_release']['module'],
+                         {'name': 'mod0', 'owner': {'username': 'puppetlabs'}})
+
+    def test_query_count(self):
+        """
+        Ensure the number of queries doesn't grow with the number of modules
+        and releases on the page.
+        """
+        # One of the queries is for the catalog generation.
+        self.create_modules(2)
+        with self.assertNumQueries(3):
+            response = self.client.get(reverse('modules_v3'))
+        self.assertEqual(len(json.loads(response.content)['results']), 2)
+
+        self.create_modules(5, author='example42')
+        with self.assertNumQueries(3):
+            response = self.client.get(reverse('modules_v3'))
+        self.assertEqual(len(json.loads(response.content)['results']), 7)
+
+    def get_page(self, url):
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return json.loads(response.content)
+
+    def test_cursor_pagination(self):
+        """
+        Ensure modules are paginated with cursors in order of their author,
+        including modules with the same author.
+        """
+        self.create_modules(4)
+        self.create_modules(3, author='example42')
+        data = self.get_page(reverse('modules_v3') + '?limit=3')
+        self.assertIsNone(data['pagination']['previous'])
+
+        names = []
+        offsets = []
+        while True:
+            names.extend('%s-%s' % (module['owner']['username'],
+                                    module['name'])
+                         for module in data['results'])
+            offsets.append(data['pagination']['offset'])
+            self.assertEqual(data['pagination']['total'], 7)
+            if not data['pagination']['next']:
+                break
+            self.assertIn('cursor=', data['pagination']['next'])
+            self.assertNotIn('offset=', data['pagination']['next'])
+            data = self.get_page(data['pagination']['next'])
+
+        self.assertEqual(names, [
+            'example42-mod0', 'example42-mod1', 'example42-mod2',
+            'puppetlabs-mod0', 'puppetlabs-mod1', 'puppetlabs-mod2',
+            'puppetlabs-mod3',
+        ])
+        self.assertEqual(offsets, [0, 3, 6])
+        self.assertEqual(data['pagination']['previous'],
+                         reverse('modules_v3') + '?limit=3&offset=3')
+
+        # Offsets may still be used.
+        data = self.get_page(reverse('modules_v3') + '?limit=3&offset=5')
+        self.assertEqual([module['name'] for module in data['results']],
+                         ['mod2', 'mod3'])
+
+    def test_cursor_query_count(self):
+        """
+        Ensure the total is only counted for the first page.
+        """
+        self.create_modules(3)
+        data = self.get_page(reverse('modules_v3') + '?limit=1')
+        with self.assertNumQueries(2):
+            data = self.get_page(data['pagination']['next'])
+        self.assertEqual(data['pagination']['total'], 3)
+        self.assertEqual(data['results'][0]['name'], 'mod1')
+
+    def test_invalid_cursor(self):
+        cursors = ['invalid', 'eyJrIjoxfQ']
+        # Cursors with values of the wrong type or number for the author
+        # name and primary key.
+        for values in (['x', 'abc'], [None, None], [{'a': 1}, 1],
+                       ['x', True], ['x'], ['x', 1, 2]):
+            cursors.append(encode_cursor(values, 1))
+        for cursor in cursors:
+            response = self.client.get(reverse('modules_v3') +
+                                       '?cursor=%s' % cursor)
+            self.assertEqual(response.status_code, 400)
+
+    def test_search_pagination(self):
+        """
+        Ensure search results are paginated by offset.
+        """
+        self.create_modules(3)
+        data = self.get_page(reverse('modules_v3') +
+                             '?query=puppetlabs&limit=2')
+        self.assertEqual(data['pagination']['total'], 3)
+        self.assertIn('offset=2', data['pagination']['next'])
+        data = self.get_page(data['pagination']['next'])
+        self.assertEqual(len(data['results']), 1)
+        self.assertIsNone(data['pagination']['next'])
@@ -1,8 +1,19 @@
 """
 Tests for the Forge releases resource (/api/v1/releases.json).
 """
+import json
+from unittest import skipUnless
+
+from django.core.files.uploadedfile import SimpleUploadedFile
 from django.core.urlresolvers import reverse
-from django.test import TestCase
+from django.db import transaction
+from django.test import TestCase, override_settings
+
+from forge import dependency
+from forge.dependency import release_dependencies
+from forge.models import CatalogGeneration, Release
+
+from .utils import ForgeTestCase, make_tarball
 
 
 class TestReleasesResourceV1(TestCase):
@@ -41,3 +52,206 @@ class TestReleasesResourceV1(TestCase):
         self.assertEqual(response['Content-Type'], 'application/json')
         self.assertContains(response, 'Module %s not found' % fake_module,
                             status_code=410)
+
+
+class TestReleaseDependenciesV1(ForgeTestCase):
+
+    def setUp(self):
+        super(TestReleaseDependenciesV1, self).setUp()
+        self.stdlib = self.create_module('puppetlabs-stdlib')
+        self.concat = self.create_module('puppetlabs-concat')
+        self.apache = self.create_module('puppetlabs-apache')
+
+        for version in ('3.2.0', '4.0.0', '4.1.0', '5.0.0'):
+            self.create_release(self.stdlib, version)
+        self.create_release(self.concat, '1.2.0', metadata={
+            'dependencies': [{'name': 'puppetlabs/stdlib',
+                              'version_requirement': '>= 4.0.0'}],
+        })
+        self.create_release(self.apache, '1.5.0', metadata={
+            'dependencies': [{'name': 'puppetlabs/stdlib',
+                              'version_requirement': '>= 3.2.0 < 5.0.0'},
+                             {'name': 'puppetlabs/concat',
+                              'version_requirement': '1.x'}],
+        })
+
+    def get_dependencies(self, module='puppetlabs/apache'):
+        response = self.client.get(
+            reverse('releases_json_v1') + '?module=%s' % module
+        )
+        self.assertEqual(response.status_code, 200)
+        return json.loads(response.content)
+
+    def versions(self, dependencies):
+        return dict((name, sorted(release['version'] for release in releases))
+                    for name, releases in dependencies.items())
+
+    def test_dependencies(self):
+        """
+        Ensure the releases satisfying every dependency are returned.
+        """
+        dependencies = self.get_dependencies()
+        self.assertEqual(self.versions(dependencies), {
+            'puppetlabs/apache': ['1.5.0'],
+            'puppetlabs/concat': ['1.2.0'],
+            'puppetlabs/stdlib': ['4.0.0', '4.1.0'],
+        })
+        self.assertEqual(dependencies['puppetlabs/concat'][0]['dependencies'],
+                         [['puppetlabs/stdlib', '>= 4.0.0']])
+
+    @override_settings(
+        CACHES={
+            'default': {
+                'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+            },
+            'dummy': {
+                'BACKEND': 'django.core.cache.backends.dummy.DummyCache',
+            },
+        },
+        FORGE_RESPONSE_CACHE='dummy'
+    )
+    def test_dependencies_cached(self):
+        """
+        Ensure dependencies are cached, and invalidated when releases of
+        a module in the dependencies are added or removed; responses
+        aren't cached, so that the dependency cache is used.
+        """
+        # Looking up the module and release, after the catalog generation.
+        self.get_dependencies()
+        with self.assertNumQueries(3):
+            self.get_dependencies()
+
+        release = self.create_release(self.stdlib, '4.2.0')
+        self.assertEqual(
+            self.versions(self.get_dependencies())['puppetlabs/stdlib'],
+            ['4.0.0', '4.1.0', '4.2.0']
+        )
+
+        release.delete()
+        self.commit()
+        self.assertEqual(
+            self.versions(self.get_dependencies())['puppetlabs/stdlib'],
+            ['4.0.0', '4.1.0']
+        )
+
+    @override_settings(
+        CACHES={
+            'default': {
+                'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+            },
+            'dummy': {
+                'BACKEND': 'django.core.cache.backends.dummy.DummyCache',
+            },
+        },
+        FORGE_RESPONSE_CACHE='dummy'
+    )
+    def test_dependencies_saved_while_resolving(self):
+        """
+        Ensure dependencies resolved while a release of one of their modules
+        is saved aren't served from the cache afterwards.
+        """
+        calculate_dependencies = dependency.calculate_dependencies
+        self.addCleanup(setattr, dependency, 'calculate_dependencies',
+                        calculate_dependencies)
+
+        def calculate_and_save(*args, **kwargs):
+            result = calculate_dependencies(*args, **kwargs)
+            dependency.calculate_dependencies = calculate_dependencies
+            self.create_release(self.stdlib, '4.2.0')
+            return result
+        dependency.calculate_dependencies = calculate_and_save
+
+        self.assertEqual(
+            self.versions(self.get_dependencies())['puppetlabs/stdlib'],
+            ['4.0.0', '4.1.0']
+        )
+        self.assertEqual(
+            self.versions(self.get_dependencies())['puppetlabs/stdlib'],
+            ['4.0.0', '4.1.0', '4.2.0']
+        )
+
+    @skipUnless(hasattr(transaction, 'on_commit'),
+                "Django 1.8 can't wait for the commit.")
+    @override_settings(
+        CACHES={
+            'default': {
+                'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+            },
+            'dummy': {
+                'BACKEND': 'django.core.cache.backends.dummy.DummyCache',
+            },
+        },
+        FORGE_RESPONSE_CACHE='dummy'
+    )
+    def test_dependencies_resolved_before_commit(self):
+        """
+        Ensure dependencies resolved after a release of one of their modules
+        is saved, but before it's committed, aren't served from the cache
+        once it is; other connections resolved them without the release.
+        """
+        calculate_dependencies = dependency.calculate_dependencies
+        self.addCleanup(setattr, dependency, 'calculate_dependencies',
+                        calculate_dependencies)
+        calculated = []
+
+        def calculate_and_count(*args, **kwargs):
+            calculated.append(args)
+            return calculate_dependencies(*args, **kwargs)
+        dependency.calculate_dependencies = calculate_and_count
+
+        generation = CatalogGeneration.objects.get_generation().generation
+        Release.objects.create(
+            module=self.stdlib, version='4.2.0',
+            tarball=SimpleUploadedFile(
+                'puppetlabs-stdlib-4.2.0.tar.gz',
+                make_tarball('puppetlabs-stdlib', '4.2.0')
+            )
+        )
+        self.get_dependencies()
+        self.get_dependencies()
+        self.assertEqual(len(calculated), 1)
+        self.assertEqual(
+            CatalogGeneration.objects.get_generation().generation, generation
+        )
+
+        self.commit()
+        self.assertEqual(
+            self.versions(self.get_dependencies())['puppetlabs/stdlib'],
+            ['4.0.0', '4.1.0', '4.2.0']
+        )
+        self.assertEqual(len(calculated), 2)
+        self.assertGreater(
+            CatalogGeneration.objects.get_generation().generation, generation
+        )
+
+    def test_dependencies_query_count(self):
+        """
+        Ensure the number of queries used to calculate dependencies grows
+        with the depth of the dependency graph rather than its edges.
+        """
+        def get_release(version):
+            return Release.objects.select_related('module__author').get(
+                module=self.apache, version=version
+            )
+
+        # The modules, releases and release dependencies for each level of
+        # the graph are loaded with three queries.
+        release = get_release('1.5.0')
+        with self.assertNumQueries(6):
+            release_dependencies(release)
+
+        dependencies = [{'name': 'puppetlabs/stdlib'},
+                        {'name': 'puppetlabs/concat'}]
+        for name in ('firewall', 'mysql', 'ntp'):
+            module = self.create_module('puppetlabs-%s' % name)
+            self.create_release(module, '1.0.0', metadata={
+                'dependencies': [{'name': 'puppetlabs/stdlib'}],
+            })
+            dependencies.append({'name': 'puppetlabs/%s' % name})
+        self.create_release(self.apache, '1.6.0',
+                            metadata={'dependencies': dependencies})
+
+        release = get_release('1.6.0')
+        with self.assertNumQueries(6):
+            dependencies = release_dependencies(release)
+        self.assertEqual(len(dependencies), 6)
@@ -0,0 +1,101 @@
+"""
+Tests for the Forge v3 releases resource (/v3/releases).
+"""
+import json
+
+from django.core.urlresolvers import reverse
+
+from forge.views.v3 import encode_cursor
+
+from .utils import ForgeTestCase
+
+
+class TestReleasesResourceV3(ForgeTestCase):
+
+    def setUp(self):
+        super(TestReleasesResourceV3, self).setUp()
+        self.stdlib = self.create_module('puppetlabs-stdlib')
+        self.concat = self.create_module('puppetlabs-concat')
+        self.apache = self.create_module('puppetlabs-apache')
+
+        self.create_release(self.stdlib, '4.0.0')
+        self.create_release(self.concat, '1.2.0', metadata={
+            'dependencies': [{'name': 'puppetlabs-stdlib',
+                              'version_requirement': '>= 4.0.0'}],
+        })
+        self.create_release(self.apache, '1.5.0', metadata={
+            'dependencies': [{'name': 'puppetlabs/stdlib'},
+                             {'name': 'puppetlabs/concat'}],
+        })
+
+    def get_releases(self, query):
+        response = self.client.get(reverse('releases_v3') + query)
+        return response, json.loads(response.content)
+
+    def test_module(self):
+        """
+        Ensure releases may be filtered by module.
+        """
+        response, data = self.get_releases('?module=puppetlabs-concat')
+        self.assertEqual(data['pagination']['total'], 1)
+        self.assertEqual(data['results'][0]['version'], '1.2.0')
+        self.assertEqual(data['results'][0]['module']['name'], 'concat')
+
+    def test_depends_on(self):
+        """
+        Ensure releases may be filtered by the modules they depend on,
+        however the dependency is named in their metadata.
+        """
+        response, data = self.get_releases('?depends_on=puppetlabs/stdlib')
+        self.assertEqual(
+            sorted(result['module']['name'] for result in data['results']),
+            ['apache', 'concat']
+        )
+
+        response, data = self.get_releases('?depends_on=puppetlabs-concat')
+        self.assertEqual(
+            [result['module']['name'] for result in data['results']],
+            ['apache']
+        )
+        self.assertIn('depends_on=puppetlabs-concat',
+                      data['pagination']['first'])
+
+        response, data = self.get_releases('?depends_on=puppetlabs-apache')
+        self.assertEqual(data['results'], [])
+
+    def test_depends_on_invalid(self):
+        """
+        Ensure invalid module names aren't accepted for dependencies.
+        """
+        response, data = self.get_releases('?depends_on=invalid')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(data['errors'],
+                         ["'invalid' is not a valid full modulename"])
+
+    def test_cursor_pagination(self):
+        """
+        Ensure releases are paginated with cursors, keeping the filters.
+        """
+        response, data = self.get_releases(
+            '?depends_on=puppetlabs/stdlib&limit=1'
+        )
+        names = [data['results'][0]['module']['name']]
+        self.assertIn('depends_on=puppetlabs%2Fstdlib',
+                      data['pagination']['next'])
+
+        response = self.client.get(data['pagination']['next'])
+        data = json.loads(response.content)
+        names.append(data['results'][0]['module']['name'])
+        self.assertEqual(data['pagination']['offset'], 1)
+        self.assertEqual(data['pagination']['total'], 2)
+        self.assertIsNone(data['pagination']['next'])
+        self.assertEqual(names, ['concat', 'apache'])
+
+    def test_invalid_cursor(self):
+        cursors = ['invalid', 'eyJrIjoxfQ']
+        for values in (['abc'], [None], [{'a': 1}], [1.5], ['x', 1]):
+            cursors.append(encode_cursor(values, 1))
+        for cursor in cursors:
+            response, data = self.get_releases('?cursor=%s' % cursor)
+            self.assertEqual(response.status_code, 400)
+            self.assertEqual(data['errors'], ['Invalid cursor'])
@@ -0,0 +1,113 @@
+"""
+Tests for caching the responses of the v1 and v3 JSON APIs.
+"""
+import shutil
+import tempfile
+import threading
+
+from django.core.urlresolvers import reverse
+from django.test import RequestFactory, override_settings
+
+from forge import metrics
+from forge.models import CatalogGeneration
+from forge.views.utils import response_cache, response_cache_key
+
+from .utils import ForgeTestCase
+
+
+class TestResponseCache(ForgeTestCase):
+
+    def setUp(self):
+        super(TestResponseCache, self).setUp()
+        self.stdlib = self.create_module('puppetlabs-stdlib')
+        self.create_release(self.stdlib, '4.9.0')
+
+        # Hits and misses are counted in the metrics.
+        metrics_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, metrics_dir)
+        settings_override = override_settings(
+            FORGE_METRICS=True, FORGE_METRICS_DIR=metrics_dir
+        )
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+    def stats(self, view_name):
+        labels = metrics.format_labels({'view': 'forge.views.%s' % view_name})
+        values = dict((name, value) for name, value_labels, le, value
+                      in metrics.get_store().values()
+                      if value_labels == labels)
+        return {
+            'hits': values.get('forge_response_cache_hits_total', 0),
+            'misses': values.get('forge_response_cache_misses_total', 0),
+        }
+
+    def test_cached(self):
+        """
+        Ensure responses are cached until the catalog changes, no matter
+        the order of the query parameters.
+        """
+        url = reverse('releases_v3')
+        stats = self.stats('v3.releases')
+        response = self.client.get(url + '?module=puppetlabs-stdlib&limit=5')
+        self.assertEqual(self.stats('v3.releases')['misses'],
+                         stats['misses'] + 1)
+
+        # Only the catalog generation is queried.
+        with self.assertNumQueries(1):
+            cached = self.client.get(url + '?limit=5&module=puppetlabs-stdlib')
+        self.assertEqual(cached.content, response.content)
+        self.assertEqual(cached['Content-Type'], response['Content-Type'])
+        self.assertEqual(cached['ETag'], response['ETag'])
+        self.assertEqual(self.stats('v3.releases')['hits'], stats['hits'] + 1)
+
+        self.create_release(self.stdlib, '4.10.0')
+        response = self.client.get(url + '?module=puppetlabs-stdlib&limit=5')
+        self.assertIn('4.10.0', response.content)
+        self.assertEqual(self.stats('v3.releases')['misses'],
+                         stats['misses'] + 2)
+
+    def test_errors_cached(self):
+        """
+        Ensure error responses keep their status when cached.
+        """
+        url = reverse('releases_json_v1') + '?module=puppetlabs/missing'
+        self.assertEqual(self.client.get(url).status_code, 410)
+        with self.assertNumQueries(1):
+            self.assertEqual(self.client.get(url).status_code, 410)
+
+    def test_streaming_not_cached(self):
+        """
+        Ensure the streamed `/modules.json` isn't cached.
+        """
+        self.client.get(reverse('modules_json_v1'))
+        self.assertEqual(self.stats('v1.modules_json'),
+                         {'hits': 0, 'misses': 0})
+
+    @override_settings(FORGE_RESPONSE_CACHE_LOCK_WAIT=5)
+    def test_stampede(self):
+        """
+        Ensure requests wait for a response that's being computed, rather
+        than computing it themselves.
+        """
+        url = reverse('modules_v3')
+        response = self.client.get(url)
+        self.create_module('puppetlabs-concat')
+
+        # Another request is computing the response, which is cached
+        # while this request waits for it.
+        cache = response_cache()
+        request = RequestFactory().get(url)
+        key = response_cache_key(
+            request, 'forge.views.v3.modules',
+            CatalogGeneration.objects.get_generation().generation
+        )
+        self.assertTrue(cache.add(key + ':lock', 1))
+        timer = threading.Timer(0.2, cache.set, (key, (
+            response.content, response['Content-Type'], 200
+        )))
+        timer.start()
+        self.addCleanup(timer.cancel)
+
+        with self.assertNumQueries(1):
+            waited = self.client.get(url)
+        self.assertEqual(waited.content, response.content)
@@ -0,0 +1,169 @@
+"""
+Tests for the module search backends.
+"""
+import json
+
+from django.core.urlresolvers import reverse
+from django.test import override_settings
+
+from forge.models import Author, Module, Release
+from forge.search import SQLiteSearchBackend, get_backend, search_modules
+
+from .utils import ForgeTestCase, benchmark, report, timed
+
+
+class SearchTestMixin(object):
+
+    def setUp(self):
+        super(SearchTestMixin, self).setUp()
+        self.apache = self.create_module(
+            'puppetlabs-apache', tags='apache web',
+            desc='Installs, configures, and manages Apache virtual hosts.'
+        )
+        self.nginx = self.create_module(
+            'jfryman-nginx', tags='nginx web proxy',
+            desc='Puppet NGINX management module, an alternative to apache.'
+        )
+        self.stdlib = self.create_module(
+            'puppetlabs-stdlib', desc='Standard library of resources.'
+        )
+
+    def search(self, query):
+        return list(search_modules(query))
+
+    def test_search_fields(self):
+        """
+        Ensure modules are found by name, author, tags and description.
+        """
+        self.assertEqual(self.search('stdlib'), [self.stdlib])
+        self.assertEqual(self.search('jfryman'), [self.nginx])
+        self.assertEqual(self.search('proxy'), [self.nginx])
+        self.assertEqual(self.search('resources'), [self.stdlib])
+        self.assertEqual(self.search('doesnotexist'), [])
+
+    def test_substring_fallback(self):
+        """
+        Ensure parts of words and release versions match when nothing
+        matches whole words.
+        """
+        self.create_release(self.stdlib, '4.9.0')
+        self.assertEqual(self.search('lib'), [self.stdlib])
+        self.assertEqual(self.search('4.9'), [self.stdlib])
+        self.assertEqual(self.search('-'), [])
+
+    def test_search_updates(self):
+        """
+        Ensure the search results reflect changes to modules and authors.
+        """
+        self.stdlib.tags = 'functions'
+        self.stdlib.save()
+        self.assertEqual(self.search('functions'), [self.stdlib])
+
+        author = Author.objects.get(name='jfryman')
+        author.name = 'voxpupuli'
+        author.save()
+        self.assertEqual(self.search('voxpupuli'), [self.nginx])
+
+        self.nginx.delete()
+        self.assertEqual(self.search('proxy'), [])
+
+    def test_modules_views(self):
+        """
+        Ensure the v1 and v3 module views use the search backend.
+        """
+        response = self.client.get(reverse('modules_json_v1') + '?q=proxy')
+        modules = json.loads(''.join(response.streaming_content))
+        self.assertEqual([module['full_name'] for module in modules],
+                         ['jfryman/nginx'])
+
+        response = self.client.get(reverse('modules_v3') + '?query=proxy')
+        data = json.loads(response.content)
+        self.assertEqual(data['pagination']['total'], 1)
+        self.assertEqual(data['results'][0]['name'], 'nginx')
+
+
+@override_settings(FORGE_SEARCH_BACKEND='forge.search.SearchBackend')
+class TestSearchBackend(SearchTestMixin, ForgeTestCase):
+    pass
+
+
+@override_settings(FORGE_SEARCH_BACKEND='forge.search.SQLiteSearchBackend')
+class TestSQLiteSearchBackend(SearchTestMixin, ForgeTestCase):
+
+    def test_ranking(self):
+        """
+        Ensure modules with matching names rank higher than those with
+        matching descriptions.
+        """
+        self.assertEqual(self.search('apache'), [self.apache, self.nginx])
+
+    def test_prefix(self):
+        """
+        Ensure partially typed terms match.
+        """
+        self.assertEqual(self.search('ngin'), [self.nginx])
+        self.assertEqual(self.search('puppetlabs std'), [self.stdlib])
+
+    def test_rebuild(self):
+        """
+        Ensure the index can be rebuilt from scratch.
+        """
+        backend = get_backend()
+        backend.remove(Module.objects.values_list('pk', flat=True))
+        self.assertEqual(list(backend.match(Module.objects.all(),
+                                            ['stdlib'])), [])
+        backend.rebuild()
+        self.assertEqual(list(backend.match(Module.objects.all(),
+                                            ['stdlib'])), [self.stdlib])
+
+
+@benchmark
+class SearchBenchmark(ForgeTestCase):
+    """
+    Compares substring and full-text search over a synthetic catalog of
+    10,000 modules with 30,000 releases.
+    """
+    words = ('apache', 'nginx', 'mysql', 'postgresql', 'java', 'firewall',
+             'ntp', 'ssh', 'docker', 'redis', 'haproxy', 'users', 'sudo',
+             'logrotate', 'collectd', 'rabbitmq', 'memcached', 'zookeeper')
+
+    def setUp(self):
+        super(SearchBenchmark, self).setUp()
+        authors = Author.objects.bulk_create(
+            [Author(name='author%d' % i) for i in xrange(500)]
+        )
+        authors = list(Author.objects.all())
+        modules = []
+        for i in xrange(10000):
+            word = self.words[i % len(self.words)]
+            modules.append(Module(
+                author=authors[i % len(authors)],
+                name='%s%d' % (word, i),
+                tags=' '.join(self.words[(i + j) % len(self.words)]
+                              for j in xrange(3)),
+                desc='Installs and manages %s, module number %d.' % (word, i),
+            ))
+        Module.objects.bulk_create(modules)
+        Release.objects.bulk_create([
+            Release(module=module, version=version, tarball='%s.tar.gz' % i)
+            for i, module in enumerate(Module.objects.all())
+            for version in ('1.0.0', '1.1.0', '2.0.0')
+        ])
+        SQLiteSearchBackend().rebuild()
+
+    def run_search(self, query):
+        # Evaluate the first page of results, along with the total count,
+        # as the v3 modules view does.
+        qs = search_modules(query)
+        qs.count()
+        list(qs[:20])
+
+    def test_search(self):
+        for query in ('zookeeper', 'author42', 'manages', 'doesnotexist'):
+            with self.settings(
+                    FORGE_SEARCH_BACKEND='forge.search.SearchBackend'):
+                baseline = timed(lambda: self.run_search(query))
+            with self.settings(
+                    FORGE_SEARCH_BACKEND='forge.search.SQLiteSearchBackend'):
+                optimized = timed(lambda: self.run_search(query))
+            report('search %r' % query, baseline, optimized)
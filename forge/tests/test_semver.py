@@ -1,8 +1,23 @@
 from django.test import TestCase
 
-from forge.semver import ForgeSpec, ForgeSpecItem
+from forge.semver import ForgeSpec, ForgeSpecItem, VersionIndex, parse_spec
 from semantic_version import Version
 
+from .utils import benchmark, report, timed
+
+
+SPECS = (
+    '>= 1.0.0', '>=1.2 <2', '> 1.2', '> 1.2.0 < 1.3.0', '<= 2', '< 2.0.0',
+    '== 1.2', '1.2.5', '1.x', '1.2.x', '!= 1.2.5', '*', '>= 1.3.0-rc1',
+    '< 1.3.0', '>=2.0.0,<3.0.0', '>= 1.0.0 != 1.2.5 <= 1.2.10', '< 0.1',
+)
+
+VERSIONS = (
+    '0.0.1', '0.1.0', '1.0.0', '1.2.0-rc1', '1.2.0', '1.2.5', '1.2.10',
+    '1.3.0-a', '1.3.0-rc1', '1.3.0', '1.3.0+build.1', '1.10.0',
+    '2.0.0-rc1', '2.0.0', '2.1.3', '3.0.0',
+)
+
 
 class TestForgeSpec(TestCase):
 
@@ -45,3 +60,75 @@ class TestForgeSpec(TestCase):
         self.assertEqual(fs.specs[0].spec, Version('1.2.0', partial=True))
         self.assertEqual(fs.specs[1].kind, ForgeSpecItem.KIND_LT)
         self.assertEqual(fs.specs[1].spec, Version('1.3.0', partial=True))
+
+    def test_parse_spec(self):
+        """
+        Ensure `parse_spec` only parses each specification string once.
+        """
+        spec = parse_spec('>= 1.0.0 < 2.0.0')
+        self.assertIs(parse_spec('>= 1.0.0 < 2.0.0'), spec)
+        self.assertEqual(spec, ForgeSpec('>= 1.0.0 < 2.0.0'))
+
+    def test_bounds(self):
+        self.assertEqual(ForgeSpec('>= 1.2 < 2').bounds,
+                         ((1, 2, 0), (2, float('inf'), float('inf'))))
+        self.assertEqual(ForgeSpec('1.2.x').bounds, ((1, 2, 0), (1, 3, 0)))
+        self.assertEqual(ForgeSpec('1.2.5').bounds, ((1, 2, 5), (1, 2, 5)))
+        self.assertEqual(ForgeSpec('!= 1.2.5').bounds, (None, None))
+        self.assertEqual(ForgeSpec('*').bounds, (None, None))
+
+
+class TestVersionIndex(TestCase):
+
+    def test_match(self):
+        """
+        Ensure matching against the index finds the same versions as
+        testing every version against the specification.
+        """
+        versions = [Version(version) for version in VERSIONS]
+        index = VersionIndex((version, str(version))
+                             for version in reversed(versions))
+        for spec_string in SPECS:
+            spec = ForgeSpec(spec_string)
+            self.assertEqual(
+                sorted(index.match(spec)),
+                sorted(str(version) for version in versions
+                       if version in spec),
+                spec_string
+            )
+
+
+@benchmark
+class SemverBenchmark(TestCase):
+    """
+    Compares parsing and matching specifications with and without
+    `parse_spec` and `VersionIndex`: parsing 1,000 dependency specifications,
+    and matching 200 of them against a module with 500 releases.
+    """
+
+    def setUp(self):
+        self.specs = ['>= %d.%d.0 < %d.0.0' % (i % 50, i % 10, i % 50 + 1)
+                      for i in xrange(1000)]
+        self.versions = [Version('%d.%d.%d' % (i // 10, i % 10, 0))
+                         for i in xrange(500)]
+
+    def test_parse(self):
+        parse_spec(self.specs[0])
+        baseline = timed(lambda: [ForgeSpec(spec) for spec in self.specs])
+        optimized = timed(lambda: [parse_spec(spec) for spec in self.specs])
+        report('Parse 1,000 specifications', baseline, optimized)
+
+    def test_match(self):
+        specs = [parse_spec(spec) for spec in self.specs[:200]]
+        index = VersionIndex((version, version) for version in self.versions)
+
+        def linear():
+            return [[version for version in self.versions if version in spec]
+                    for spec in specs]
+
+        def bisect():
+            return [index.match(spec) for spec in specs]
+
+        self.assertEqual(linear(), bisect())
+        report('Match 200 specifications against 500 versions',
+               timed(linear, repeat=3), timed(bisect, repeat=3))
@@ -0,0 +1,168 @@
+"""
+Tests for the content-addressed tarball storage.
+"""
+import hashlib
+import os
+
+from django.core.files.base import ContentFile
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.test import RequestFactory
+
+from forge.models import Release, StoredFile
+from forge.storage import ContentAddressedStorage, DownloadedFile
+from forge.views.static import release_tarball
+
+from .server import FakeForge
+from .utils import ForgeTestCase, make_tarball
+
+
+class ContentAddressedTestCase(ForgeTestCase):
+    """
+    Test case that stores release tarballs with `ContentAddressedStorage`.
+    """
+
+    def setUp(self):
+        super(ContentAddressedTestCase, self).setUp()
+        self.module = self.create_module('puppetlabs-stdlib')
+        self.content = make_tarball('puppetlabs-stdlib', '4.9.0')
+        self.digest = hashlib.sha256(self.content).hexdigest()
+        self.blob_path = os.path.join(self.media_root, 'sha256',
+                                      self.digest[:2], self.digest[2:4],
+                                      self.digest)
+
+    def use_content_addressed_storage(self):
+        tarball_storage = Release._meta.get_field('tarball').storage
+        forge_storage = tarball_storage._wrapped
+        tarball_storage._wrapped = self.storage = ContentAddressedStorage(
+            location=self.media_root
+        )
+        self.addCleanup(setattr, tarball_storage, '_wrapped', forge_storage)
+
+
+class TestContentAddressedStorage(ContentAddressedTestCase):
+
+    def setUp(self):
+        super(TestContentAddressedStorage, self).setUp()
+        self.use_content_addressed_storage()
+
+    def test_save(self):
+        """
+        Ensure files with the same contents are only stored once, and keep
+        their names and URLs.
+        """
+        names = ['p/puppetlabs/puppetlabs-stdlib-4.9.0.tar.gz',
+                 'p/puppet/puppet-stdlib-4.9.0.tar.gz']
+        for name in names:
+            self.assertEqual(self.storage.save(name,
+                                               ContentFile(self.content)),
+                             name)
+            self.assertEqual(self.storage.path(name), self.blob_path)
+            self.assertTrue(self.storage.exists(name))
+            self.assertEqual(self.storage.url(name),
+                             '/system/releases/%s' % name)
+            with self.storage.open(name) as fh:
+                self.assertEqual(fh.read(), self.content)
+
+        self.assertEqual(os.listdir(os.path.dirname(self.blob_path)),
+                         [self.digest])
+        self.assertFalse(os.path.exists(os.path.join(self.media_root, 'p')))
+
+        # The contents are removed along with the last file using them.
+        self.storage.delete(names[0])
+        self.assertFalse(self.storage.exists(names[0]))
+        self.assertTrue(os.path.exists(self.blob_path))
+        self.storage.delete(names[1])
+        self.assertFalse(os.path.exists(self.blob_path))
+
+    def test_save_replace(self):
+        """
+        Ensure saving a file with the same name replaces its contents.
+        """
+        name = 'p/puppetlabs/puppetlabs-stdlib-4.9.0.tar.gz'
+        self.storage.save(name, ContentFile(b'old'))
+        old_path = self.storage.path(name)
+        self.storage.save(name, ContentFile(self.content))
+        self.assertEqual(self.storage.path(name), self.blob_path)
+        self.assertFalse(os.path.exists(old_path))
+        self.assertEqual(StoredFile.objects.count(), 1)
+
+    def test_save_downloaded(self):
+        """
+        Ensure downloaded files are moved into the store.
+        """
+        path = os.path.join(self.media_root, 'download.tar.gz')
+        with open(path, 'wb') as fh:
+            fh.write(self.content)
+        downloaded = DownloadedFile(path, sha256=self.digest)
+        self.storage.save('p/puppetlabs/puppetlabs-stdlib-4.9.0.tar.gz',
+                          downloaded)
+        downloaded.close()
+        self.assertFalse(os.path.exists(path))
+        self.assertTrue(os.path.exists(self.blob_path))
+
+    def test_release(self):
+        """
+        Ensure releases are saved to, and served from, the store.
+        """
+        release = Release(module=self.module, version='4.9.0')
+        release.tarball.save('puppetlabs-stdlib-4.9.0.tar.gz',
+                             ContentFile(self.content), save=False)
+        release.save()
+        release = Release.objects.get(pk=release.pk)
+        self.assertEqual(release.tarball.path, self.blob_path)
+        self.assertEqual(release.file_sha256, self.digest)
+        self.assertEqual(release.metadata['version'], '4.9.0')
+
+        request = RequestFactory().get(release.tarball.url)
+        response = release_tarball(request, release.tarball.name)
+        self.assertEqual(b''.join(response.streaming_content), self.content)
+
+    def test_sync(self):
+        """
+        Ensure synchronized tarballs are moved into the store.
+        """
+        with FakeForge() as forge:
+            forge.add_release('puppetlabs-stdlib', '4.9.0')
+            call_command('sync_forge', api_url=forge.url, quiet=True,
+                         throttle=0)
+        release = Release.objects.get(module__name='stdlib')
+        self.assertEqual(release.tarball.name,
+                         'p/puppetlabs/puppetlabs-stdlib-4.9.0.tar.gz')
+        self.assertEqual(release.tarball.path,
+                         self.storage.blob_path(release.file_sha256))
+        self.assertFalse(os.path.exists(os.path.join(self.media_root, 'p')))
+
+
+class TestDedupeReleases(ContentAddressedTestCase):
+
+    def test_dedupe(self):
+        """
+        Ensure `dedupe_releases` moves tarballs into the store, keeping
+        only one copy of identical tarballs.
+        """
+        fork = self.create_module('puppet-stdlib')
+        releases = []
+        for module in (self.module, fork):
+            release = Release(module=module, version='4.9.0')
+            release.tarball.save('%s-4.9.0.tar.gz' % module.canonical_name,
+                                 ContentFile(self.content), save=False)
+            release.save()
+            releases.append(release)
+        paths = [release.tarball.path for release in releases]
+
+        self.use_content_addressed_storage()
+        call_command('dedupe_releases', verbosity=0)
+        for path in paths:
+            self.assertFalse(os.path.exists(path))
+        for release in releases:
+            release = Release.objects.get(pk=release.pk)
+            self.assertEqual(release.tarball.path, self.blob_path)
+        self.assertEqual(StoredFile.objects.count(), 2)
+
+    def test_dedupe_storage(self):
+        """
+        Ensure `dedupe_releases` requires the content-addressed storage.
+        """
+        with self.assertRaises(CommandError):
+            call_command('dedupe_releases', verbosity=0)
@@ -0,0 +1,316 @@
+"""
+Tests for the `sync_forge` management command.
+"""
+import datetime
+import hashlib
+import os
+import time
+
+from django.core.management import call_command
+from django.test import SimpleTestCase
+
+from forge.client import RateLimiter, parse_timestamp
+from forge.models import Author, Module, Release, ReleaseDependency, SyncMark
+from forge.search import search_modules
+from forge.storage import tarball_storage
+
+from .server import FakeForge
+from .utils import ForgeTestCase, benchmark, report
+
+
+class TestSyncForge(ForgeTestCase):
+
+    def setUp(self):
+        super(TestSyncForge, self).setUp()
+        self.forge = FakeForge()
+        self.forge.add_module('puppetlabs-stdlib', desc='Standard library',
+                              tags=['stdlib', 'functions'])
+        for version in ('4.0.0', '4.1.0', '4.2.0'):
+            self.forge.add_release('puppetlabs-stdlib', version)
+        self.forge.add_release('puppetlabs-concat', '1.2.0', metadata={
+            'dependencies': [{'name': 'puppetlabs/stdlib'}],
+        })
+        self.forge.add_release('jfryman-nginx', '0.2.0')
+        self.forge.start()
+        self.addCleanup(self.forge.stop)
+
+    def sync(self, **options):
+        options.setdefault('throttle', 0)
+        call_command('sync_forge', api_url=self.forge.url, quiet=True,
+                     **options)
+
+    def assertSynced(self):
+        self.assertEqual(
+            sorted(Author.objects.values_list('name', flat=True)),
+            ['jfryman', 'puppetlabs']
+        )
+        stdlib = Module.objects.get_for_full_name('puppetlabs/stdlib')
+        self.assertEqual(stdlib.desc, 'Standard library')
+        self.assertEqual(stdlib.tags, 'stdlib functions')
+        self.assertEqual(str(stdlib.current_release.version), '4.2.0')
+
+        for rel in self.forge.releases():
+            release = Release.objects.get(
+                module__author__name=rel['module']['owner']['username'],
+                module__name=rel['module']['name'],
+                version=rel['version']
+            )
+            with open(release.tarball.path, 'rb') as fh:
+                self.assertEqual(hashlib.md5(fh.read()).hexdigest(),
+                                 rel['file_md5'])
+            self.assertEqual(release.file_md5, rel['file_md5'])
+
+    def test_sync(self):
+        """
+        Ensure authors, modules and releases are synchronized.
+        """
+        self.sync()
+        self.assertSynced()
+
+    def test_sync_workers(self):
+        """
+        Ensure tarballs may be downloaded in parallel.
+        """
+        self.sync(workers=3)
+        self.assertSynced()
+
+        # Syncing again doesn't download the tarballs again.
+        del self.forge.requests[:]
+        self.sync(workers=3)
+        self.assertSynced()
+        self.assertFalse([path for path in self.forge.requests
+                          if path.startswith('/v3/files/')])
+
+    def test_sync_corrupt(self):
+        """
+        Ensure releases aren't created when the tarball's MD5 doesn't match.
+        """
+        self.forge.add_release('jfryman-nginx', '0.3.0', file_md5='0' * 32)
+        self.sync(workers=2)
+        self.assertFalse(
+            Release.objects.filter(module__name='nginx', version='0.3.0')
+        )
+        self.assertTrue(
+            Release.objects.filter(module__name='nginx', version='0.2.0')
+        )
+
+    def test_sync_resume(self):
+        """
+        Ensure downloads resume from where a dropped connection left off.
+        """
+        path = '/v3/files/puppetlabs-stdlib-4.2.0.tar.gz'
+        self.forge.drops[path] = [100, 50]
+        self.sync()
+        self.assertSynced()
+        self.assertEqual(
+            [range_header for range_header in self.forge.ranges
+             if range_header],
+            ['bytes=100-', 'bytes=150-']
+        )
+
+    def test_sync_resume_interrupted(self):
+        """
+        Ensure partial downloads left by an interrupted sync are resumed,
+        and restarted if they turn out to be from a different file.
+        """
+        content = self.forge.files['/v3/files/puppetlabs-stdlib-4.2.0.tar.gz']
+        download_dir = os.path.join(self.media_root, '.downloads')
+        os.makedirs(download_dir)
+        with open(os.path.join(download_dir, 'puppetlabs-stdlib-4.2.0.tar.gz'
+                                             '.tmp'), 'wb') as fh:
+            fh.write(content[:120])
+        with open(os.path.join(download_dir, 'puppetlabs-concat-1.2.0.tar.gz'
+                                             '.tmp'), 'wb') as fh:
+            fh.write(b'\0' * 120)
+
+        self.sync()
+        self.assertSynced()
+        self.assertEqual(sorted(filter(None, self.forge.ranges)),
+                         ['bytes=120-', 'bytes=120-'])
+        self.assertFalse(os.listdir(download_dir))
+
+    def test_sync_batches(self):
+        """
+        Ensure the rows written in batches are complete, as they bypass
+        `Release.save` and the signal handlers.
+        """
+        self.sync(batch_size=2)
+        self.assertSynced()
+        concat = Release.objects.get(module__name='concat')
+        self.assertEqual(
+            list(ReleaseDependency.objects.filter(release=concat)
+                 .values_list('name', 'spec')),
+            [('puppetlabs/stdlib', '>= 0.0.0')]
+        )
+        self.assertEqual(concat.file_size,
+                         len(self.forge.files['/v3/files/'
+                                              'puppetlabs-concat-1.2.0.tar.gz']))
+        self.assertEqual(
+            [module.name for module in search_modules('standard')],
+            ['stdlib']
+        )
+
+    def test_sync_invalid_release(self):
+        """
+        Ensure a release that can't be created doesn't stop the others in
+        its batch from being created, and that its tarball isn't kept.
+        """
+        self.forge.add_release('puppetlabs-concat', '1.3.0', metadata={
+            'dependencies': [{'version_requirement': '>= 4.0.0'}],
+        })
+        self.sync()
+        self.assertFalse(
+            Release.objects.filter(module__name='concat', version='1.3.0')
+        )
+        self.assertFalse(tarball_storage.exists(
+            'p/puppetlabs/puppetlabs-concat-1.3.0.tar.gz'
+        ))
+        self.assertEqual(Release.objects.count(), 5)
+        concat = Module.objects.get_for_full_name('puppetlabs/concat')
+        self.assertEqual(str(concat.current_release.version), '1.2.0')
+
+    def test_sync_updates(self):
+        """
+        Ensure changed modules are updated and reindexed by later syncs.
+        """
+        self.sync()
+        self.forge.add_module('puppetlabs-stdlib', desc='Utility functions',
+                              tags=['stdlib'])
+        self.forge.add_release('puppetlabs-stdlib', '4.3.0')
+        self.sync(batch_size=2)
+
+        stdlib = Module.objects.get_for_full_name('puppetlabs/stdlib')
+        self.assertEqual(stdlib.desc, 'Utility functions')
+        self.assertEqual(stdlib.tags, 'stdlib')
+        self.assertEqual(str(stdlib.current_release.version), '4.3.0')
+        self.assertEqual(stdlib.releases.count(), 4)
+        self.assertEqual(
+            [module.name for module in search_modules('utility')],
+            ['stdlib']
+        )
+
+
+@benchmark
+class SyncBenchmark(ForgeTestCase):
+    """
+    Compares syncing a Forge of 200 modules and 400 releases with a
+    transaction per row against syncing in batches.
+    """
+
+    def setUp(self):
+        super(SyncBenchmark, self).setUp()
+        self.forge = FakeForge()
+        for i in xrange(200):
+            for version in ('1.0.0', '1.1.0'):
+                self.forge.add_release('author%d-module' % i, version)
+        self.forge.start()
+        self.addCleanup(self.forge.stop)
+
+    def time_sync(self, batch_size):
+        # Tarballs are already downloaded after the first sync, so this
+        # mostly times the database writes.
+        Author.objects.all().delete()
+        start = time.time()
+        call_command('sync_forge', api_url=self.forge.url, quiet=True,
+                     throttle=0, workers=4, batch_size=batch_size)
+        elapsed = time.time() - start
+        self.assertEqual(Release.objects.count(), 400)
+        return elapsed
+
+    def test_batches(self):
+        self.time_sync(500)
+        baseline = min(self.time_sync(1) for i in xrange(3))
+        optimized = min(self.time_sync(500) for i in xrange(3))
+        report('sync 400 releases', baseline, optimized)
+
+
+class TestRateLimiter(ForgeTestCase):
+
+    def test_rate(self):
+        """
+        Ensure requests are spread out at the given rate.
+        """
+        limiter = RateLimiter(50)
+        start = time.time()
+        for i in xrange(6):
+            limiter.acquire()
+        self.assertGreaterEqual(time.time() - start, 0.09)
+
+
+class TestIncrementalSync(ForgeTestCase):
+
+    def setUp(self):
+        super(TestIncrementalSync, self).setUp()
+        self.forge = FakeForge()
+        for i in xrange(25):
+            self.forge.add_release(
+                'author%d-module' % i, '1.0.0',
+                created_at='2015-07-%02d 12:00:00 -0700' % (i + 1)
+            )
+        self.forge.start()
+        self.addCleanup(self.forge.stop)
+
+    def sync(self):
+        call_command('sync_forge', api_url=self.forge.url, quiet=True,
+                     throttle=0, incremental=True)
+
+    def api_requests(self, endpoint):
+        return [path for path in self.forge.requests
+                if path.startswith('/v3/%s?' % endpoint)]
+
+    def test_incremental(self):
+        """
+        Ensure incremental syncs stop paging once they reach items that
+        have already been synchronized.
+        """
+        self.sync()
+        self.assertEqual(Author.objects.count(), 25)
+        self.assertEqual(Release.objects.count(), 25)
+        self.assertEqual(
+            SyncMark.objects.get_mark(self.forge.url, 'releases'),
+            datetime.datetime(2015, 7, 25, 19)
+        )
+        self.assertFalse(self.api_requests('users'))
+
+        del self.forge.requests[:]
+        self.forge.add_release('author3-module', '1.1.0',
+                               created_at='2015-08-02 09:00:00 +0200')
+        self.forge.add_release('newauthor-module', '0.1.0',
+                               created_at='2015-08-03 12:00:00 -0700')
+        self.sync()
+
+        module = Module.objects.get_for_full_name('author3/module')
+        self.assertEqual(str(module.current_release.version), '1.1.0')
+        self.assertTrue(Release.objects.filter(module__name='module',
+                                               module__author__name='newauthor'))
+        self.assertEqual(len(self.api_requests('modules')), 1)
+        self.assertEqual(len(self.api_requests('releases')), 1)
+        self.assertEqual(
+            SyncMark.objects.get_mark(self.forge.url, 'releases'),
+            datetime.datetime(2015, 8, 3, 19)
+        )
+
+    def test_incremental_failure(self):
+        """
+        Ensure the high-water mark isn't moved past releases that failed
+        to download.
+        """
+        self.sync()
+        self.forge.add_release('author3-module', '1.1.0', file_md5='0' * 32,
+                               created_at='2015-08-02 12:00:00 -0700')
+        self.sync()
+        self.assertEqual(
+            SyncMark.objects.get_mark(self.forge.url, 'releases'),
+            datetime.datetime(2015, 7, 25, 19)
+        )
+
+
+class TestParseTimestamp(SimpleTestCase):
+
+    def test_parse_timestamp(self):
+        self.assertEqual(parse_timestamp('2015-08-18 11:23:05 -0700'),
+                         datetime.datetime(2015, 8, 18, 18, 23, 5))
+        self.assertEqual(parse_timestamp('2015-08-18 11:23:05 +0530'),
+                         datetime.datetime(2015, 8, 18, 5, 53, 5))
+        self.assertEqual(parse_timestamp('2015-08-18 11:23:05'),
+                         datetime.datetime(2015, 8, 18, 11, 23, 5))
@@ -0,0 +1,197 @@
+"""
+Tests for reading module tarballs.
+"""
+import hashlib
+import json
+import os
+import shutil
+import tarfile
+import tempfile
+
+from django.test import SimpleTestCase
+
+from forge.tarball import (TarballError, TarballIngest, TarballReader,
+                           file_digests, read_metadata, tarball_data)
+
+from .utils import benchmark, make_archive, make_tarball, report, timed
+
+
+def ingest(content, chunk_size=100):
+    tarball = TarballIngest()
+    for i in xrange(0, len(content), chunk_size):
+        tarball.update(content[i:i + chunk_size])
+    return tarball.data()
+
+
+class TestTarballIngest(SimpleTestCase):
+
+    def test_data(self):
+        """
+        Ensure the digests, size, metadata, README and CHANGELOG are read
+        in one pass, however the tarball is split into chunks.
+        """
+        content = make_tarball('puppetlabs-stdlib', '4.9.0', extra_files=[
+            ('manifests/init.pp', b'class stdlib {}\n' * 1000),
+            ('README.markdown', b'# stdlib\n'),
+            ('CHANGELOG.md', u'## 4.9.0\n\nCaf\xe9\n'.encode('utf-8')),
+        ])
+        for chunk_size in (1, 511, 512, 4096, len(content)):
+            data = ingest(content, chunk_size)
+            self.assertEqual(data['file_md5'],
+                             hashlib.md5(content).hexdigest())
+            self.assertEqual(data['file_sha256'],
+                             hashlib.sha256(content).hexdigest())
+            self.assertEqual(data['file_size'], len(content))
+            self.assertEqual(json.loads(data['metadata_json'])['version'],
+                             '4.9.0')
+            self.assertEqual(data['readme'], u'# stdlib\n')
+            self.assertEqual(data['changelog'], u'## 4.9.0\n\nCaf\xe9\n')
+
+    def test_long_names(self):
+        """
+        Ensure members with long names are found in ustar, GNU and pax
+        archives.
+        """
+        top_level = 'puppetlabs-%s-1.0.0' % ('x' * 80)
+        files = [
+            ('%s/%s/fixture' % (top_level, 'y' * 120), b'fixture'),
+            ('%s/metadata.json' % top_level, b'{"name": "long"}'),
+            ('%s/README' % top_level, b'long'),
+        ]
+        for format in (tarfile.USTAR_FORMAT, tarfile.GNU_FORMAT,
+                       tarfile.PAX_FORMAT):
+            # ustar can only split names of up to 255 characters.
+            archive_files = files[1:] if format == tarfile.USTAR_FORMAT \
+                else files
+            data = ingest(make_archive(archive_files, format))
+            self.assertEqual(data['metadata_json'], u'{"name": "long"}')
+            self.assertEqual(data['readme'], u'long')
+
+    def test_top_level_metadata(self):
+        """
+        Ensure the top-level `metadata.json` is used over others, which are
+        only used when there's no top-level one.
+        """
+        data = ingest(make_archive([
+            ('mod-1.0.0/spec/fixtures/metadata.json', b'{"name": "fixture"}'),
+            ('mod-1.0.0/metadata.json', b'{"name": "mod"}'),
+        ]))
+        self.assertEqual(data['metadata_json'], u'{"name": "mod"}')
+        self.assertEqual(data['readme'], u'')
+
+        data = ingest(make_archive([
+            ('mod-1.0.0/spec/fixtures/metadata.json', b'{"name": "fixture"}'),
+        ]))
+        self.assertEqual(data['metadata_json'], u'{"name": "fixture"}')
+
+    def test_invalid(self):
+        with self.assertRaises(TarballError):
+            ingest(make_archive([('mod-1.0.0/README', b'no metadata')]))
+        with self.assertRaises(TarballError):
+            ingest(b'not a tarball' * 100)
+
+
+class TestReadMetadata(SimpleTestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmp_dir)
+
+    def write(self, content):
+        path = os.path.join(self.tmp_dir, 'mod-1.0.0.tar.gz')
+        with open(path, 'wb') as fh:
+            fh.write(content)
+        return path
+
+    def test_stops_at_metadata(self):
+        """
+        Ensure reading stops at the top-level `metadata.json`, so members
+        after it (here, a truncated one) aren't read.
+        """
+        content = make_archive([
+            ('mod-1.0.0/spec/fixtures/metadata.json', b'{"name": "fixture"}'),
+            ('mod-1.0.0/metadata.json', b'{"name": "mod"}'),
+            ('mod-1.0.0/files/big', os.urandom(1024 * 1024)),
+        ])
+        path = self.write(content[:len(content) // 2])
+        self.assertEqual(read_metadata(path), u'{"name": "mod"}')
+
+        path = self.write(make_archive([
+            ('mod-1.0.0/spec/fixtures/metadata.json', b'{"name": "fixture"}'),
+        ]))
+        self.assertEqual(read_metadata(path), u'{"name": "fixture"}')
+
+        path = self.write(make_archive([('mod-1.0.0/README', b'none')]))
+        with self.assertRaises(TarballError):
+            read_metadata(path)
+
+    def test_offset(self):
+        """
+        Ensure `metadata.json` is read from the offset found when the
+        tarball was ingested, including after long name headers, and that
+        a wrong offset falls back to reading the whole tarball.
+        """
+        for format in (tarfile.GNU_FORMAT, tarfile.PAX_FORMAT):
+            top_level = 'mod-%s-1.0.0' % ('x' * 120)
+            content = make_archive([
+                ('%s/files/file%d' % (top_level, i), b'x' * 1000)
+                for i in xrange(10)
+            ] + [('%s/metadata.json' % top_level, b'{"name": "mod"}')],
+                format)
+            offset = ingest(content)['metadata_offset']
+            self.assertGreater(offset, 10 * 1000)
+
+            path = self.write(content)
+            reader = TarballReader(start=offset)
+            reader.update(content)
+            self.assertEqual(reader.files,
+                             {'metadata.json': b'{"name": "mod"}'})
+            self.assertEqual(read_metadata(path, offset), u'{"name": "mod"}')
+
+            for wrong_offset in (0, 512, offset + 512, 10 ** 9):
+                self.assertEqual(read_metadata(path, wrong_offset),
+                                 u'{"name": "mod"}')
+
+
+@benchmark
+class TarballBenchmark(SimpleTestCase):
+    """
+    Compares hashing a tarball and then reading its metadata separately
+    against reading it in a single pass, and ways of reading only its
+    metadata, for a tarball of 2,000 files with `metadata.json` at the end.
+    """
+
+    def setUp(self):
+        tmp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmp_dir)
+        self.path = os.path.join(tmp_dir, 'puppetlabs-big-1.0.0.tar.gz')
+        files = [('puppetlabs-big-1.0.0/spec/fixtures/file%d.pp' % i,
+                  os.urandom(256).encode('hex')) for i in xrange(2000)]
+        files.append(('puppetlabs-big-1.0.0/metadata.json',
+                      b'{"name": "puppetlabs-big"}'))
+        with open(self.path, 'wb') as fh:
+            fh.write(make_archive(files))
+
+    def test_tarball_data(self):
+        def separate():
+            with open(self.path, 'rb') as fh:
+                file_digests(fh)
+            read_metadata(self.path)
+
+        report('read tarball of 2,000 files', timed(separate),
+               timed(lambda: tarball_data(self.path)))
+
+    def test_read_metadata(self):
+        def scan_names():
+            # How `read_metadata` used to find `metadata.json`.
+            with tarfile.open(self.path, mode='r:gz') as tf:
+                for name in tf.getnames():
+                    if os.path.basename(name) == 'metadata.json':
+                        return tf.extractfile(name).read()
+
+        baseline = timed(scan_names)
+        report('read metadata.json after 2,000 files', baseline,
+               timed(lambda: read_metadata(self.path)))
+        offset = tarball_data(self.path)['metadata_offset']
+        report('read metadata.json at its offset', baseline,
+               timed(lambda: read_metadata(self.path, offset)))
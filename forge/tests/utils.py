@@ -0,0 +1,133 @@
+"""
+Helpers shared by the Forge tests.
+"""
+import io
+import json
+import os
+import shutil
+import sys
+import tarfile
+import tempfile
+import time
+from unittest import skipUnless
+
+from django.core.cache import caches
+from django.core.files.base import ContentFile
+from django.db import connection
+from django.test import TestCase, override_settings
+
+from forge.models import Author, Module, Release
+
+
+# Benchmarks are slow, and only run when FORGE_BENCHMARKS is set.
+benchmark = skipUnless(os.environ.get('FORGE_BENCHMARKS'),
+                       'Set FORGE_BENCHMARKS=1 to run benchmarks.')
+
+
+def make_archive(files, format=tarfile.GNU_FORMAT):
+    """
+    Returns the bytes of a gzipped tar archive of the given (name, content)
+    pairs, in the given tar format.
+    """
+    tarball = io.BytesIO()
+    with tarfile.open(fileobj=tarball, mode='w:gz', format=format) as tf:
+        for name, content in files:
+            ti = tarfile.TarInfo(name)
+            ti.size = len(content)
+            tf.addfile(ti, io.BytesIO(content))
+    return tarball.getvalue()
+
+
+def make_tarball(full_name, version, metadata=None, extra_files=None):
+    """
+    Returns the bytes of a gzipped module tarball for the given module name
+    (e.g., 'puppetlabs-stdlib') and version, containing a `metadata.json`.
+    """
+    metadata = dict(metadata or {})
+    metadata.setdefault('name', full_name)
+    metadata.setdefault('version', version)
+
+    files = [('metadata.json', json.dumps(metadata).encode('utf-8'))]
+    files.extend(extra_files or [])
+
+    top_level = '%s-%s' % (full_name, version)
+    return make_archive([('%s/%s' % (top_level, name), content)
+                         for name, content in files])
+
+
+def timed(func, repeat=10):
+    """
+    Returns the best time, in seconds, of calling the given function
+    `repeat` times.
+    """
+    best = None
+    for i in xrange(repeat):
+        start = time.time()
+        func()
+        elapsed = time.time() - start
+        if best is None or elapsed < best:
+            best = elapsed
+    return best
+
+
+def report(name, baseline, optimized):
+    """
+    Writes the timings of a benchmark to stderr.
+    """
+    sys.stderr.write('\n%s: %.2fms -> %.2fms (%.1fx)\n' %
+                     (name, baseline * 1000, optimized * 1000,
+                      baseline / optimized if optimized else float('inf')))
+
+
+class ForgeTestCase(TestCase):
+    """
+    Test case that stores release tarballs in a temporary directory.
+    """
+
+    def setUp(self):
+        super(ForgeTestCase, self).setUp()
+        self.media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media_root)
+
+        settings_override = override_settings(MEDIA_ROOT=self.media_root)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+        # The storage instance has already read the location from settings.
+        storage = Release._meta.get_field('tarball').storage
+        old_locations = (storage.base_location, storage.location)
+        storage.base_location = storage.location = self.media_root
+        self.addCleanup(self.restore_storage, storage, old_locations)
+
+        for cache in caches.all():
+            cache.clear()
+
+    def restore_storage(self, storage, locations):
+        storage.base_location, storage.location = locations
+
+    def commit(self):
+        """
+        Calls the functions waiting for the transaction to be committed, as
+        the test's transaction never is.
+        """
+        callbacks = getattr(connection, 'run_on_commit', [])
+        while callbacks:
+            sids, func = callbacks.pop(0)
+            func()
+
+    def create_module(self, full_name, **kwargs):
+        author_name, name = full_name.split('-')
+        author, created = Author.objects.get_or_create(name=author_name)
+        module = Module.objects.create(author=author, name=name, **kwargs)
+        self.commit()
+        return module
+
+    def create_release(self, module, version, metadata=None, **kwargs):
+        filename = '%s-%s.tar.gz' % (module.canonical_name, version)
+        content = make_tarball(module.canonical_name, version,
+                               metadata=metadata, **kwargs)
+        release = Release(module=module, version=version)
+        release.tarball.save(filename, ContentFile(content), save=False)
+        release.save()
+        self.commit()
+        return release
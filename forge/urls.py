@@ -3,7 +3,7 @@ from django.conf.urls import patterns, include, url
 from django.contrib import admin
 
 from . import views
-from .views import v1, v3
+from .views import metrics, static, v1, v3
 
 admin.autodiscover()
 
@@ -20,12 +20,7 @@ urlpatterns = patterns('',
         v1.module_json, name='module_json_v1'),
     url(r'^v3/modules$', v3.modules, name='modules_v3'),
     url(r'^v3/releases$', v3.releases, name='releases_v3'),
+    url(r'^metrics$', metrics.metrics, name='metrics'),
+    url(r'^%s(?P<path>.*)$' % settings.MEDIA_URL[1:],
+        static.release_tarball, name='release_tarball'),
 )
-
-if settings.DEBUG:
-    urlpatterns += patterns('',
-        url(r'^%s(?P<path>.*)$' % settings.MEDIA_URL[1:],
-            'forge.views.static.serve', {
-            'document_root': settings.MEDIA_ROOT,
-        }),
-   )
@@ -2,8 +2,8 @@ from django.shortcuts import render
 
 
 def handler404(request):
-    return render(request, 'admin/404.html', {})
+    return render(request, 'admin/404.html', {}, status=404)
 
 
 def handler500(request):
-    return render(request, 'admin/500.html', {})
+    return render(request, 'admin/500.html', {}, status=500)
@@ -0,0 +1,14 @@
+from django.http import Http404, HttpResponse
+
+from .. import metrics as forge_metrics
+
+
+def metrics(request):
+    """
+    Provides the `/metrics` URL, with metrics in the Prometheus text format
+    when the `FORGE_METRICS` setting is true.
+    """
+    if not forge_metrics.enabled():
+        raise Http404
+    return HttpResponse(forge_metrics.render(),
+                        content_type='text/plain; version=0.0.4; charset=utf-8')
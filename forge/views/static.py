@@ -1,15 +1,63 @@
-from django.views.static import serve as static_serve
+import os
+import posixpath
+import urllib
 
+from django.conf import settings
+from django.http import (FileResponse, Http404, HttpResponse,
+                         HttpResponseNotModified)
+from django.utils.http import http_date
+from django.views.static import was_modified_since
 
-def serve(request, path, document_root=None, show_indexes=False):
+from ..models import Release
+from ..storage import tarball_storage
+
+
+def release_tarball(request, path):
     """
-    Static file serving for Forge releases; should only be used when DEBUG
-    is set -- it deletes 'Content-Encoding' header so that module tarball
-    data isn't extracted twice by the Puppet module tool.
+    Serves the tarball of a release.  The transfer is handed off to the
+    front-end web server with an `X-Accel-Redirect` (nginx) or `X-Sendfile`
+    (Apache, lighttpd) header when the `FORGE_SENDFILE` setting is set to
+    'x-accel-redirect' or 'x-sendfile'; otherwise the file is streamed,
+    using the WSGI server's file wrapper when it has one.
+
+    Tarballs are sent as opaque binary data, without a 'Content-Encoding'
+    header, so that they aren't decompressed before reaching the Puppet
+    module tool.
     """
-    response = static_serve(request, path,
-                            document_root=document_root,
-                            show_indexes=show_indexes)
-    if path.endswith('.tar.gz'):
-        del response['Content-Encoding']
+    name = posixpath.normpath(path).lstrip('/')
+    if not Release.objects.filter(tarball=name).exists():
+        raise Http404('Release tarball not found: %s' % name)
+
+    full_path = tarball_storage.path(name)
+    try:
+        statobj = os.stat(full_path)
+    except OSError:
+        raise Http404('Release tarball not found: %s' % name)
+
+    sendfile = getattr(settings, 'FORGE_SENDFILE', None)
+    if sendfile == 'x-accel-redirect':
+        # The path is relative to the storage's location, which has to be
+        # an internal location of nginx.
+        prefix = getattr(settings, 'FORGE_ACCEL_REDIRECT_PREFIX',
+                         '/internal/releases/')
+        relative_path = os.path.relpath(full_path, tarball_storage.location)
+        response = HttpResponse(content_type='application/octet-stream')
+        response['X-Accel-Redirect'] = urllib.quote(
+            prefix + relative_path.replace(os.sep, '/')
+        )
+    elif sendfile == 'x-sendfile':
+        response = HttpResponse(content_type='application/octet-stream')
+        response['X-Sendfile'] = full_path
+    else:
+        if not was_modified_since(request.META.get('HTTP_IF_MODIFIED_SINCE'),
+                                  statobj.st_mtime, statobj.st_size):
+            return HttpResponseNotModified()
+        response = FileResponse(open(full_path, 'rb'),
+                                content_type='application/octet-stream')
+        response['Content-Length'] = statobj.st_size
+
+    response['Last-Modified'] = http_date(statobj.st_mtime)
+    response['Content-Disposition'] = (
+        'attachment; filename="%s"' % posixpath.basename(name)
+    )
     return response
@@ -1,9 +1,173 @@
+import hashlib
 import json
+import time
+import urllib
+from functools import wraps
 
-from django.http import HttpResponse
+from django.conf import settings
+from django.core.cache import caches
+from django.http import HttpResponse, StreamingHttpResponse
+from django.views.decorators.http import condition
+
+from .. import metrics
+from ..instrumentation import timer
+from ..models import CatalogGeneration
+
+
+def catalog_generation(request):
+    """
+    Returns the catalog generation, only querying it once per request.
+    """
+    if not hasattr(request, 'catalog_generation'):
+        request.catalog_generation = CatalogGeneration.objects.get_generation()
+    return request.catalog_generation
+
+
+def request_hash(request):
+    """
+    Returns a hash of the request's path and query parameters, in sorted
+    order so that their order doesn't matter.
+    """
+    params = sorted(
+        (key.encode('utf-8'), value.encode('utf-8'))
+        for key in request.GET for value in request.GET.getlist(key)
+    )
+    return hashlib.md5('%s?%s' % (request.path.encode('utf-8'),
+                                  urllib.urlencode(params))).hexdigest()
+
+
+def catalog_etag(request, *args, **kwargs):
+    """
+    Returns an ETag for the request from the catalog generation and a hash
+    of the request.
+    """
+    return '%d-%s' % (catalog_generation(request).generation,
+                      request_hash(request))
+
+
+def catalog_last_modified(request, *args, **kwargs):
+    return catalog_generation(request).modified
+
+
+# Decorator for views whose responses only change with the catalog of
+# authors, modules and releases; conditional requests are answered
+# without calling the view when the catalog hasn't changed.
+catalog_condition = condition(etag_func=catalog_etag,
+                              last_modified_func=catalog_last_modified)
+
+
+## Response caching
+
+def response_cache():
+    return caches[getattr(settings, 'FORGE_RESPONSE_CACHE', 'default')]
+
+
+def response_cache_key(request, view_name, generation):
+    """
+    Returns the cache key for the response to the request, from the view,
+    the catalog generation, and a hash of the request.
+    """
+    return 'forge:response:%s:%d:%s' % (view_name, generation,
+                                        request_hash(request))
+
+
+def cache_response(view):
+    """
+    Decorator that caches the responses of a view for as long as the
+    catalog generation is the same.  Only one request computes a missing
+    response at a time: the others wait (for up to
+    `FORGE_RESPONSE_CACHE_LOCK_WAIT` seconds) for it to be cached.
+    Streaming responses aren't cached.  Hits and misses are counted in
+    the metrics.
+    """
+    view_name = '%s.%s' % (view.__module__, view.__name__)
+
+    @wraps(view)
+    def wrapper(request, *args, **kwargs):
+        if request.method not in ('GET', 'HEAD'):
+            return view(request, *args, **kwargs)
+
+        cache = response_cache()
+        key = response_cache_key(request, view_name,
+                                 catalog_generation(request).generation)
+        lock_key = key + ':lock'
+        lock_wait = getattr(settings, 'FORGE_RESPONSE_CACHE_LOCK_WAIT', 5)
+
+        cached = cache.get(key)
+        locked = False
+        if cached is None:
+            locked = cache.add(lock_key, 1, lock_wait)
+            if not locked:
+                # Another request is computing the response.
+                deadline = time.time() + lock_wait
+                while cached is None and time.time() < deadline:
+                    time.sleep(0.05)
+                    cached = cache.get(key)
+
+        if cached is not None:
+            metrics.inc('forge_response_cache_hits_total', view=view_name)
+            content, content_type, status = cached
+            return HttpResponse(content, content_type=content_type,
+                                status=status)
+
+        metrics.inc('forge_response_cache_misses_total', view=view_name)
+        try:
+            response = view(request, *args, **kwargs)
+            if not response.streaming and response.status_code < 500:
+                cache.set(key, (response.content, response['Content-Type'],
+                                response.status_code),
+                          getattr(settings, 'FORGE_RESPONSE_CACHE_TIMEOUT',
+                                  3600))
+        finally:
+            if locked:
+                cache.delete(lock_key)
+        return response
+
+    return wrapper
 
 
 def json_response(data, indent=None, status=None):
-    return HttpResponse(json.dumps(data, indent=indent),
-                        content_type='application/json',
+    with timer('json'):
+        content = json.dumps(data, indent=indent)
+    return HttpResponse(content, content_type='application/json',
                         status=status)
+
+
+def json_stream_response(items, status=None):
+    """
+    Returns a streaming response with a JSON array of the given items,
+    serializing them one at a time as the response is written.
+    """
+    def stream():
+        yield '['
+        for i, item in enumerate(items):
+            if i:
+                yield ', '
+            yield json.dumps(item)
+        yield ']'
+
+    return StreamingHttpResponse(stream(),
+                                 content_type='application/json',
+                                 status=status)
+
+
+def queryset_chunks(queryset, chunk_size=500, prepare=None):
+    """
+    Iterates over the objects of the given queryset, loading them in chunks
+    of primary keys so that memory use stays bounded while still allowing
+    related objects to be loaded for each chunk.  The `prepare` function,
+    when given, is called with the queryset for each chunk (e.g., to add
+    `select_related` or `prefetch_related`).
+    """
+    pks = list(queryset.values_list('pk', flat=True))
+    model_qs = queryset.model._default_manager.all()
+    if prepare:
+        model_qs = prepare(model_qs)
+
+    for i in xrange(0, len(pks), chunk_size):
+        chunk = pks[i:i + chunk_size]
+        objects = model_qs.in_bulk(chunk)
+        for pk in chunk:
+            # Objects deleted since the primary keys were read are skipped.
+            if pk in objects:
+                yield objects[pk]
@@ -1,6 +1,10 @@
-from .utils import json_response
-from ..dependency import release_dependencies
+from django.db.models import Prefetch
+
+from .utils import (cache_response, catalog_condition, json_response,
+                    json_stream_response, queryset_chunks)
+from ..dependency import cached_release_dependencies
 from ..models import Module, Release
+from ..search import search_modules
 
 
 def error_response(errors, **kwargs):
@@ -25,7 +29,7 @@ def module_dict(module):
     Helper method to return a dictionary (for JSON generation) for the
     given module.
     """
-    latest = module.latest_release
+    latest = module.current_release
     if latest:
         latest_version = str(latest.version)
         versions = [release.version for release in module.releases.all()]
@@ -48,6 +52,8 @@ def module_dict(module):
     }
 
 
+@catalog_condition
+@cache_response
 def module_json(request, author, module_name):
     """
     Provides the `<author>/<module>.json` URL.
@@ -62,6 +68,7 @@ def module_json(request, author, module_name):
     return json_response(module_dict(module))
 
 
+@catalog_condition
 def modules_json(request):
     """
     Provides the `/modules.json` URL expected by `puppet module`.
@@ -78,23 +85,31 @@ def modules_json(request):
                                               name=name)
         else:
             # Otherwise we search other fields.
-            module_qs = (
-                Module.objects.filter(name__icontains=query) |
-                Module.objects.filter(author__name__icontains=query) |
-                Module.objects.filter(releases__version__icontains=query) |
-                Module.objects.filter(tags__icontains=query) |
-                Module.objects.filter(desc__icontains=query)
-            )
+            module_qs = search_modules(query)
     else:
         # No query provided, use all modules.
-        module_qs = Module.objects.all()
-
-    modules = []
-    for module in module_qs.order_by('author__name').distinct():
-        modules.append(module_dict(module))
-    return json_response(modules)
-
-
+        module_qs = Module.objects.order_by('author__name')
+
+    def prepare(qs):
+        # Only the versions of releases other than the current release
+        # are needed.
+        return qs.select_related('author', 'current_release').defer(
+            'current_release__readme', 'current_release__changelog'
+        ).prefetch_related(
+            Prefetch('releases',
+                     queryset=Release.objects.only('module', 'version'))
+        )
+
+    # The list of modules may be very large, so it's loaded in chunks and
+    # streamed to the client as JSON one module at a time.
+    return json_stream_response(
+        module_dict(module)
+        for module in queryset_chunks(module_qs, prepare=prepare)
+    )
+
+
+@catalog_condition
+@cache_response
 def releases_json(request):
     """
     Provides the `/api/v1/releases.json` URL expected by `puppet module`.
@@ -120,9 +135,9 @@ def releases_json(request):
             return error_response('Module %s has no release for version %s' %
                                   (full_name, version), status=410)
     else:
-        release = module.latest_release
+        release = module.current_release
 
     try:
-        return json_response(release_dependencies(release))
+        return json_response(cached_release_dependencies(release))
     except Exception as e:
         return error_response([e], status=410)
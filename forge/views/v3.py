@@ -1,11 +1,17 @@
+import base64
+import hashlib
+import json
 import urllib
 import urlparse
 
-from django.core.paginator import Paginator
+from django.conf import settings
 from django.core.urlresolvers import reverse
+from django.db.models import Q
 
-from .utils import json_response
+from .utils import (cache_response, catalog_condition, catalog_generation,
+                    json_response, response_cache)
 from ..models import Author, Module, Release
+from ..search import search_modules
 
 
 ## Helper methods
@@ -28,12 +34,12 @@ def query_dict(request):
     Returns query dictionary initialized with common parameters to v3 views.
     """
     try:
-        limit = int(request.GET.get('limit', 20))
+        limit = max(int(request.GET.get('limit', 20)), 1)
     except ValueError:
         limit = 20
 
     try:
-        offset = int(request.GET.get('offset', 0))
+        offset = max(int(request.GET.get('offset', 0)), 0)
     except ValueError:
         offset = 0
 
@@ -43,43 +49,152 @@ def query_dict(request):
     }
 
 
-def pagination_data(qs, query, url_name):
+class InvalidCursor(Exception):
+    pass
+
+
+def encode_cursor(values, offset):
+    """
+    Returns an opaque cursor for the page after the row with the given
+    ordering key values, which is at the given offset.
+    """
+    data = json.dumps({'k': values, 'o': offset}, separators=(',', ':'))
+    return base64.urlsafe_b64encode(data).rstrip('=')
+
+
+def decode_cursor(cursor, keys):
+    """
+    Returns a two-tuple of the values of the given ordering keys and the
+    offset in the given cursor, raising `InvalidCursor` if it's not valid.
+    """
+    try:
+        data = json.loads(
+            base64.urlsafe_b64decode(str(cursor) + '=' * (-len(cursor) % 4))
+        )
+        values, offset = data['k'], int(data['o'])
+    except (KeyError, TypeError, ValueError, UnicodeEncodeError):
+        raise InvalidCursor
+    if not isinstance(values, list) or len(values) != len(keys):
+        raise InvalidCursor
+    for key, value in zip(keys, values):
+        # Primary keys are integers, and the other keys are names.
+        if key == 'pk':
+            valid = (isinstance(value, (int, long)) and
+                     not isinstance(value, bool))
+        else:
+            valid = isinstance(value, basestring)
+        if not valid:
+            raise InvalidCursor
+    return values, offset
+
+
+def key_value(obj, key):
+    """
+    Returns the value of an ordering key (e.g., 'author__name') for the
+    given object.
+    """
+    for attr in key.split('__'):
+        obj = getattr(obj, attr)
+    return obj
+
+
+def after_filter(keys, values):
+    """
+    Returns a filter for the rows that come after the given values of the
+    ordering keys, the last of which must be unique.
+    """
+    q = None
+    for i, key in enumerate(keys):
+        conditions = dict(zip(keys[:i], values[:i]))
+        conditions['%s__gt' % key] = values[i]
+        q = Q(**conditions) if q is None else q | Q(**conditions)
+    return q
+
+
+def cached_count(request, qs, query, url_name):
+    """
+    Returns the total number of results for the queryset, which is cached
+    for as long as the catalog generation is the same.
+    """
+    params = sorted((key, unicode(value).encode('utf-8'))
+                    for key, value in query.items()
+                    if key not in ('limit', 'offset'))
+    key = 'forge:count:%s:%d:%s' % (
+        url_name, catalog_generation(request).generation,
+        hashlib.md5(urllib.urlencode(params)).hexdigest()
+    )
+    cache = response_cache()
+    count = cache.get(key)
+    if count is None:
+        count = qs.count()
+        cache.set(key, count,
+                  getattr(settings, 'FORGE_RESPONSE_CACHE_TIMEOUT', 3600))
+    return count
+
+
+def pagination_data(request, qs, query, url_name, keys=None):
     """
-    Returns a two-tuple comprising a Page and dictionary of pagination data
-    corresponding to the given queryset, query parameters, and URL name.
+    Returns a two-tuple comprising the list of results and dictionary of
+    pagination data corresponding to the given queryset, query parameters,
+    and URL name.
+
+    When the ordering `keys` of the queryset are given (the last of which
+    must be unique), the `next` URL has an opaque cursor for the row after
+    the current page instead of an offset, so that the page can be found
+    without scanning the rows before it.  Raises `InvalidCursor` for
+    invalid cursors.
     """
     limit = query['limit']
     offset = query['offset']
 
-    p = Paginator(qs, limit)
-    page_num = (offset / p.per_page) + 1
-    page = p.page(page_num)
+    cursor = request.GET.get('cursor', None)
+    if keys:
+        qs = qs.order_by(*keys)
+        if cursor:
+            values, offset = decode_cursor(cursor, keys)
+            results = list(qs.filter(after_filter(keys, values))[:limit + 1])
+        else:
+            results = list(qs[offset:offset + limit + 1])
+        has_next = len(results) > limit
+        results = results[:limit]
+    else:
+        results = list(qs[offset:offset + limit])
+        has_next = None
+
+    total = cached_count(request, qs, query, url_name)
+    if has_next is None:
+        has_next = offset + limit < total
 
     cur_url = urlparse.urlsplit(reverse(url_name))
+
+    def page_url(page_query):
+        return urlparse.urlunsplit(
+            (cur_url.scheme, cur_url.netloc, cur_url.path,
+             urllib.urlencode(page_query), cur_url.fragment)
+        )
+
     first_query = query.copy()
     first_query['offset'] = 0
-    first_url = urlparse.urlunsplit(
-        (cur_url.scheme, cur_url.netloc, cur_url.path,
-         urllib.urlencode(first_query), cur_url.fragment)
-    )
+    first_url = page_url(first_query)
 
-    if page.has_previous():
+    if offset > 0:
         prev_query = query.copy()
-        prev_query['offset'] = (page_num - 2) * p.per_page
-        prev_url = urlparse.urlunsplit(
-            (cur_url.scheme, cur_url.netloc, cur_url.path,
-             urllib.urlencode(prev_query), cur_url.fragment)
-        )
+        prev_query['offset'] = max(offset - limit, 0)
+        prev_url = page_url(prev_query)
     else:
         prev_url = None
 
-    if page.has_next():
+    if has_next:
         next_query = query.copy()
-        next_query['offset'] = page_num * p.per_page
-        next_url = urlparse.urlunsplit(
-            (cur_url.scheme, cur_url.netloc, cur_url.path,
-             urllib.urlencode(next_query), cur_url.fragment)
-        )
+        if keys:
+            del next_query['offset']
+            next_query['cursor'] = encode_cursor(
+                [key_value(results[-1], key) for key in keys],
+                offset + limit
+            )
+        else:
+            next_query['offset'] = offset + limit
+        next_url = page_url(next_query)
     else:
         next_url = None
 
@@ -89,14 +204,16 @@ def pagination_data(qs, query, url_name):
         'first': first_url,
         'previous': prev_url,
         'next': next_url,
-        'total': p.count,
+        'total': total,
     }
 
-    return page, pagination_dict
+    return results, pagination_dict
 
 
 ## API views
 
+@catalog_condition
+@cache_response
 def modules(request):
     """
     Provides the `/v3/modules` API endpoint.
@@ -104,6 +221,7 @@ def modules(request):
     query = query_dict(request)
 
     q = request.GET.get('query', None)
+    parsed = None
     if q:
         # Client has provided a search query..
         query['query'] = q
@@ -115,36 +233,49 @@ def modules(request):
             qs = Module.objects.filter(author__name=author, name=name)
         else:
             # Otherwise we search other fields.
-            qs = (
-                Module.objects.filter(name__icontains=q) |
-                Module.objects.filter(author__name__icontains=q) |
-                Module.objects.filter(releases__version__icontains=q) |
-                Module.objects.filter(tags__icontains=q) |
-                Module.objects.filter(desc__icontains=q)
-            )
+            qs = search_modules(q)
     else:
         qs = Module.objects.all()
 
-    # Ensure only distinct records are returned.
-    qs = qs.order_by('author__name').distinct()
+    # Search results are ordered by relevance, and paginated by offset;
+    # otherwise modules are ordered by author name, and paginated with
+    # cursors.
+    if q and not parsed:
+        keys = None
+    else:
+        keys = ('author__name', 'pk')
+
+    # Load the authors and current releases needed for serialization
+    # in the same query.
+    qs = qs.select_related('author', 'current_release').defer(
+        'current_release__readme', 'current_release__changelog'
+    )
 
     # Get pagination page and data.
-    page, pagination_dict = pagination_data(qs, query, 'modules_v3')
+    try:
+        results, pagination_dict = pagination_data(request, qs, query,
+                                                   'modules_v3', keys=keys)
+    except InvalidCursor:
+        return error_response(['Invalid cursor'])
 
     modules_data = {
         'pagination': pagination_dict,
-        'results': [module.v3 for module in page.object_list],
+        'results': [module.v3 for module in results],
     }
 
     return json_response(modules_data, indent=2)
 
 
+@catalog_condition
+@cache_response
 def releases(request):
     """
     Provides the `/v3/releases` API endpoint.
     """
     query = query_dict(request)
-    qs = Release.objects.all()
+    qs = Release.objects.select_related('module__author').defer(
+        'readme', 'changelog'
+    )
 
     module_name = request.GET.get('module', None)
     if module_name:
@@ -161,13 +292,34 @@ def releases(request):
                 ["'%s' is not a valid full modulename" % module_name]
             )
 
+    depends_on = request.GET.get('depends_on', None)
+    if depends_on:
+        query['depends_on'] = depends_on
+        parsed = Module.objects.parse_full_name(depends_on)
+        if parsed:
+            # Dependencies may be named in metadata with either separator.
+            author, name = [part.lower() for part in parsed]
+            qs = qs.filter(
+                dependencies__name__in=['%s/%s' % (author, name),
+                                        '%s-%s' % (author, name)]
+            ).distinct()
+        else:
+            return error_response(
+                ["'%s' is not a valid full modulename" % depends_on]
+            )
+
     # Get pagination page and data.
-    page, pagination_dict = pagination_data(qs, query, 'releases_v3')
+    try:
+        results, pagination_dict = pagination_data(request, qs, query,
+                                                   'releases_v3',
+                                                   keys=('pk',))
+    except InvalidCursor:
+        return error_response(['Invalid cursor'])
 
     # Constructing releases_data dictionary for serialization.
     releases_data = {
         'pagination': pagination_dict,
-        'results': [rel.v3 for rel in page.object_list],
+        'results': [rel.v3 for rel in results],
     }
 
     return json_response(releases_data, indent=2)
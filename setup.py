@@ -10,7 +10,7 @@ setup(name='django-forge',
       download_url='http://pypi.python.org/pypi/django-forge/',
       install_requires=[
         'Django>=1.8',
-        'requests>=2',
+        'requests>=2.10',
         'semantic_version>=2.1.2',
       ],
       packages=find_packages(),